@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.utils.metrics.collectors import render_metrics
+
+router = APIRouter(tags=["Мониторинг"])
+
+
+@router.get(
+    "/metrics",
+    summary="Метрики в формате Prometheus",
+    response_class=PlainTextResponse,
+)
+async def get_metrics() -> PlainTextResponse:
+    """
+    ### Метрики процесса в текстовом формате Prometheus.
+
+    Задержки HTTP-обработчиков, этапов обработки платежа и вызовов внешних
+    сервисов, счётчики повторов, глубина фоновых очередей, ожидание и
+    занятость пулов соединений баз данных.
+    """
+    return PlainTextResponse(
+        await render_metrics(), media_type="text/plain; version=0.0.4"
+    )
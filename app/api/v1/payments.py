@@ -1,12 +1,20 @@
 import asyncio
 
-from fastapi import APIRouter, BackgroundTasks, Body, HTTPException, Path
+from fastapi import APIRouter, Body, Header, HTTPException, Path
 
 from app.db.payment_db import async_session as payment_async_session
-from app.db.payment_db import create_payment_record, get_payment_record
+from app.db.payment_db import create_payment_record
+from app.exception.custom_exception import (IdempotencyKeyInProgress,
+                                            IdempotencyKeyMismatch)
 from app.schemas.models import PaymentRequest, PaymentResponse, PaymentStatus
-from app.utils.processes.background import process_payment
-from app.utils.processes.retry import retry_operation
+from app.utils.cache.payment_cache import get_payment_status
+from app.utils.logger import bind_log_context
+from app.utils.processes.background import (PROCESS_PAYMENT_JOB,
+                                            payment_job_payload)
+from app.utils.processes.deadline import deadline
+from app.utils.processes.idempotency import run_idempotent
+from app.utils.processes.jobs import enqueue_job, wake_job_workers
+from app.utils.processes.retry_policy import PAYMENT_DB_WRITE
 
 router = APIRouter(prefix="/api/v1", tags=["Платежи v1"])
 
@@ -30,13 +38,36 @@ router = APIRouter(prefix="/api/v1", tags=["Платежи v1"])
                 }
             },
         },
+        409: {
+            "description": "Запрос с этим ключом идемпотентности ещё выполняется",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Запрос с этим ключом ещё выполняется"}
+                }
+            },
+        },
+        422: {
+            "description": "Ключ идемпотентности использован с другим запросом",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "Ключ идемпотентности использован с другим запросом"
+                    }
+                }
+            },
+        },
     },
 )
 async def create_payment(
     payment_request: PaymentRequest = Body(
         ..., description="Запрос на создание платежа"
     ),
-    background_tasks: BackgroundTasks = None,
+    idempotency_key: str | None = Header(
+        None,
+        alias="Idempotency-Key",
+        max_length=255,
+        description="Ключ идемпотентности: повтор с тем же ключом вернёт исходный ответ",
+    ),
 ) -> PaymentResponse:
     """
     ### Создание платежа
@@ -44,49 +75,80 @@ async def create_payment(
     Принимает запрос в виде модели `PaymentRequest` и возвращает `PaymentResponse`.
 
     **Процесс:**
-    1. Создаётся запись платежа со статусом "processing".
+    1. Создаётся запись платежа со статусом "processing" и, в той же транзакции,
+       задача на его обработку в очереди задач.
     2. Возвращается ответ с идентификатором платежа и статусом "processing".
-    3. В фоне запускается задача для обработки платежа:
+    3. Воркер очереди обрабатывает платёж:
         - Проверяется баланс пользователя.
         - Обновляется запись платежа.
         - Вызываются внешние сервисы.
 
+    Если передан заголовок `Idempotency-Key`, повтор запроса с тем же ключом
+    возвращает исходный ответ и не создаёт второй платёж.
     """
+    if idempotency_key is None:
+        return await _create_payment(payment_request)
 
     try:
-        async with payment_async_session() as payment_session:
-
-            async def create_payment_op():
-                return await create_payment_record(
-                    user_id=payment_request.user_id,
-                    amount=payment_request.amount,
-                    currency=payment_request.currency,
-                    status="processing",
-                    message="Платёж в обработке",
-                    session=payment_session,
-                )
-
-            payment_id = await asyncio.wait_for(
-                retry_operation(
-                    coro=create_payment_op, retries=5, delay=0.2, backoff=2
-                ),
-                timeout=5.0,
-            )
-
-            await payment_session.commit()
+        return await run_idempotent(
+            "v1",
+            idempotency_key,
+            payment_request,
+            lambda: _create_payment(payment_request),
+        )
+    except IdempotencyKeyMismatch:
+        raise HTTPException(
+            status_code=422,
+            detail="Ключ идемпотентности использован с другим запросом",
+        )
+    except IdempotencyKeyInProgress:
+        raise HTTPException(
+            status_code=409, detail="Запрос с этим ключом ещё выполняется"
+        )
+
+
+async def _create_payment(payment_request: PaymentRequest) -> PaymentResponse:
+    bind_log_context(user_id=payment_request.user_id)
+    try:
+        async with deadline(5.0):
+            async with payment_async_session() as payment_session:
+
+                async def create_payment_op():
+                    payment_id = await create_payment_record(
+                        user_id=payment_request.user_id,
+                        amount=payment_request.amount,
+                        currency=payment_request.currency,
+                        status="processing",
+                        message="Платёж в обработке",
+                        session=payment_session,
+                    )
+                    try:
+                        await enqueue_job(
+                            PROCESS_PAYMENT_JOB,
+                            payment_job_payload(
+                                payment_id,
+                                payment_request.user_id,
+                                payment_request.amount,
+                                payment_request.currency,
+                            ),
+                            session=payment_session,
+                        )
+                    except Exception as e:
+                        await payment_session.rollback()
+                        raise e
+                    return payment_id
+
+                payment_id = await PAYMENT_DB_WRITE.run(create_payment_op)
+
+                await payment_session.commit()
 
     except asyncio.TimeoutError:
         raise HTTPException(status_code=503, detail="Сервис временно недоступен")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Неизвестная ошибка: {e}")
 
-    background_tasks.add_task(
-        process_payment,
-        payment_id,
-        payment_request.user_id,
-        payment_request.amount,
-        payment_request.currency,
-    )
+    bind_log_context(payment_id=payment_id)
+    wake_job_workers()
 
     return PaymentResponse(
         payment_id=payment_id, status="processing", message="Платёж в обработке"
@@ -124,7 +186,7 @@ async def get_payment(
 
     **Процесс:**
 
-    1. Поиск записи платежа в базе данных.
+    1. Поиск записи платежа в кэше, при промахе - в базе данных.
     2. Если запись не найдена, возвращается ошибка.
     3. Если запись найдена, возвращается её текущий статус.
 
@@ -134,31 +196,12 @@ async def get_payment(
     - Если время ожидания запроса истекло, возвращается статус 408.
     """
 
-    async with payment_async_session(expire_on_commit=False) as payment_session:
-
-        async def fetch_payment():
-            return await get_payment_record(payment_id, payment_session)
-
-        try:
-            payment = await asyncio.wait_for(
-                retry_operation(fetch_payment, retries=3, delay=0.5, backoff=2),
-                timeout=5.0,
-            )
-
-            if not payment:
-                raise HTTPException(status_code=404, detail="Платёж не найден")
-
-            return PaymentStatus(
-                payment_id=payment.payment_id,
-                user_id=payment.user_id,
-                amount=payment.amount,
-                currency=payment.currency,
-                status=payment.status,
-                bonus=payment.bonus,
-                message=payment.message,
-            )
-
-        except asyncio.TimeoutError:
-            raise HTTPException(
-                status_code=408, detail="Время ожидания запроса истекло"
-            )
+    try:
+        payment = await get_payment_status(payment_id)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=408, detail="Время ожидания запроса истекло")
+
+    if not payment:
+        raise HTTPException(status_code=404, detail="Платёж не найден")
+
+    return payment
@@ -1,19 +1,39 @@
 import asyncio
 from decimal import Decimal
+from typing import AsyncIterator
 
-from fastapi import APIRouter, BackgroundTasks, Body, HTTPException, Path
+from fastapi import APIRouter, Body, Header, HTTPException, Path, Query
+from fastapi.responses import StreamingResponse
 
+from app.config import (PAYMENT_EVENTS_RECHECK_INTERVAL,
+                        PAYMENT_LONG_POLL_MAX_WAIT, PAYMENT_V2_FINALIZE_DELAY,
+                        PAYMENT_V2_LOYALTY_BUDGET)
+from app.db.payment_db import (PAYMENT_FAILED, PAYMENT_PROCESSING,
+                               create_payment_record, create_payment_records)
 from app.db.payment_db import async_session as payment_async_session
-from app.db.payment_db import create_payment_record_v2, get_payment_record
-from app.db.user_db import check_user_data
-from app.exception.custom_exception import NoRetryError
-from app.schemas.models import PaymentRequest, PaymentResponse, PaymentStatus
-from app.utils.logger import logger
-from app.utils.processes.background import finalize_payment
+from app.db.user_db import check_user_data, get_user_balances
+from app.db.user_db import read_router as user_read_router
+from app.exception.custom_exception import (IdempotencyKeyInProgress,
+                                            IdempotencyKeyMismatch,
+                                            NoRetryError)
+from app.schemas.models import (PaymentBatchItem, PaymentBatchRequest,
+                                PaymentBatchResponse, PaymentRequest,
+                                PaymentResponse, PaymentStatus)
+from app.utils.cache.payment_cache import get_payment_status
+from app.utils.events.payment_events import payment_events
+from app.utils.logger import bind_log_context, logger
+from app.utils.metrics.metrics import stage_timer
+from app.utils.processes.background import (FINALIZE_PAYMENT_JOB,
+                                            payment_job_payload)
+from app.utils.processes.deadline import deadline
+from app.utils.processes.idempotency import run_idempotent
+from app.utils.processes.jobs import (cancel_job, enqueue_job, enqueue_jobs,
+                                      release_job, wake_job_workers)
 from app.utils.processes.protected import protected_update_payment_status
-from app.utils.processes.retry import retry_operation
-from app.utils.services.call_services import (call_loyalty_service,
-                                              call_notification_service)
+from app.utils.processes.retry_policy import (LOYALTY_CALL, PAYMENT_DB_WRITE,
+                                              USER_DB_READ)
+from app.utils.services.call_services import call_loyalty_service
+from app.utils.services.notification_dispatcher import dispatch_notification
 
 router = APIRouter(prefix="/api/v2", tags=["Платежи v2"])
 
@@ -47,13 +67,36 @@ router = APIRouter(prefix="/api/v2", tags=["Платежи v2"])
                 }
             },
         },
+        409: {
+            "description": "Запрос с этим ключом идемпотентности ещё выполняется",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Запрос с этим ключом ещё выполняется"}
+                }
+            },
+        },
+        422: {
+            "description": "Ключ идемпотентности использован с другим запросом",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "Ключ идемпотентности использован с другим запросом"
+                    }
+                }
+            },
+        },
     },
 )
 async def create_payment_endpoint(
     payment_request: PaymentRequest = Body(
         ..., description="Запрос на создание платежа"
     ),
-    background_tasks: BackgroundTasks = None,
+    idempotency_key: str | None = Header(
+        None,
+        alias="Idempotency-Key",
+        max_length=255,
+        description="Ключ идемпотентности: повтор с тем же ключом вернёт исходный ответ",
+    ),
 ) -> PaymentResponse:
     """
     ### Создание платежа
@@ -62,75 +105,113 @@ async def create_payment_endpoint(
 
     **Процесс:**
 
-    1. **Параллельное выполнение 4-х операций:**
+    1. **Параллельное выполнение 3-х операций:**
        - Создание записи платежа в базе (с начальным статусом `"processing"` и бонусом 0).
        - Проверка существования пользователя и достаточности его баланса.
-       - Вызов внешнего сервиса лояльности для расчёта бонусов.
-       - Отправка запроса в сервис уведомлений о получении платежа (со статусом `"processing"`).
+       - Вызов внешнего сервиса лояльности для расчёта бонусов. На него
+         отводится не более `PAYMENT_V2_LOYALTY_BUDGET` секунд: если бонусы
+         не рассчитаны, платёж создаётся с нулевым бонусом, а бонусы
+         начисляет фоновая задача.
 
     2. Если пользователь не существует или баланс недостаточен, возвращается ошибка.
-       Если все операции прошли успешно, возвращается статус `"processing"`.
+       Если все операции прошли успешно, уведомление о получении платежа
+       (со статусом `"processing"`) ставится в очередь пакетной отправки
+       и возвращается статус `"processing"`.
 
-    В фоне запускается задача, которая:
+    В очередь задач ставится задача, которая:
        - Вычитает сумму с баланса пользователя,
        - Обновляет запись платежа, записывая рассчитанные бонусы,
        - Отправляет финальное уведомление (успех/неудача).
+
+    Задача создаётся в одной транзакции с платежом, с нулевым бонусом и
+    отложенным на `PAYMENT_V2_FINALIZE_DELAY` секунд запуском. После проверок
+    запрос передаёт в неё рассчитанные бонусы и запускает сразу. Если процесс
+    упадёт раньше, задача всё равно выполнится, а бонусы начислит очередь.
+
+    Если передан заголовок `Idempotency-Key`, повтор запроса с тем же ключом
+    возвращает исходный ответ без повторной проверки пользователя и вызова
+    сервиса лояльности.
     """
+    if idempotency_key is None:
+        return await _create_payment(payment_request)
+
     try:
+        return await run_idempotent(
+            "v2",
+            idempotency_key,
+            payment_request,
+            lambda: _create_payment(payment_request),
+        )
+    except IdempotencyKeyMismatch:
+        raise HTTPException(
+            status_code=422,
+            detail="Ключ идемпотентности использован с другим запросом",
+        )
+    except IdempotencyKeyInProgress:
+        raise HTTPException(
+            status_code=409, detail="Запрос с этим ключом ещё выполняется"
+        )
 
-        async def initial_create_payment():
-            return await create_payment_record_v2(
-                user_id=payment_request.user_id,
-                amount=payment_request.amount,
-                currency=payment_request.currency,
-                status="processing",
-                message="Платёж в обработке",
-            )
 
-        task_create_payment = retry_operation(
-            initial_create_payment,
-            retries=5,
-            delay=0.2,
-            backoff=2,
-        )
+async def _create_payment(payment_request: PaymentRequest) -> PaymentResponse:
+    bind_log_context(user_id=payment_request.user_id)
+    try:
+
+        async def initial_create_payment():
+            async with payment_async_session() as payment_session:
+                try:
+                    payment_id = await create_payment_record(
+                        user_id=payment_request.user_id,
+                        amount=payment_request.amount,
+                        currency=payment_request.currency,
+                        status="processing",
+                        message="Платёж в обработке",
+                        session=payment_session,
+                    )
+                    job_id = await enqueue_job(
+                        FINALIZE_PAYMENT_JOB,
+                        payment_job_payload(
+                            payment_id,
+                            payment_request.user_id,
+                            payment_request.amount,
+                            payment_request.currency,
+                            Decimal("0.00"),
+                        ),
+                        session=payment_session,
+                        delay=PAYMENT_V2_FINALIZE_DELAY,
+                    )
+                    await payment_session.commit()
+                except Exception as e:
+                    await payment_session.rollback()
+                    raise e
+            return payment_id, job_id
+
+        task_create_payment = PAYMENT_DB_WRITE.run(initial_create_payment)
 
         async def initial_check_user():
             return await check_user_data(
                 payment_request.user_id, payment_request.amount
             )
 
-        task_check_user = retry_operation(
-            initial_check_user,
-            retries=5,
-            delay=0.2,
-            backoff=2,
-        )
+        task_check_user = USER_DB_READ.run(initial_check_user)
 
         async def initial_loyalty():
             return await call_loyalty_service(
                 payment_request.user_id,
                 payment_request.amount,
+                hedge=True,
             )
 
-        task_loyalty = retry_operation(
-            initial_loyalty,
-            retries=3,
-            delay=0.2,
-            backoff=2,
-        )
-
-        async def initial_notification():
-            return await call_notification_service(
-                payment_request.user_id, "processing"
-            )
+        async def loyalty_within_budget():
+            async with deadline(PAYMENT_V2_LOYALTY_BUDGET):
+                return await LOYALTY_CALL.run(initial_loyalty)
 
-        task_notification = initial_notification()
+        task_loyalty = loyalty_within_budget()
 
         results = await asyncio.gather(
             task_create_payment,
             task_check_user,
             task_loyalty,
-            task_notification,
             return_exceptions=True,
         )
 
@@ -138,69 +219,278 @@ async def create_payment_endpoint(
             payment_record_result,
             user_check_result,
             loyalty_result,
-            notification_result,
         ) = results
 
     except Exception as e:
-        logger.error(f"Ошибка запуска параллельных операций: {e}")
+        logger.error("Ошибка запуска параллельных операций: %s", e)
         raise HTTPException(status_code=503, detail="Сервис временно недоступен")
 
     # Обработка результатов:
     if isinstance(payment_record_result, Exception):
-        logger.error(f"Ошибка создания платежа: {payment_record_result}")
+        logger.error("Ошибка создания платежа: %s", payment_record_result)
         raise HTTPException(
             status_code=400, detail=f"Ошибка создания платежа: {payment_record_result}"
         )
-    payment_id = payment_record_result
+    payment_id, finalize_job_id = payment_record_result
+    bind_log_context(payment_id=payment_id)
+
+    async def reject_payment(message: str) -> None:
+        # Задача обработки создана вместе с платежом: отклонённый платёж не
+        # должен дойти до списания по её сроку.
+        try:
+            cancelled = await PAYMENT_DB_WRITE.run(lambda: cancel_job(finalize_job_id))
+        except Exception as e:
+            logger.error("Ошибка отмены обработки платежа %s: %s", payment_id, e)
+            cancelled = False
+        if not cancelled:
+            logger.warning("Задача обработки платежа %s не отменена", payment_id)
+        await protected_update_payment_status(payment_id, "failed", message)
 
     if isinstance(user_check_result, NoRetryError):
         logger.error(
-            f"Пользователь не найден или недостаточно средств: {user_check_result}"
+            "Пользователь не найден или недостаточно средств: %s", user_check_result
         )
-        await protected_update_payment_status(
-            payment_id,
-            "field",
-            f"Пользователь не найден или недостаточно средств {user_check_result}",
+        await reject_payment(
+            f"Пользователь не найден или недостаточно средств {user_check_result}"
         )
         raise HTTPException(
             status_code=404, detail="Пользователь не найден или недостаточно средств"
         )
     elif isinstance(user_check_result, Exception):
-        logger.error(f"Ошибка проверки пользователя: {user_check_result}")
-        await protected_update_payment_status(
-            payment_id, "field", f"Ошибка проверки пользователя: {user_check_result}"
-        )
+        logger.error("Ошибка проверки пользователя: %s", user_check_result)
+        await reject_payment(f"Ошибка проверки пользователя: {user_check_result}")
         raise HTTPException(
             status_code=400, detail=f"Ошибка проверки пользователя: {user_check_result}"
         )
 
     bonus = Decimal("0.00")
-    if isinstance(loyalty_result, Exception):
-        logger.error(f"Ошибка расчёта бонусов: {loyalty_result}")
+    if isinstance(loyalty_result, asyncio.TimeoutError):
+        logger.warning(
+            "Бонусы платежа %s не рассчитаны за %s с, будут начислены в фоне",
+            payment_id,
+            PAYMENT_V2_LOYALTY_BUDGET,
+        )
+    elif isinstance(loyalty_result, Exception):
+        logger.error("Ошибка расчёта бонусов: %s", loyalty_result)
     else:
         bonus = Decimal(loyalty_result.get("bonus", 0))
 
-    logger.info(f"Notification result: {notification_result}")
+    dispatch_notification(payment_request.user_id, "processing")
 
-    response = PaymentResponse(
+    async def release_finalize():
+        return await release_job(
+            finalize_job_id,
+            payment_job_payload(
+                payment_id,
+                payment_request.user_id,
+                payment_request.amount,
+                payment_request.currency,
+                bonus,
+            ),
+        )
+
+    # Платёж уже в очереди: если запустить задачу сразу не удалось, она
+    # выполнится по сроку, а бонусы начислит очередь.
+    try:
+        released = await PAYMENT_DB_WRITE.run(release_finalize)
+    except Exception as e:
+        logger.error("Ошибка запуска обработки платежа %s: %s", payment_id, e)
+        released = False
+    if not released:
+        logger.warning(
+            "Бонусы платежа %s не переданы в задачу обработки, будут начислены в фоне",
+            payment_id,
+        )
+
+    return PaymentResponse(
         payment_id=payment_id,
         status="processing",
         message="Платёж в обработке",
     )
 
-    if background_tasks is None:
-        background_tasks = BackgroundTasks()
 
-    background_tasks.add_task(
-        finalize_payment,
-        payment_id,
-        payment_request.user_id,
-        payment_request.amount,
-        payment_request.currency,
-        bonus,
-    )
+@router.post(
+    "/payments/batch",
+    response_model=PaymentBatchResponse,
+    summary="Создать пакет платежей",
+    responses={
+        503: {
+            "description": "Сервис недоступен",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Сервис временно недоступен"}
+                }
+            },
+        },
+        409: {
+            "description": "Запрос с этим ключом идемпотентности ещё выполняется",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Запрос с этим ключом ещё выполняется"}
+                }
+            },
+        },
+        422: {
+            "description": "Ошибка валидации пакета или ключ идемпотентности использован с другим запросом",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "Ключ идемпотентности использован с другим запросом"
+                    }
+                }
+            },
+        },
+    },
+)
+async def create_payment_batch_endpoint(
+    batch_request: PaymentBatchRequest = Body(
+        ..., description="Пакет платежей"
+    ),
+    idempotency_key: str | None = Header(
+        None,
+        alias="Idempotency-Key",
+        max_length=255,
+        description="Ключ идемпотентности: повтор с тем же ключом вернёт исходный ответ",
+    ),
+) -> PaymentBatchResponse:
+    """
+    ### Пакетное создание платежей
+
+    Пакет проверяется целиком до обращения к базам: если хотя бы один платёж
+    не проходит валидацию, отклоняется весь пакет (422).
 
-    return response
+    **Процесс:**
+
+    1. Балансы всех пользователей пакета читаются одним запросом. Платежи
+       пользователя проверяются по порядку: платёж отклоняется, если
+       пользователь не найден или баланса не хватает с учётом его
+       предыдущих платежей в пакете.
+    2. Все платежи записываются одним многострочным
+       `INSERT ... RETURNING payment_id`: принятые со статусом `"processing"`,
+       отклонённые - со статусом `"failed"`. В той же транзакции для
+       принятых платежей в очередь ставятся задачи финальной обработки:
+       списание, начисление бонусов и итоговое уведомление.
+    3. Уведомления о получении платежей ставятся в очередь пакетной отправки.
+
+    Возвращает результат каждого платежа в порядке запроса. Если передан
+    заголовок `Idempotency-Key`, повтор с тем же ключом возвращает исходный
+    ответ и не создаёт платежи повторно.
+    """
+    if idempotency_key is None:
+        return await _create_payment_batch(batch_request)
+
+    try:
+        return await run_idempotent(
+            "v2-batch",
+            idempotency_key,
+            batch_request,
+            lambda: _create_payment_batch(batch_request),
+            PaymentBatchResponse,
+        )
+    except IdempotencyKeyMismatch:
+        raise HTTPException(
+            status_code=422,
+            detail="Ключ идемпотентности использован с другим запросом",
+        )
+    except IdempotencyKeyInProgress:
+        raise HTTPException(
+            status_code=409, detail="Запрос с этим ключом ещё выполняется"
+        )
+
+
+async def _create_payment_batch(
+    batch_request: PaymentBatchRequest,
+) -> PaymentBatchResponse:
+    payments = batch_request.payments
+    user_ids = sorted({payment.user_id for payment in payments})
+
+    # Предварительная проверка допускает отставание: окончательно баланс
+    # проверяет списание в основной базе.
+    replica = user_read_router.use_replica(*user_ids)
+
+    async def read_balances():
+        async with user_read_router.session(replica) as session:
+            return await get_user_balances(user_ids, session)
+
+    try:
+        balances = await USER_DB_READ.run(read_balances)
+    except Exception as e:
+        logger.error("Ошибка чтения балансов пакета платежей: %s", e)
+        raise HTTPException(status_code=503, detail="Сервис временно недоступен")
+
+    rows = []
+    for payment in payments:
+        balance = balances.get(payment.user_id)
+        if balance is None:
+            status, message = PAYMENT_FAILED, "Пользователь не найден"
+        elif balance < payment.amount:
+            status, message = PAYMENT_FAILED, "Недостаточно средств"
+        else:
+            balances[payment.user_id] = balance - payment.amount
+            status, message = PAYMENT_PROCESSING, "Платёж в обработке"
+        rows.append(
+            {
+                "user_id": payment.user_id,
+                "amount": payment.amount,
+                "currency": payment.currency,
+                "status": status,
+                "message": message,
+            }
+        )
+
+    async def create_batch():
+        async with payment_async_session() as session:
+            try:
+                payment_ids = await create_payment_records(rows, session)
+                payloads = [
+                    payment_job_payload(
+                        payment_id,
+                        payment.user_id,
+                        payment.amount,
+                        payment.currency,
+                        Decimal("0.00"),
+                    )
+                    for payment_id, payment, row in zip(payment_ids, payments, rows)
+                    if row["status"] == PAYMENT_PROCESSING
+                ]
+                if payloads:
+                    await enqueue_jobs(FINALIZE_PAYMENT_JOB, payloads, session)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+        return payment_ids
+
+    try:
+        with stage_timer("batch_create"):
+            payment_ids = await PAYMENT_DB_WRITE.run(create_batch)
+    except Exception as e:
+        logger.error("Ошибка создания пакета платежей: %s", e)
+        raise HTTPException(status_code=503, detail="Сервис временно недоступен")
+    wake_job_workers()
+
+    results = []
+    for index, (payment_id, row) in enumerate(zip(payment_ids, rows)):
+        if row["status"] == PAYMENT_PROCESSING:
+            dispatch_notification(row["user_id"], PAYMENT_PROCESSING)
+        results.append(
+            PaymentBatchItem(
+                index=index,
+                payment_id=payment_id,
+                status=row["status"],
+                message=row["message"],
+            )
+        )
+    accepted = sum(1 for row in rows if row["status"] == PAYMENT_PROCESSING)
+    logger.info(
+        "Пакет из %s платежей создан: принято %s, отклонено %s",
+        len(rows),
+        accepted,
+        len(rows) - accepted,
+    )
+    return PaymentBatchResponse(
+        accepted=accepted, rejected=len(rows) - accepted, results=results
+    )
 
 
 @router.get(
@@ -225,7 +515,13 @@ async def create_payment_endpoint(
     },
 )
 async def get_payment(
-    payment_id: int = Path(..., description="Уникальный идентификатор платежа")
+    payment_id: int = Path(..., description="Уникальный идентификатор платежа"),
+    wait: float = Query(
+        0,
+        ge=0,
+        le=PAYMENT_LONG_POLL_MAX_WAIT,
+        description="Сколько секунд ждать завершения платежа (long-poll)",
+    ),
 ) -> PaymentStatus:
     """
     ### Получение состояния платежа по его ID.
@@ -234,41 +530,115 @@ async def get_payment(
 
     **Процесс:**
 
-    1. Поиск записи платежа в базе данных.
+    1. Поиск записи платежа в кэше, при промахе - в базе данных.
     2. Если запись не найдена, возвращается ошибка.
-    3. Если запись найдена, возвращается её текущий статус.
+    3. Если платёж в статусе `"processing"` и передан `wait`, ответ задерживается
+       до изменения статуса, но не дольше `wait` секунд.
+    4. Возвращается текущий статус платежа.
 
     **Ошибки:**
 
     - Если запись не найдена, возвращается статус 404.
     - Если время ожидания запроса истекло, возвращается статус 408.
     """
+    loop = asyncio.get_running_loop()
+    wait_until = loop.time() + wait
+    while True:
+        subscription = payment_events.subscribe(payment_id)
+        # Подписка снимается при любом выходе, в том числе при ошибке чтения
+        # статуса и отмене запроса после отключения клиента.
+        try:
+            try:
+                payment = await get_payment_status(payment_id)
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=408, detail="Время ожидания запроса истекло"
+                )
+
+            remaining = wait_until - loop.time()
+            if not payment or payment.status != "processing" or remaining <= 0:
+                break
+            await payment_events.wait(
+                payment_id,
+                subscription,
+                min(remaining, PAYMENT_EVENTS_RECHECK_INTERVAL),
+            )
+        finally:
+            payment_events.unsubscribe(payment_id, subscription)
 
-    async with payment_async_session(expire_on_commit=False) as payment_session:
+    if not payment:
+        raise HTTPException(status_code=404, detail="Платёж не найден")
 
-        async def fetch_payment():
-            return await get_payment_record(payment_id, payment_session)
+    return payment
 
+
+async def _payment_event_stream(payment_id: int) -> AsyncIterator[str]:
+    last_snapshot = None
+    while True:
+        subscription = payment_events.subscribe(payment_id)
+        # Подписка снимается и при отключении клиента на `yield`, и при
+        # ошибке чтения статуса, иначе она висела бы до следующего события.
         try:
-            payment = await asyncio.wait_for(
-                retry_operation(fetch_payment, retries=3, delay=0.5, backoff=2),
-                timeout=5.0,
+            try:
+                payment = await get_payment_status(payment_id)
+            except asyncio.TimeoutError:
+                payment = None
+
+            if payment is not None:
+                snapshot = payment.model_dump_json()
+                if snapshot != last_snapshot:
+                    last_snapshot = snapshot
+                    yield f"event: status\ndata: {snapshot}\n\n"
+                if payment.status != "processing":
+                    return
+
+            changed = await payment_events.wait(
+                payment_id, subscription, PAYMENT_EVENTS_RECHECK_INTERVAL
             )
+            if not changed:
+                yield ": keep-alive\n\n"
+        finally:
+            payment_events.unsubscribe(payment_id, subscription)
 
-            if not payment:
-                raise HTTPException(status_code=404, detail="Платёж не найден")
-
-            return PaymentStatus(
-                payment_id=payment.payment_id,
-                user_id=payment.user_id,
-                amount=payment.amount,
-                currency=payment.currency,
-                status=payment.status,
-                bonus=payment.bonus,
-                message=payment.message,
-            )
 
-        except asyncio.TimeoutError:
-            raise HTTPException(
-                status_code=408, detail="Время ожидания запроса истекло"
-            )
+@router.get(
+    "/payments/{payment_id}/events",
+    summary="Подписаться на изменения статуса платежа",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"text/event-stream": {}}},
+        404: {
+            "description": "Платёж не найден",
+            "content": {
+                "application/json": {"example": {"detail": "Платёж не найден"}}
+            },
+        },
+    },
+)
+async def get_payment_events(
+    payment_id: int = Path(..., description="Уникальный идентификатор платежа")
+) -> StreamingResponse:
+    """
+    ### Поток изменений статуса платежа (Server-Sent Events).
+
+    Отправляет событие `status` с текущим состоянием платежа (модель
+    `PaymentStatus`) сразу после подключения и при каждом изменении статуса.
+    Поток закрывается, когда платёж переходит в итоговый статус.
+
+    **Ошибки:**
+
+    - Если запись не найдена, возвращается статус 404.
+    - Если время ожидания запроса истекло, возвращается статус 408.
+    """
+    try:
+        payment = await get_payment_status(payment_id)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=408, detail="Время ожидания запроса истекло")
+    if not payment:
+        raise HTTPException(status_code=404, detail="Платёж не найден")
+
+    return StreamingResponse(
+        _payment_event_stream(payment_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -6,11 +6,25 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-def build_db_url(db_name):
+def env_bool(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def build_db_url(db_name, host=None, port=None):
+    if STORAGE_BACKEND == "sqlite":
+        return f"sqlite+aiosqlite:///{os.path.join(SQLITE_DIR, db_name)}.sqlite3"
+    if STORAGE_BACKEND == "memory":
+        # memdb - общая для соединений процесса база в памяти с обычными
+        # блокировками SQLite (в отличие от shared cache).
+        return f"sqlite+aiosqlite:///file:/{db_name}?vfs=memdb&uri=true"
+    if STORAGE_BACKEND != "postgres":
+        raise ValueError(f"Неизвестный STORAGE_BACKEND: {STORAGE_BACKEND}")
+    host = host or DATABASE_HOST
+    port = port or DATABASE_PORT
     return urlunparse(
         (
             "postgresql+asyncpg",
-            f"{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}",
+            f"{DATABASE_USER}:{DATABASE_PASSWORD}@{host}:{port}",
             f"/{db_name}",
             "",
             "",
@@ -19,6 +33,10 @@ def build_db_url(db_name):
     )
 
 
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_DIR = os.getenv("SQLITE_DIR", "data")
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
 DATABASE_HOST = os.getenv("DATABASE_HOST", "localhost")
 DATABASE_PORT = os.getenv("DATABASE_PORT", "5432")
 PAYMENT_DB = os.getenv("DATABASE_PAYMENT_NAME", "payment_db")
@@ -27,10 +45,36 @@ DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD", default="testpass")
 DATABASE_USER = os.getenv("DATABASE_USER", "testuser")
 
 PAYMENT_DATABASE_URL = build_db_url(PAYMENT_DB)
-PAYMENT_DATABASE_URL_SYNC = PAYMENT_DATABASE_URL.replace("+asyncpg", "")
+PAYMENT_DATABASE_URL_SYNC = PAYMENT_DATABASE_URL.replace("+asyncpg", "").replace(
+    "+aiosqlite", ""
+)
 
 USER_DATABASE_URL = build_db_url(USER_DB)
-USER_DATABASE_URL_SYNC = USER_DATABASE_URL.replace("+asyncpg", "")
+USER_DATABASE_URL_SYNC = USER_DATABASE_URL.replace("+asyncpg", "").replace(
+    "+aiosqlite", ""
+)
+
+# Реплика для чтений, допускающих отставание. Без DATABASE_REPLICA_HOST (и для
+# SQLite) все чтения идут в основную базу.
+DATABASE_REPLICA_HOST = os.getenv("DATABASE_REPLICA_HOST", "")
+DATABASE_REPLICA_PORT = os.getenv("DATABASE_REPLICA_PORT", DATABASE_PORT)
+REPLICA_ENABLED = bool(DATABASE_REPLICA_HOST) and STORAGE_BACKEND == "postgres"
+PAYMENT_DATABASE_REPLICA_URL = (
+    build_db_url(PAYMENT_DB, DATABASE_REPLICA_HOST, DATABASE_REPLICA_PORT)
+    if REPLICA_ENABLED
+    else ""
+)
+USER_DATABASE_REPLICA_URL = (
+    build_db_url(USER_DB, DATABASE_REPLICA_HOST, DATABASE_REPLICA_PORT)
+    if REPLICA_ENABLED
+    else ""
+)
+REPLICA_POOL_SIZE = int(os.getenv("REPLICA_POOL_SIZE", "15"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "1.0"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "1.0"))
+REPLICA_READ_YOUR_WRITES_WINDOW = float(
+    os.getenv("REPLICA_READ_YOUR_WRITES_WINDOW", "5.0")
+)
 
 
 LOYALTY_HOST = os.getenv("LOYALTY_HOST", "localhost")
@@ -39,4 +83,104 @@ NOTIFICATION_HOST = os.getenv("NOTIFICATION_HOST", "localhost")
 NOTIFICATION_PORT = int(os.getenv("NOTIFICATION_PORT", "8002"))
 
 LOYALTY_SERVICE_URL = f"http://{LOYALTY_HOST}:{LOYALTY_PORT}/loyalty"
+LOYALTY_BATCH_SERVICE_URL = f"{LOYALTY_SERVICE_URL}/batch"
 NOTIFICATION_SERVICE_URL = f"http://{NOTIFICATION_HOST}:{NOTIFICATION_PORT}/notify"
+NOTIFICATION_BATCH_SERVICE_URL = f"{NOTIFICATION_SERVICE_URL}/batch"
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "1.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5.0"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "5.0"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "1.0"))
+HTTP2_ENABLED = env_bool("HTTP2_ENABLED")
+
+JOB_WORKER_ENABLED = env_bool("JOB_WORKER_ENABLED", "true")
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "20"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "10"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "0.5"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "2"))
+JOB_MAX_RETRY_DELAY = float(os.getenv("JOB_MAX_RETRY_DELAY", "120"))
+
+RETRY_SCHEDULER_MAX_PENDING = int(os.getenv("RETRY_SCHEDULER_MAX_PENDING", "10000"))
+RETRY_SCHEDULER_CONCURRENCY = int(os.getenv("RETRY_SCHEDULER_CONCURRENCY", "50"))
+
+CIRCUIT_BREAKER_WINDOW_SIZE = int(os.getenv("CIRCUIT_BREAKER_WINDOW_SIZE", "20"))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "10"))
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+CIRCUIT_BREAKER_SLOW_CALL_RATE = float(
+    os.getenv("CIRCUIT_BREAKER_SLOW_CALL_RATE", "0.5")
+)
+CIRCUIT_BREAKER_SLOW_CALL_DURATION = float(
+    os.getenv("CIRCUIT_BREAKER_SLOW_CALL_DURATION", "2.0")
+)
+CIRCUIT_BREAKER_OPEN_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_OPEN_TIMEOUT", "15"))
+CIRCUIT_BREAKER_HALF_OPEN_CALLS = int(
+    os.getenv("CIRCUIT_BREAKER_HALF_OPEN_CALLS", "3")
+)
+
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "100"))
+NOTIFICATION_BATCH_INTERVAL = float(os.getenv("NOTIFICATION_BATCH_INTERVAL", "0.05"))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "10000"))
+NOTIFICATION_OVERFLOW_POLICY = os.getenv("NOTIFICATION_OVERFLOW_POLICY", "drop_oldest")
+
+LOYALTY_BATCH_ENABLED = env_bool("LOYALTY_BATCH_ENABLED", "true")
+LOYALTY_BATCH_SIZE = int(os.getenv("LOYALTY_BATCH_SIZE", "50"))
+LOYALTY_BATCH_LINGER = float(os.getenv("LOYALTY_BATCH_LINGER", "0.005"))
+
+PAYMENT_CACHE_MAX_SIZE = int(os.getenv("PAYMENT_CACHE_MAX_SIZE", "10000"))
+PAYMENT_CACHE_TTL = float(os.getenv("PAYMENT_CACHE_TTL", "1.0"))
+
+PAYMENT_LONG_POLL_MAX_WAIT = float(os.getenv("PAYMENT_LONG_POLL_MAX_WAIT", "30"))
+PAYMENT_EVENTS_RECHECK_INTERVAL = float(
+    os.getenv("PAYMENT_EVENTS_RECHECK_INTERVAL", "15")
+)
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "10"))
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+
+LOYALTY_HEDGE_ENABLED = env_bool("LOYALTY_HEDGE_ENABLED", "true")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "1.0"))
+HEDGE_MAX_ATTEMPTS = int(os.getenv("HEDGE_MAX_ATTEMPTS", "2"))
+HEDGE_WINDOW_SIZE = int(os.getenv("HEDGE_WINDOW_SIZE", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+PAYMENT_V2_LOYALTY_BUDGET = float(os.getenv("PAYMENT_V2_LOYALTY_BUDGET", "1.0"))
+PAYMENT_V2_FINALIZE_DELAY = float(os.getenv("PAYMENT_V2_FINALIZE_DELAY", "5.0"))
+
+PAYMENT_BATCH_MAX_SIZE = int(os.getenv("PAYMENT_BATCH_MAX_SIZE", "5000"))
+
+PAYMENT_STATUS_WRITE_BEHIND = env_bool("PAYMENT_STATUS_WRITE_BEHIND")
+PAYMENT_STATUS_FLUSH_INTERVAL = float(os.getenv("PAYMENT_STATUS_FLUSH_INTERVAL", "0.005"))
+PAYMENT_STATUS_FLUSH_SIZE = int(os.getenv("PAYMENT_STATUS_FLUSH_SIZE", "500"))
+PAYMENT_STATUS_BUFFER_SIZE = int(os.getenv("PAYMENT_STATUS_BUFFER_SIZE", "10000"))
+
+USER_BALANCE_MODE = os.getenv("USER_BALANCE_MODE", "column").lower()
+LEDGER_SNAPSHOT_INTERVAL = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "100"))
+# Число шардов баланса по кошелькам: "user_id:shards,user_id:shards".
+WALLET_SHARDS = {
+    int(user_id): int(shards)
+    for user_id, shards in (
+        item.split(":") for item in os.getenv("WALLET_SHARDS", "").split(",") if item.strip()
+    )
+}
+
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "10"))
+RETRY_BUDGET_CAPACITY = float(os.getenv("RETRY_BUDGET_CAPACITY", "100"))
+
+FAULT_PROFILE = os.getenv("FAULT_PROFILE", "flaky")
+FAULT_PROFILES_FILE = os.getenv("FAULT_PROFILES_FILE", "")
+FAULT_SEED = int(os.getenv("FAULT_SEED")) if os.getenv("FAULT_SEED") else None
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "10"))
+LOG_RATE_INTERVAL = float(os.getenv("LOG_RATE_INTERVAL", "1.0"))
@@ -0,0 +1,109 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy_utils import create_database, database_exists
+
+from app.config import SQLITE_BUSY_TIMEOUT, SQLITE_DIR, STORAGE_BACKEND
+from app.utils.faults.db import install_db_faults
+from app.utils.logger import logger
+from app.utils.metrics.pool import register_pool_metrics, timed_pool_class
+
+POSTGRES = "postgresql"
+SQLITE = "sqlite"
+
+# Опция выполнения движка: его транзакции только читают.
+READ_ONLY = "read_only"
+
+
+def create_db_engine(url: str, name: str, pool_size: int = 15) -> AsyncEngine:
+    """
+    ### Создаёт асинхронный движок базы для выбранного `STORAGE_BACKEND`.
+
+    Движок получает пул с метриками ожидания соединений и профиль отказов
+    базы `<name>_db`.
+
+    ### Параметры:
+    - **url**: Адрес базы из `app.config`.
+    - **name**: Имя пула в метриках (`payment`, `user`, `payment_replica`,
+      `user_replica`).
+    - **pool_size**: Размер пула соединений.
+    """
+    engine = create_async_engine(
+        url,
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=0,
+        poolclass=timed_pool_class(name),
+    )
+    if engine.dialect.name == SQLITE:
+        _configure_sqlite(engine)
+    register_pool_metrics(name, engine)
+    install_db_faults(f"{name}_db", engine)
+    return engine
+
+
+def read_only_engine(engine: AsyncEngine) -> AsyncEngine:
+    """
+    ### Движок для сессий, которые только читают.
+
+    Делит пул с `engine`. В SQLite его транзакции открываются обычным
+    `BEGIN` и не ждут блокировку записи (см. `_configure_sqlite`).
+    """
+    return engine.execution_options(**{READ_ONLY: True})
+
+
+def _configure_sqlite(engine: AsyncEngine) -> None:
+    """
+    ### Настраивает соединения SQLite для конкурентной работы.
+
+    Пишущие транзакции открываются `BEGIN IMMEDIATE`: SQLite допускает
+    одного писателя, и транзакция, начавшаяся чтением, не смогла бы позже
+    получить блокировку записи. Транзакции движка `read_only_engine`
+    открываются `BEGIN`: в режиме WAL они читают снимок параллельно с
+    писателем. Ожидание блокировки ограничено `SQLITE_BUSY_TIMEOUT`.
+    """
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # Транзакциями управляет обработчик begin, а не драйвер.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}")
+        if STORAGE_BACKEND == "sqlite":
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def on_begin(conn):
+        if conn.get_execution_options().get(READ_ONLY):
+            conn.exec_driver_sql("BEGIN")
+        else:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def ensure_database(sync_url: str, name: str) -> None:
+    """
+    ### Создаёт базу, если её ещё нет.
+
+    Для `sqlite` создаётся каталог `SQLITE_DIR`, файл базы появляется при
+    первом подключении. База `memory` живёт, пока открыто хотя бы одно
+    соединение процесса.
+    """
+    if STORAGE_BACKEND == "memory":
+        return
+    if STORAGE_BACKEND == "sqlite":
+        os.makedirs(SQLITE_DIR, exist_ok=True)
+        return
+    if not database_exists(sync_url):
+        logger.info("База данных %s не найдена. Создаём базу...", name)
+        create_database(sync_url)
+        logger.info("База данных %s успешно создана.", name)
+
+
+def dialect_name(session: AsyncSession) -> str:
+    """
+    ### Диалект базы сессии: `postgresql` или `sqlite`.
+    """
+    return session.get_bind().dialect.name
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import JSON, DateTime, Integer, String, delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.engine import POSTGRES, SQLITE, dialect_name
+from app.db.payment_db import Base, engine, utcnow
+
+# INSERT ... ON CONFLICT DO NOTHING есть в обоих диалектах, но строится
+# конструктором своего диалекта.
+_INSERTS = {POSTGRES: postgresql.insert, SQLITE: sqlite.insert}
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    request_hash: Mapped[str] = mapped_column(String, nullable=False)
+    payment_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    response: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(IdempotencyKey.__table__.create, checkfirst=True)
+
+
+async def claim_idempotency_key(
+    key: str, request_hash: str, lock_timeout: float, session: AsyncSession
+) -> bool:
+    """
+    ### Захватывает ключ идемпотентности для выполнения запроса.
+
+    Ключ захватывается, если его ещё нет, или если предыдущий владелец не
+    сохранил ответ за `lock_timeout` секунд (например, процесс упал).
+
+    ### Возвращает:
+    - `True`, если ключ захвачен текущим запросом.
+    """
+    now = utcnow()
+    insert = _INSERTS[dialect_name(session)]
+    result = await session.execute(
+        insert(IdempotencyKey)
+        .values(key=key, request_hash=request_hash, created_at=now)
+        .on_conflict_do_nothing(index_elements=[IdempotencyKey.key])
+        .returning(IdempotencyKey.key)
+    )
+    if result.scalar_one_or_none() is not None:
+        return True
+
+    result = await session.execute(
+        update(IdempotencyKey)
+        .where(
+            IdempotencyKey.key == key,
+            IdempotencyKey.request_hash == request_hash,
+            IdempotencyKey.response.is_(None),
+            IdempotencyKey.created_at < now - timedelta(seconds=lock_timeout),
+        )
+        .values(created_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def get_idempotency_key(
+    key: str, session: AsyncSession
+) -> IdempotencyKey | None:
+    result = await session.execute(
+        select(IdempotencyKey).where(IdempotencyKey.key == key)
+    )
+    return result.scalar_one_or_none()
+
+
+async def save_idempotent_response(
+    key: str, payment_id: int | None, response: dict, session: AsyncSession
+) -> None:
+    await session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key)
+        .values(payment_id=payment_id, response=response)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def release_idempotency_key(key: str, session: AsyncSession) -> None:
+    """
+    ### Освобождает ключ, запрос по которому завершился ошибкой.
+    """
+    await session.execute(
+        delete(IdempotencyKey).where(
+            IdempotencyKey.key == key, IdempotencyKey.response.is_(None)
+        )
+    )
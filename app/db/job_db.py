@@ -0,0 +1,249 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import (JSON, DateTime, Index, Integer, String, and_, delete,
+                        func, insert, or_, select, update)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.payment_db import Base, engine, utcnow
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DEAD = "dead"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+    job_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    status: Mapped[str] = mapped_column(String, nullable=False, default=JOB_PENDING)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    max_attempts: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    run_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    locked_until: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    last_error: Mapped[str | None] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Job.__table__.create, checkfirst=True)
+
+
+async def enqueue_job(
+    kind: str,
+    payload: dict,
+    session: AsyncSession,
+    max_attempts: int | None = None,
+    delay: float = 0.0,
+) -> int:
+    """
+    ### Добавляет задачу в очередь в рамках переданной сессии.
+
+    Задача фиксируется вместе с остальными изменениями сессии, поэтому запись
+    платежа и задача на его обработку сохраняются атомарно.
+
+    ### Параметры:
+    - **kind**: Тип задачи (имя обработчика).
+    - **payload**: JSON-параметры задачи.
+    - **max_attempts**: Максимальное число попыток, `None` - без ограничений.
+    - **delay**: Задержка перед первым запуском в секундах.
+    """
+    now = utcnow()
+    result = await session.execute(
+        insert(Job)
+        .values(
+            kind=kind,
+            payload=payload,
+            status=JOB_PENDING,
+            attempts=0,
+            max_attempts=max_attempts,
+            run_at=now + timedelta(seconds=delay),
+            created_at=now,
+        )
+        .returning(Job.job_id)
+    )
+    return result.scalar_one()
+
+
+async def enqueue_jobs(
+    kind: str,
+    payloads: list[dict],
+    session: AsyncSession,
+    max_attempts: int | None = None,
+) -> list[int]:
+    """
+    ### Добавляет пачку задач одного типа многострочным `INSERT`.
+
+    Как и `enqueue_job`, задачи фиксируются вместе с остальными изменениями сессии.
+    """
+    now = utcnow()
+    result = await session.execute(
+        insert(Job).returning(Job.job_id, sort_by_parameter_order=True),
+        [
+            dict(
+                kind=kind,
+                payload=payload,
+                status=JOB_PENDING,
+                attempts=0,
+                max_attempts=max_attempts,
+                run_at=now,
+                created_at=now,
+            )
+            for payload in payloads
+        ],
+    )
+    return list(result.scalars())
+
+
+async def claim_jobs(
+    session: AsyncSession, limit: int, visibility_timeout: float
+) -> list[Job]:
+    """
+    ### Забирает пачку готовых к выполнению задач.
+
+    Кандидаты выбираются с `FOR UPDATE SKIP LOCKED`, поэтому несколько
+    воркеров не блокируют друг друга и не получают одну и ту же задачу.
+    В SQLite `FOR UPDATE` не поддерживается: там выборку сериализует
+    блокировка записи транзакции.
+    Задачи, чей `locked_until` истёк (воркер упал), забираются повторно.
+    """
+    now = utcnow()
+    candidates = (
+        select(Job.job_id)
+        .where(
+            or_(
+                and_(Job.status == JOB_PENDING, Job.run_at <= now),
+                and_(Job.status == JOB_RUNNING, Job.locked_until < now),
+            )
+        )
+        .order_by(Job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(Job)
+        .where(Job.job_id.in_(candidates.scalar_subquery()))
+        .values(
+            status=JOB_RUNNING,
+            attempts=Job.attempts + 1,
+            locked_until=now + timedelta(seconds=visibility_timeout),
+        )
+        .returning(Job)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars().all())
+
+
+async def complete_job(job_id: int, attempts: int, session: AsyncSession) -> bool:
+    """
+    ### Удаляет выполненную задачу.
+
+    `attempts` служит маркером владения: если задачу уже забрал другой воркер
+    после истечения таймаута видимости, удаление не применяется.
+    """
+    result = await session.execute(
+        delete(Job).where(
+            Job.job_id == job_id,
+            Job.status == JOB_RUNNING,
+            Job.attempts == attempts,
+        )
+    )
+    return result.rowcount == 1
+
+
+async def fail_job(
+    job_id: int,
+    attempts: int,
+    error: str,
+    retry_delay: float | None,
+    session: AsyncSession,
+) -> bool:
+    """
+    ### Фиксирует ошибку выполнения задачи.
+
+    При `retry_delay=None` задача помечается как `dead`, иначе возвращается
+    в очередь с запуском через `retry_delay` секунд.
+    """
+    if retry_delay is None:
+        values = dict(status=JOB_DEAD, locked_until=None, last_error=error)
+    else:
+        values = dict(
+            status=JOB_PENDING,
+            locked_until=None,
+            last_error=error,
+            run_at=utcnow() + timedelta(seconds=retry_delay),
+        )
+    result = await session.execute(
+        update(Job)
+        .where(
+            Job.job_id == job_id,
+            Job.status == JOB_RUNNING,
+            Job.attempts == attempts,
+        )
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def release_job(job_id: int, payload: dict, session: AsyncSession) -> bool:
+    """
+    ### Заменяет параметры отложенной задачи и делает её готовой к запуску.
+
+    Применяется, только пока задача ни разу не выбиралась воркером.
+
+    ### Возвращает:
+    - `True`, если задача обновлена.
+    """
+    result = await session.execute(
+        update(Job)
+        .where(Job.job_id == job_id, Job.status == JOB_PENDING, Job.attempts == 0)
+        .values(payload=payload, run_at=utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def cancel_job(job_id: int, session: AsyncSession) -> bool:
+    """
+    ### Удаляет отложенную задачу, пока она ни разу не выбиралась воркером.
+
+    ### Возвращает:
+    - `True`, если задача удалена.
+    """
+    result = await session.execute(
+        delete(Job).where(
+            Job.job_id == job_id, Job.status == JOB_PENDING, Job.attempts == 0
+        )
+    )
+    return result.rowcount == 1
+
+
+async def get_queue_stats(session: AsyncSession) -> dict:
+    """
+    ### Возвращает число задач по статусам и возраст самой старой ожидающей задачи.
+    """
+    result = await session.execute(
+        select(Job.status, func.count(), func.min(Job.created_at)).group_by(
+            Job.status
+        )
+    )
+    stats = {"pending": 0, "running": 0, "dead": 0, "oldest_pending_age": 0.0}
+    oldest = None
+    for status, count, created_at in result.all():
+        stats[status] = count
+        if status in (JOB_PENDING, JOB_RUNNING) and created_at is not None:
+            oldest = created_at if oldest is None else min(oldest, created_at)
+    if oldest is not None:
+        if oldest.tzinfo is None:
+            oldest = oldest.replace(tzinfo=timezone.utc)
+        stats["oldest_pending_age"] = (utcnow() - oldest).total_seconds()
+    return stats
@@ -1,21 +1,37 @@
-import asyncio
-import random
+from datetime import datetime, timezone
 from decimal import Decimal
 
-from sqlalchemy import DECIMAL, Integer, String, create_engine, select
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import (DECIMAL, Integer, String, column, insert, select, update,
+                        values)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
-from sqlalchemy_utils import create_database, database_exists
 
-from app.config import (PAYMENT_DATABASE_URL, PAYMENT_DATABASE_URL_SYNC,
-                        PAYMENT_DB)
-from app.utils.logger import logger
+from app.config import (PAYMENT_DATABASE_REPLICA_URL, PAYMENT_DATABASE_URL,
+                        PAYMENT_DATABASE_URL_SYNC, PAYMENT_DB)
+from app.db.engine import (POSTGRES, create_db_engine, dialect_name,
+                           ensure_database, read_only_engine)
+from app.db.replica import ReadRouter
+from app.exception.custom_exception import InvalidStatusTransition
 
-engine = create_async_engine(
-    PAYMENT_DATABASE_URL, echo=False, pool_size=15, max_overflow=0
-)
-engine_sync = create_engine(PAYMENT_DATABASE_URL_SYNC)
+engine = create_db_engine(PAYMENT_DATABASE_URL, "payment")
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+read_session = sessionmaker(
+    read_only_engine(engine), class_=AsyncSession, expire_on_commit=False
+)
+read_router = ReadRouter("payment", read_session, PAYMENT_DATABASE_REPLICA_URL)
+
+
+PAYMENT_PROCESSING = "processing"
+PAYMENT_SUCCESS = "success"
+PAYMENT_FAILED = "failed"
+
+# Допустимые переходы статусов платежа: processing -> success | failed.
+# Итоговые статусы больше не меняются.
+PAYMENT_STATUS_TRANSITIONS: dict[str, frozenset[str]] = {
+    PAYMENT_PROCESSING: frozenset({PAYMENT_SUCCESS, PAYMENT_FAILED}),
+    PAYMENT_SUCCESS: frozenset(),
+    PAYMENT_FAILED: frozenset(),
+}
 
 
 class Base(DeclarativeBase):
@@ -36,25 +52,16 @@ class Payment(Base):
     message: Mapped[str | None] = mapped_column(String, nullable=True)
 
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 async def init_db():
-    if not database_exists(engine_sync.url):
-        logger.info(f"База данных {PAYMENT_DB} не найдена. Создаём базу...")
-        create_database(engine_sync.url)
-        logger.info(f"База данных {PAYMENT_DB} успешно создана.")
+    ensure_database(PAYMENT_DATABASE_URL_SYNC, PAYMENT_DB)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
 
-async def simulate_db_delay():
-    rnd = random.random()
-    if rnd < 0.1:
-        await asyncio.sleep(60)
-    elif rnd < 0.2:
-        await asyncio.sleep(2)
-    else:
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-
-
 async def create_payment_record(
     user_id: int,
     amount: Decimal,
@@ -80,46 +87,169 @@ async def create_payment_record(
         raise e
 
 
-async def create_payment_record_v2(
-    user_id: int,
-    amount: Decimal,
-    currency: str,
+async def create_payment_records(rows: list[dict], session: AsyncSession) -> list[int]:
+    """
+    ### Создаёт записи платежей одним многострочным `INSERT ... RETURNING`.
+
+    Запись фиксируется вместе с остальными изменениями сессии.
+
+    ### Параметры:
+    - **rows**: Значения `user_id`, `amount`, `currency`, `status`, `message` для каждого платежа.
+
+    ### Возвращает:
+    - ID платежей в порядке `rows`.
+    """
+    result = await session.execute(
+        insert(Payment).returning(Payment.payment_id, sort_by_parameter_order=True),
+        [{**row, "bonus": Decimal("0.00")} for row in rows],
+    )
+    return list(result.scalars())
+
+
+def check_status_transition(payment_id: int, expected_status: str, status: str) -> None:
+    """
+    ### Проверяет переход статуса по `PAYMENT_STATUS_TRANSITIONS`.
+    """
+    if status not in PAYMENT_STATUS_TRANSITIONS.get(expected_status, frozenset()):
+        raise InvalidStatusTransition(
+            f"Недопустимый переход статуса платежа {payment_id}: "
+            f"{expected_status} -> {status}"
+        )
+
+
+async def update_payment_status(
+    payment_id: int,
     status: str,
     message: str,
-) -> int:
-    async with async_session() as session:
-
-        try:
-            payment = Payment(
-                user_id=user_id,
-                amount=amount,
-                currency=currency,
-                status=status,
-                bonus=Decimal("0.00"),
-                message=message,
+    bonus: Decimal,
+    session: AsyncSession,
+    expected_status: str = PAYMENT_PROCESSING,
+) -> bool:
+    """
+    ### Переводит платёж из статуса `expected_status` в `status`.
+
+    Переход проверяется по `PAYMENT_STATUS_TRANSITIONS` и выполняется одним
+    условным запросом `UPDATE ... WHERE payment_id = :id AND status = :expected`,
+    поэтому конкурентные обработчики не перезаписывают итоговый статус друг друга.
+
+    ### Возвращает:
+    - `True`, если переход применён, `False`, если платёж не найден или его статус
+      уже отличается от ожидаемого.
+    """
+    check_status_transition(payment_id, expected_status, status)
+    try:
+        result = await session.execute(
+            update(Payment)
+            .where(
+                Payment.payment_id == payment_id,
+                Payment.status == expected_status,
             )
-            session.add(payment)
-            await session.commit()
-            return payment.payment_id
-        except Exception as e:
-            await session.rollback()
-            raise e
+            .values(status=status, message=message, bonus=bonus)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+    except Exception as e:
+        await session.rollback()
+        raise e
 
 
-async def update_payment_status(
-    payment_id: int, status: str, message: str, bonus: Decimal, session: AsyncSession
-):
+async def update_payment_bonus(
+    payment_id: int, bonus: Decimal, message: str, session: AsyncSession
+) -> bool:
+    """
+    ### Записывает бонусы успешно проведённого платежа.
+
+    Обновление применяется только к платежам в статусе `success`.
+
+    ### Возвращает:
+    - `True`, если бонусы записаны.
+    """
     try:
         result = await session.execute(
-            select(Payment).where(Payment.payment_id == payment_id)
+            update(Payment)
+            .where(
+                Payment.payment_id == payment_id,
+                Payment.status == PAYMENT_SUCCESS,
+            )
+            .values(bonus=bonus, message=message)
+            .execution_options(synchronize_session=False)
         )
-        payment = result.scalar_one_or_none()
-        if payment:
-            payment.status = status
-            payment.message = message
-            payment.bonus = bonus
-            session.add(payment)
-            await session.flush()
+        return result.rowcount == 1
+    except Exception as e:
+        await session.rollback()
+        raise e
+
+
+async def update_payment_statuses(
+    updates: list[dict], session: AsyncSession
+) -> set[int]:
+    """
+    ### Применяет пачку условных обновлений платежей одним запросом.
+
+    Каждое обновление - значения `payment_id`, `expected_status`, `status`,
+    `message`, `bonus` - применяется, только если платёж в статусе
+    `expected_status`, как в `update_payment_status`. В PostgreSQL пачка
+    выполняется одним `UPDATE ... FROM (VALUES ...) RETURNING`. SQLite не
+    поддерживает имена столбцов у `VALUES`, поэтому там обновления выполняются
+    по одному в той же транзакции. В пачке не должно быть двух обновлений
+    одного платежа.
+
+    ### Возвращает:
+    - ID платежей, к которым обновление применено.
+    """
+    try:
+        if dialect_name(session) == POSTGRES:
+            pending = values(
+                column("payment_id", Integer),
+                column("expected_status", String),
+                column("status", String),
+                column("message", String),
+                column("bonus", DECIMAL(10, 2)),
+                name="pending",
+            ).data(
+                [
+                    (
+                        item["payment_id"],
+                        item["expected_status"],
+                        item["status"],
+                        item["message"],
+                        item["bonus"],
+                    )
+                    for item in updates
+                ]
+            )
+            result = await session.execute(
+                update(Payment)
+                .where(
+                    Payment.payment_id == pending.c.payment_id,
+                    Payment.status == pending.c.expected_status,
+                )
+                .values(
+                    status=pending.c.status,
+                    message=pending.c.message,
+                    bonus=pending.c.bonus,
+                )
+                .returning(Payment.payment_id)
+                .execution_options(synchronize_session=False)
+            )
+            return set(result.scalars())
+
+        applied = set()
+        for item in updates:
+            result = await session.execute(
+                update(Payment)
+                .where(
+                    Payment.payment_id == item["payment_id"],
+                    Payment.status == item["expected_status"],
+                )
+                .values(
+                    status=item["status"], message=item["message"], bonus=item["bonus"]
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                applied.add(item["payment_id"])
+        return applied
     except Exception as e:
         await session.rollback()
         raise e
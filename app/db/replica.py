@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.config import (REPLICA_LAG_CHECK_INTERVAL, REPLICA_MAX_LAG,
+                        REPLICA_POOL_SIZE, REPLICA_READ_YOUR_WRITES_WINDOW)
+from app.db.engine import create_db_engine
+from app.utils.logger import logger
+from app.utils.metrics.metrics import DB_READS, DB_REPLICA_LAG
+from app.utils.processes.deadline import deadline, detached
+
+LAG_CHECK_TIMEOUT = 1.0
+
+# Реплика, проигравшая весь полученный WAL, не отстаёт, даже если последняя
+# транзакция была давно, но только пока WAL receiver стримит с основной базы:
+# отключённая реплика тоже проиграла всё полученное, а новый WAL не получает.
+# Для неё отставание неизвестно (NULL). На основной базе (не в режиме
+# восстановления) отставание нулевое.
+_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
+
+
+class ReadRouter:
+    """
+    ### Выбирает базу для чтений, допускающих отставание.
+
+    Чтение идёт в реплику, если она настроена, её отставание известно и не
+    больше `max_lag`, а ни один из ключей чтения (ID платежа, пользователя)
+    не записывался этим процессом последние `read_your_writes_window` секунд.
+    Иначе чтение идёт в основную базу.
+
+    Отставание проверяется в фоне при очередном чтении, не чаще раза в
+    `lag_check_interval` секунд. Пока оно неизвестно или реплика недоступна,
+    все чтения идут в основную базу.
+
+    ### Параметры:
+    - **name**: Имя базы в метриках (`payment`, `user`).
+    - **primary**: Фабрика читающих сессий основной базы.
+    - **replica_url**: Адрес реплики, пустая строка - реплики нет.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        primary: sessionmaker,
+        replica_url: str,
+        max_lag: float = REPLICA_MAX_LAG,
+        lag_check_interval: float = REPLICA_LAG_CHECK_INTERVAL,
+        read_your_writes_window: float = REPLICA_READ_YOUR_WRITES_WINDOW,
+        max_tracked: int = 100_000,
+    ):
+        self.name = name
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.read_your_writes_window = read_your_writes_window
+        self.max_tracked = max_tracked
+        self.lag: float | None = None
+        self._primary = primary
+        self._replica: sessionmaker | None = None
+        if replica_url:
+            engine = create_db_engine(
+                replica_url, f"{name}_replica", pool_size=REPLICA_POOL_SIZE
+            )
+            self._replica = sessionmaker(
+                engine, class_=AsyncSession, expire_on_commit=False
+            )
+        self._healthy = False
+        self._checked_at = float("-inf")
+        self._checking: asyncio.Task | None = None
+        # Ключ -> момент, до которого чтения идут в основную базу. Окно у всех
+        # ключей одинаковое, поэтому порядок словаря совпадает с порядком
+        # истечения.
+        self._written: OrderedDict[Hashable, float] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self._replica is not None
+
+    def mark_written(self, key: Hashable) -> None:
+        """
+        ### Отмечает запись по ключу: его чтения на время окна идут в основную базу.
+        """
+        if self._replica is None:
+            return
+        self._written[key] = time.monotonic() + self.read_your_writes_window
+        self._written.move_to_end(key)
+        while len(self._written) > self.max_tracked:
+            self._written.popitem(last=False)
+
+    def _recently_written(self, keys: tuple[Hashable, ...]) -> bool:
+        now = time.monotonic()
+        while self._written:
+            until = next(iter(self._written.values()))
+            if until > now:
+                break
+            self._written.popitem(last=False)
+        return any(key in self._written for key in keys)
+
+    def use_replica(self, *keys: Hashable) -> bool:
+        """
+        ### Решает, можно ли выполнить чтение по ключам на реплике.
+        """
+        if self._replica is None:
+            return False
+        self._schedule_lag_check()
+        replica = self._healthy and not self._recently_written(keys)
+        DB_READS.inc(database=self.name, target="replica" if replica else "primary")
+        return replica
+
+    def session(self, replica: bool, **kwargs) -> AsyncSession:
+        """
+        ### Открывает сессию реплики или основной базы.
+        """
+        if replica and self._replica is not None:
+            return self._replica(**kwargs)
+        return self._primary(**kwargs)
+
+    def _schedule_lag_check(self) -> None:
+        if self._checking is not None:
+            return
+        if time.monotonic() - self._checked_at < self.lag_check_interval:
+            return
+        self._checking = detached(self._check_lag())
+
+    async def _check_lag(self) -> None:
+        try:
+            async with deadline(LAG_CHECK_TIMEOUT):
+                async with self._replica() as session:
+                    lag = (await session.execute(_LAG_QUERY)).scalar_one()
+            self.lag = None if lag is None else float(lag)
+        except Exception as e:
+            self.lag = None
+            logger.warning("Не удалось проверить отставание реплики %s: %s", self.name, e)
+        finally:
+            self._checked_at = time.monotonic()
+            self._checking = None
+
+        if self.lag is not None:
+            DB_REPLICA_LAG.set(self.lag, database=self.name)
+        healthy = self.lag is not None and self.lag <= self.max_lag
+        if healthy != self._healthy:
+            if healthy:
+                logger.info("Чтения базы %s переключены на реплику", self.name)
+            else:
+                logger.warning(
+                    "Чтения базы %s переключены на основную базу: отставание реплики %s",
+                    self.name,
+                    "неизвестно" if self.lag is None else "%.3f с" % self.lag,
+                )
+        self._healthy = healthy
@@ -1,21 +1,50 @@
-import asyncio
 import random
-from decimal import Decimal
+import uuid
+from datetime import datetime, timezone
+from decimal import ROUND_DOWN, Decimal
 
-from sqlalchemy import DECIMAL, Integer, create_engine, select
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import (DECIMAL, BigInteger, DateTime, Index, Integer, String,
+                        and_, cast, exists, func, insert, literal, select,
+                        type_coerce, update)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
-from sqlalchemy_utils import create_database, database_exists
 
-from app.config import USER_DATABASE_URL, USER_DATABASE_URL_SYNC, USER_DB
+from app.config import (LEDGER_SNAPSHOT_INTERVAL, USER_BALANCE_MODE,
+                        USER_DATABASE_REPLICA_URL, USER_DATABASE_URL,
+                        USER_DATABASE_URL_SYNC, USER_DB,
+                        WALLET_SHARDS)
+from app.db.engine import (POSTGRES, SQLITE, create_db_engine, dialect_name,
+                           ensure_database, read_only_engine)
+from app.db.replica import ReadRouter
 from app.exception.custom_exception import NotEnoughMoney, UserNotFoundError
 from app.utils.logger import logger
+from app.utils.metrics.metrics import WALLET_SHARD_REBALANCES
 
-engine = create_async_engine(
-    USER_DATABASE_URL, echo=False, pool_size=15, max_overflow=0
-)
-engine_sync = create_engine(USER_DATABASE_URL_SYNC)
+BALANCE_COLUMN = "column"
+BALANCE_LEDGER = "ledger"
+
+if USER_BALANCE_MODE not in (BALANCE_COLUMN, BALANCE_LEDGER):
+    raise ValueError(f"Неизвестный USER_BALANCE_MODE: {USER_BALANCE_MODE}")
+
+WALLET_ACCOUNT_PREFIX = "user:"
+# Счёт, на который зачисляются списания с кошельков.
+PAYMENTS_ACCOUNT = "payments"
+
+# Пространство ключей pg_advisory_xact_lock для кошельков.
+_WALLET_LOCK_CLASS = 1
+# Полосы журнала блокируются одним ключом bigint `(user_id << 16) | полоса`:
+# такие ключи не пересекаются с парами `(класс, ID)`.
+_STRIPE_LOCK_BITS = 16
+
+_INSERTS = {POSTGRES: postgresql.insert, SQLITE: sqlite.insert}
+
+engine = create_db_engine(USER_DATABASE_URL, "user")
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+read_session = sessionmaker(
+    read_only_engine(engine), class_=AsyncSession, expire_on_commit=False
+)
+read_router = ReadRouter("user", read_session, USER_DATABASE_REPLICA_URL)
 
 
 class Base(DeclarativeBase):
@@ -29,11 +58,59 @@ class User(Base):
     balance: Mapped[Decimal] = mapped_column(DECIMAL(10, 2), nullable=False)
 
 
+class WalletShard(Base):
+    """
+    Шард баланса кошелька. Баланс кошелька - `users.balance` плюс сумма его
+    шардов; у нешардированного кошелька шардов нет.
+    """
+
+    __tablename__ = "wallet_shards"
+
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    balance: Mapped[Decimal] = mapped_column(DECIMAL(10, 2), nullable=False)
+
+
+class LedgerEntry(Base):
+    """
+    Проводка журнала балансов. Записи только добавляются; проводки одной
+    операции (`transaction_id`) в сумме дают ноль.
+    """
+
+    __tablename__ = "ledger_entries"
+    __table_args__ = (Index("ix_ledger_entries_account_entry", "account", "entry_id"),)
+
+    entry_id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True,
+    )
+    transaction_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    account: Mapped[str] = mapped_column(String(64), nullable=False)
+    amount: Mapped[Decimal] = mapped_column(DECIMAL(12, 2), nullable=False)
+    payment_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+
+class BalanceSnapshot(Base):
+    """
+    Свёрнутый баланс счёта: сумма начального баланса и проводок с
+    `entry_id <= last_entry_id`.
+    """
+
+    __tablename__ = "balance_snapshots"
+
+    account: Mapped[str] = mapped_column(String(64), primary_key=True)
+    balance: Mapped[Decimal] = mapped_column(DECIMAL(12, 2), nullable=False)
+    last_entry_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
 async def init_db():
-    if not database_exists(engine_sync.url):
-        logger.info(f"База данных {USER_DB} не найдена. Создаём базу...")
-        create_database(engine_sync.url)
-        logger.info(f"База данных {USER_DB} успешно создана.")
+    ensure_database(USER_DATABASE_URL_SYNC, USER_DB)
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -45,16 +122,100 @@ async def init_db():
                 new_user = User(balance=round(random.uniform(500, 1000), 2))
                 session.add(new_user)
             await session.commit()
+        await apply_wallet_shards(session)
 
 
-async def simulate_db_delay():
-    rnd = random.random()
-    if rnd < 0.1:
-        await asyncio.sleep(60)
-    elif rnd < 0.2:
-        await asyncio.sleep(2)
+async def apply_wallet_shards(session: AsyncSession) -> None:
+    """
+    ### Приводит шарды кошельков к `WALLET_SHARDS`.
+
+    Кошельки из настройки делятся на заданное число шардов, кошельки, шарды
+    которых из настройки убраны, собираются обратно в `users.balance`.
+    """
+    if USER_BALANCE_MODE == BALANCE_LEDGER:
+        sharded = await _striped_wallets(session)
     else:
-        await asyncio.sleep(random.uniform(0.1, 0.3))
+        sharded = set(
+            (await session.execute(select(WalletShard.user_id).distinct())).scalars()
+        )
+    for user_id in sorted(sharded | set(WALLET_SHARDS)):
+        shards = wallet_shard_count(user_id)
+        try:
+            await set_wallet_shards(user_id, shards, session)
+        except UserNotFoundError:
+            logger.warning("Шарды кошелька %s не настроены: пользователь не найден", user_id)
+            continue
+        logger.info("Кошелёк %s: шардов баланса %s", user_id, shards)
+    await session.commit()
+
+
+def wallet_shard_count(user_id: int) -> int:
+    """
+    ### Число шардов баланса кошелька по `WALLET_SHARDS` (1 - без шардов).
+    """
+    return max(WALLET_SHARDS.get(user_id, 1), 1)
+
+
+def _split(total: Decimal, shards: int) -> list[Decimal]:
+    """
+    ### Делит сумму на `shards` частей с точностью до копейки.
+
+    Остаток от деления достаётся первому шарду.
+    """
+    part = (total / shards).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+    return [total - part * (shards - 1)] + [part] * (shards - 1)
+
+
+async def _lock_wallet(
+    user_id: int, session: AsyncSession
+) -> tuple[User, list[WalletShard]]:
+    """
+    ### Блокирует строку пользователя и все шарды кошелька.
+
+    Строки блокируются всегда в одном порядке (пользователь, затем шарды по
+    номеру), поэтому перераспределения не взаимоблокируются.
+    """
+    user = (
+        await session.execute(
+            select(User).where(User.user_id == user_id).with_for_update()
+        )
+    ).scalar_one_or_none()
+    if user is None:
+        raise UserNotFoundError(f"User with id {user_id} not found")
+    shards = (
+        await session.execute(
+            select(WalletShard)
+            .where(WalletShard.user_id == user_id)
+            .order_by(WalletShard.shard)
+            .with_for_update()
+        )
+    ).scalars().all()
+    return user, list(shards)
+
+
+async def set_wallet_shards(user_id: int, shards: int, session: AsyncSession) -> None:
+    """
+    ### Делит баланс кошелька поровну на `shards` шардов.
+
+    При `shards <= 1` шарды удаляются, а весь баланс возвращается в
+    `users.balance`. В режиме журнала шарды - полосы журнала (см.
+    `_set_ledger_stripes`). Коммит выполняет вызывающий.
+    """
+    if USER_BALANCE_MODE == BALANCE_LEDGER:
+        await _set_ledger_stripes(user_id, shards, session)
+        return
+    user, current = await _lock_wallet(user_id, session)
+    total = user.balance + sum((shard.balance for shard in current), Decimal(0))
+    for shard in current:
+        await session.delete(shard)
+    await session.flush()
+    if shards <= 1:
+        user.balance = total
+        return
+    user.balance = Decimal(0)
+    for number, balance in enumerate(_split(total, shards)):
+        session.add(WalletShard(user_id=user_id, shard=number, balance=balance))
+    await session.flush()
 
 
 async def get_user(user_id: int, session: AsyncSession):
@@ -65,22 +226,582 @@ async def get_user(user_id: int, session: AsyncSession):
     return user
 
 
-async def update_user_balance(
+def wallet_account(user_id: int) -> str:
+    """
+    ### Имя счёта кошелька пользователя в журнале.
+    """
+    return f"{WALLET_ACCOUNT_PREFIX}{user_id}"
+
+
+def wallet_stripe_account(user_id: int, stripe: int) -> str:
+    """
+    ### Имя счёта полосы шардированного кошелька в журнале.
+    """
+    return f"{wallet_account(user_id)}/{stripe}"
+
+
+def _wallet_stripes(user_id: int) -> list[str]:
+    """
+    ### Счета полос кошелька по `WALLET_SHARDS` (пусто - кошелёк без шардов).
+    """
+    shards = wallet_shard_count(user_id)
+    if shards == 1:
+        return []
+    return [wallet_stripe_account(user_id, stripe) for stripe in range(shards)]
+
+
+def _ledger_balances(user_ids: list[int]):
+    """
+    ### Запрос балансов кошельков в режиме журнала.
+
+    Баланс - снимок (или начальный `users.balance`, если снимка ещё нет) плюс
+    проводки после снимка. Списание сворачивает журнал в снимок не реже, чем
+    через `LEDGER_SNAPSHOT_INTERVAL` проводок, поэтому запрос читает
+    ограниченное число строк по индексу `(account, entry_id)`.
+
+    ### Возвращает:
+    - `select` со столбцами `user_id`, `balance`, `last_entry_id`, `pending`
+      (число проводок после снимка).
+    """
+    account = literal(WALLET_ACCOUNT_PREFIX) + cast(User.user_id, String)
+    last_entry_id = func.coalesce(BalanceSnapshot.last_entry_id, 0)
+    since_snapshot = and_(
+        LedgerEntry.account == account, LedgerEntry.entry_id > last_entry_id
+    )
+    delta = (
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+        .where(since_snapshot)
+        .scalar_subquery()
+    )
+    pending = (
+        select(func.count())
+        .select_from(LedgerEntry)
+        .where(since_snapshot)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            User.user_id,
+            type_coerce(
+                func.coalesce(BalanceSnapshot.balance, User.balance) + delta,
+                DECIMAL(12, 2),
+            ).label("balance"),
+            last_entry_id.label("last_entry_id"),
+            pending.label("pending"),
+        )
+        .select_from(User)
+        .outerjoin(BalanceSnapshot, BalanceSnapshot.account == account)
+        .where(User.user_id.in_(user_ids))
+    )
+
+
+def _stripe_balances(accounts: list[str]):
+    """
+    ### Запрос балансов полос журнала.
+
+    Полоса получает снимок в момент создания (см. `_set_ledger_stripes`),
+    поэтому её баланс - снимок плюс проводки после него. Полос без снимка
+    ещё нет, и запрос их не возвращает.
+
+    ### Возвращает:
+    - `select` со столбцами `account`, `balance`, `last_entry_id`, `pending`.
+    """
+    since_snapshot = and_(
+        LedgerEntry.account == BalanceSnapshot.account,
+        LedgerEntry.entry_id > BalanceSnapshot.last_entry_id,
+    )
+    delta = (
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+        .where(since_snapshot)
+        .scalar_subquery()
+    )
+    pending = (
+        select(func.count())
+        .select_from(LedgerEntry)
+        .where(since_snapshot)
+        .scalar_subquery()
+    )
+    return select(
+        BalanceSnapshot.account,
+        type_coerce(BalanceSnapshot.balance + delta, DECIMAL(12, 2)).label("balance"),
+        BalanceSnapshot.last_entry_id,
+        pending.label("pending"),
+    ).where(BalanceSnapshot.account.in_(accounts))
+
+
+async def get_user_balances(
+    user_ids: list[int], session: AsyncSession
+) -> dict[int, Decimal]:
+    """
+    ### Балансы пользователей одним запросом.
+
+    ### Возвращает:
+    - Баланс по ID пользователя. Несуществующих пользователей в словаре нет.
+    """
+    if USER_BALANCE_MODE == BALANCE_LEDGER:
+        result = await session.execute(_ledger_balances(user_ids))
+        balances = {row.user_id: row.balance for row in result}
+        stripes = {
+            account: user_id
+            for user_id in balances
+            for account in _wallet_stripes(user_id)
+        }
+        if stripes:
+            for row in await session.execute(_stripe_balances(list(stripes))):
+                balances[stripes[row.account]] += row.balance
+        return balances
+    # Сумма шардов читается по первичному ключу `(user_id, shard)`, для
+    # нешардированного кошелька это пустой диапазон.
+    shards = (
+        select(func.coalesce(func.sum(WalletShard.balance), 0))
+        .where(WalletShard.user_id == User.user_id)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        select(
+            User.user_id, type_coerce(User.balance + shards, DECIMAL(10, 2))
+        ).where(User.user_id.in_(user_ids))
+    )
+    return dict(result.all())
+
+
+async def debit_user_balance(
+    user_id: int,
+    amount: Decimal,
+    session: AsyncSession,
+    payment_id: int | None = None,
+) -> Decimal:
+    """
+    ### Атомарно списывает сумму с баланса пользователя.
+
+    В режиме `USER_BALANCE_MODE=ledger` списание записывается проводками
+    журнала (см. `_debit_ledger`), а `users.balance` не меняется. Кошельки
+    из `WALLET_SHARDS` списываются с одного из шардов (см. `_debit_sharded`,
+    в режиме журнала - `_debit_ledger_stripe`).
+
+    Проверка баланса и списание выполняются одним запросом
+    `UPDATE ... WHERE balance >= :amount RETURNING balance`, поэтому конкурентные
+    списания с одного кошелька не теряют обновлений. В PostgreSQL тот же запрос
+    сообщает, существует ли пользователь, чтобы отличить отсутствие пользователя
+    от нехватки средств без второго обращения к базе.
+
+    ### Параметры:
+    - **payment_id**: ID платежа для проводок журнала.
+
+    ### Возвращает:
+    - Новый баланс пользователя.
+    """
+    if USER_BALANCE_MODE == BALANCE_LEDGER:
+        return await _debit_ledger(user_id, amount, session, payment_id)
+    if wallet_shard_count(user_id) > 1:
+        return await _debit_sharded(user_id, amount, session)
+    debit = (
+        update(User)
+        .where(User.user_id == user_id, User.balance >= amount)
+        .values(balance=User.balance - amount)
+        .returning(User.balance)
+    )
+    if dialect_name(session) == POSTGRES:
+        debited = debit.cte("debited")
+        result = await session.execute(
+            select(
+                exists().where(User.user_id == user_id).label("user_exists"),
+                select(debited.c.balance).scalar_subquery().label("balance"),
+            )
+        )
+        user_exists, new_balance = result.one()
+    else:
+        # SQLite не поддерживает UPDATE внутри CTE. Транзакция уже держит
+        # блокировку записи (BEGIN IMMEDIATE), поэтому проверка существования
+        # вторым запросом не конкурирует с другими списаниями.
+        new_balance = (
+            await session.execute(debit.execution_options(synchronize_session=False))
+        ).scalar_one_or_none()
+        user_exists = new_balance is not None or (
+            await session.execute(select(exists().where(User.user_id == user_id)))
+        ).scalar_one()
+    if new_balance is not None:
+        return new_balance
+    if not user_exists:
+        raise UserNotFoundError(f"User with id {user_id} not found")
+    raise NotEnoughMoney(f"User with id {user_id} has not enough money")
+
+
+async def _debit_sharded(
+    user_id: int, amount: Decimal, session: AsyncSession
+) -> Decimal:
+    """
+    ### Списание с шардированного кошелька.
+
+    Запрос выбирает самый наполненный шард с достаточным балансом среди
+    незаблокированных (`FOR UPDATE SKIP LOCKED`) и списывает с него, поэтому
+    конкурентные списания с одного кошелька расходятся по разным строкам.
+    Если такого шарда нет (остальные заняты или в каждом не хватает средств),
+    списание выполняется с перераспределением (см. `_rebalance_and_debit`).
+    В SQLite `FOR UPDATE` не используется: запись и так идёт в одну
+    транзакцию за раз.
+    """
+    picked = (
+        select(WalletShard.shard)
+        .where(WalletShard.user_id == user_id, WalletShard.balance >= amount)
+        .order_by(WalletShard.balance.desc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    debited = (
+        await session.execute(
+            update(WalletShard)
+            .where(WalletShard.user_id == user_id, WalletShard.shard == picked)
+            .values(balance=WalletShard.balance - amount)
+            .returning(WalletShard.shard)
+            .execution_options(synchronize_session=False)
+        )
+    ).scalar_one_or_none()
+    if debited is None:
+        # Точка сохранения: повтор после сбоя не должен застать половину
+        # перераспределения.
+        async with session.begin_nested():
+            return await _rebalance_and_debit(user_id, amount, session)
+    return (await get_user_balances([user_id], session))[user_id]
+
+
+async def _rebalance_and_debit(
     user_id: int, amount: Decimal, session: AsyncSession
-) -> bool:
-    user = await get_user(user_id, session)
-    new_balance = user.balance - amount
-    if new_balance < 0:
+) -> Decimal:
+    """
+    ### Списание с перераспределением баланса между шардами.
+
+    Блокирует весь кошелёк, проверяет общий баланс и раскладывает остаток
+    после списания поровну по шардам. Если шардов нет (например, ещё не
+    выполнен `apply_wallet_shards`), списывает с `users.balance`.
+    """
+    user, shards = await _lock_wallet(user_id, session)
+    total = user.balance + sum((shard.balance for shard in shards), Decimal(0))
+    if total < amount:
         raise NotEnoughMoney(f"User with id {user_id} has not enough money")
-    user.balance = new_balance
-    session.add(user)
+    remaining = total - amount
+    if not shards:
+        user.balance = remaining
+    else:
+        user.balance = Decimal(0)
+        for shard, balance in zip(shards, _split(remaining, len(shards))):
+            shard.balance = balance
+        WALLET_SHARD_REBALANCES.inc()
     await session.flush()
-    return True
+    return remaining
+
+
+async def _debit_ledger(
+    user_id: int, amount: Decimal, session: AsyncSession, payment_id: int | None
+) -> Decimal:
+    """
+    ### Списание в режиме журнала.
+
+    Строка пользователя не обновляется: списание добавляет две проводки
+    (кошелёк `-amount`, счёт `payments` `+amount`). Проверка и вставка
+    выполняются под транзакционной advisory-блокировкой кошелька, которая
+    держится до коммита, иначе два конкурентных списания не увидели бы
+    проводки друг друга. В SQLite ту же роль играет блокировка записи
+    `BEGIN IMMEDIATE`.
+
+    Кошелёк из `WALLET_SHARDS` сначала пробует списать с одной из полос без
+    исключительной блокировки (см. `_debit_ledger_stripe`), а если ни одна
+    полоса не покрывает сумму - перераспределяет баланс под ней.
+
+    Когда после снимка накапливается `LEDGER_SNAPSHOT_INTERVAL` проводок,
+    снимок кошелька обновляется в той же транзакции.
+    """
+    # Точка сохранения: повтор после сбоя одного из запросов не должен
+    # оставить в транзакции проводки предыдущей попытки.
+    async with session.begin_nested():
+        stripes = _wallet_stripes(user_id)
+        if stripes:
+            new_balance = await _debit_ledger_stripe(
+                user_id, amount, stripes, session, payment_id
+            )
+            if new_balance is not None:
+                return new_balance
+        await _lock_ledger_wallet(user_id, session)
+        state = (await session.execute(_ledger_balances([user_id]))).one_or_none()
+        if state is None:
+            raise UserNotFoundError(f"User with id {user_id} not found")
+        if stripes:
+            return await _rebalance_ledger(
+                user_id, amount, state.balance, stripes, session, payment_id
+            )
+        if state.balance < amount:
+            raise NotEnoughMoney(f"User with id {user_id} has not enough money")
+
+        account = wallet_account(user_id)
+        entry_id, _ = await _post(
+            [(account, -amount), (PAYMENTS_ACCOUNT, amount)], payment_id, session
+        )
+        new_balance = state.balance - amount
+        if state.pending + 1 >= LEDGER_SNAPSHOT_INTERVAL:
+            await _save_snapshot(account, new_balance, entry_id, session)
+    return new_balance
+
+
+async def _debit_ledger_stripe(
+    user_id: int,
+    amount: Decimal,
+    stripes: list[str],
+    session: AsyncSession,
+    payment_id: int | None,
+) -> Decimal | None:
+    """
+    ### Списание с одной полосы шардированного кошелька в режиме журнала.
+
+    Полоса - отдельный счёт журнала со своим снимком. Кошелёк блокируется
+    в разделяемом режиме, а полоса - своей advisory-блокировкой, которую
+    берёт `pg_try_advisory_xact_lock`: занятая другим списанием полоса
+    пропускается, как шард в `_debit_sharded`. Поэтому конкурентные
+    списания с одного кошелька пишут проводки на разные счета одновременно,
+    а перераспределение (исключительная блокировка кошелька) ждёт их всех.
+
+    Выбирается самая наполненная полоса, покрывающая сумму. Если такой нет,
+    точка сохранения откатывается вместе с взятыми в ней блокировками,
+    чтобы перераспределение не ждало само себя.
+
+    ### Возвращает:
+    - Новый баланс кошелька или `None`, если списать с одной полосы нельзя.
+    """
+    postgres = dialect_name(session) == POSTGRES
+    attempt = await session.begin_nested()
+    try:
+        if postgres:
+            await _lock_ledger_wallet(user_id, session, shared=True)
+        rows = (await session.execute(_stripe_balances(stripes))).all()
+        candidates = sorted(
+            (row for row in rows if row.balance >= amount),
+            key=lambda row: row.balance,
+            reverse=True,
+        )
+        for stripe in candidates:
+            if postgres:
+                key = (user_id << _STRIPE_LOCK_BITS) | stripes.index(stripe.account)
+                locked = (
+                    await session.execute(select(func.pg_try_advisory_xact_lock(key)))
+                ).scalar_one()
+                if not locked:
+                    continue
+                # Между чтением и блокировкой с полосы могло списать другое
+                # завершившееся списание.
+                stripe = (
+                    await session.execute(_stripe_balances([stripe.account]))
+                ).one()
+                if stripe.balance < amount:
+                    continue
+            entry_id, _ = await _post(
+                [(stripe.account, -amount), (PAYMENTS_ACCOUNT, amount)],
+                payment_id,
+                session,
+            )
+            if stripe.pending + 1 >= LEDGER_SNAPSHOT_INTERVAL:
+                await _save_snapshot(
+                    stripe.account, stripe.balance - amount, entry_id, session
+                )
+            await attempt.commit()
+            return (await get_user_balances([user_id], session))[user_id]
+    except BaseException:
+        await attempt.rollback()
+        raise
+    await attempt.rollback()
+    return None
+
+
+async def _rebalance_ledger(
+    user_id: int,
+    amount: Decimal,
+    wallet_balance: Decimal,
+    stripes: list[str],
+    session: AsyncSession,
+    payment_id: int | None,
+) -> Decimal:
+    """
+    ### Списание с перераспределением баланса между полосами журнала.
+
+    Вызывается под исключительной блокировкой кошелька. Одна операция
+    журнала списывает сумму и раскладывает остаток по полосам поровну,
+    а счёт кошелька `user:<id>` обнуляет.
+    """
+    current = {wallet_account(user_id): wallet_balance} | {
+        row.account: row.balance
+        for row in await session.execute(_stripe_balances(stripes))
+    }
+    total = sum(current.values(), Decimal(0))
+    if total < amount:
+        raise NotEnoughMoney(f"User with id {user_id} has not enough money")
+    remaining = total - amount
+    target = {wallet_account(user_id): Decimal(0)} | dict(
+        zip(stripes, _split(remaining, len(stripes)))
+    )
+    await _move_ledger_balances(current, target, session, payment_id, amount)
+    WALLET_SHARD_REBALANCES.inc()
+    return remaining
+
+
+async def _set_ledger_stripes(
+    user_id: int, shards: int, session: AsyncSession
+) -> None:
+    """
+    ### Делит баланс кошелька в журнале на `shards` полос.
+
+    Баланс переводится проводками между счётом кошелька и счетами полос, так
+    что журнал остаётся сбалансированным. При `shards <= 1` весь баланс
+    собирается обратно на счёт кошелька.
+    """
+    await _lock_ledger_wallet(user_id, session)
+    state = (await session.execute(_ledger_balances([user_id]))).one_or_none()
+    if state is None:
+        raise UserNotFoundError(f"User with id {user_id} not found")
+    account = wallet_account(user_id)
+    existing = (
+        await session.execute(
+            select(BalanceSnapshot.account).where(
+                BalanceSnapshot.account.like(f"{account}/%")
+            )
+        )
+    ).scalars().all()
+    current = {account: state.balance} | {
+        row.account: row.balance
+        for row in await session.execute(_stripe_balances(list(existing)))
+    }
+    total = sum(current.values(), Decimal(0))
+    target = dict.fromkeys(current, Decimal(0))
+    if shards <= 1:
+        target[account] = total
+    else:
+        stripes = [wallet_stripe_account(user_id, stripe) for stripe in range(shards)]
+        target.update(zip(stripes, _split(total, shards)))
+    await _move_ledger_balances(current, target, session, None)
+
+
+async def _striped_wallets(session: AsyncSession) -> set[int]:
+    """
+    ### Кошельки, у которых в журнале есть полосы с ненулевым снимком.
+    """
+    accounts = (
+        await session.execute(
+            select(BalanceSnapshot.account).where(
+                BalanceSnapshot.account.like(f"{WALLET_ACCOUNT_PREFIX}%/%"),
+                BalanceSnapshot.balance != 0,
+            )
+        )
+    ).scalars()
+    return {
+        int(account.removeprefix(WALLET_ACCOUNT_PREFIX).split("/")[0])
+        for account in accounts
+    }
+
+
+async def _lock_ledger_wallet(
+    user_id: int, session: AsyncSession, shared: bool = False
+) -> None:
+    """
+    ### Берёт транзакционную advisory-блокировку кошелька (только PostgreSQL).
+    """
+    if dialect_name(session) != POSTGRES:
+        return
+    lock = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+    await session.execute(select(lock(_WALLET_LOCK_CLASS, user_id)))
+
+
+async def _post(
+    entries: list[tuple[str, Decimal]], payment_id: int | None, session: AsyncSession
+) -> list[int]:
+    """
+    ### Записывает проводки одной операции журнала.
+
+    ### Возвращает:
+    - ID проводок в порядке `entries`.
+    """
+    transaction_id = str(uuid.uuid4())
+    result = await session.execute(
+        insert(LedgerEntry).returning(LedgerEntry.entry_id, sort_by_parameter_order=True),
+        [
+            {
+                "transaction_id": transaction_id,
+                "account": account,
+                "amount": amount,
+                "payment_id": payment_id,
+            }
+            for account, amount in entries
+        ],
+    )
+    return list(result.scalars())
+
+
+async def _move_ledger_balances(
+    current: dict[str, Decimal],
+    target: dict[str, Decimal],
+    session: AsyncSession,
+    payment_id: int | None,
+    debit: Decimal = Decimal(0),
+) -> None:
+    """
+    ### Переводит балансы счетов кошелька из `current` в `target`.
+
+    Одна операция журнала: по проводке на каждый изменившийся счёт и,
+    если `debit` не ноль, зачисление списанной суммы на счёт `payments`.
+    Снимки всех счетов из `target` обновляются, поэтому вызывающий должен
+    держать исключительную блокировку кошелька.
+    """
+    entries = [
+        (account, balance - current.get(account, Decimal(0)))
+        for account, balance in target.items()
+        if balance != current.get(account, Decimal(0))
+    ]
+    if debit:
+        entries.append((PAYMENTS_ACCOUNT, debit))
+    if entries:
+        last_entry_id = max(await _post(entries, payment_id, session))
+    else:
+        last_entry_id = (
+            await session.execute(select(func.coalesce(func.max(LedgerEntry.entry_id), 0)))
+        ).scalar_one()
+    for account, balance in target.items():
+        await _save_snapshot(account, balance, last_entry_id, session)
+
+
+async def _save_snapshot(
+    account: str, balance: Decimal, last_entry_id: int, session: AsyncSession
+) -> None:
+    """
+    ### Сворачивает журнал счёта в снимок.
+
+    Вызывается только под блокировкой кошелька (снимок полосы - и под
+    блокировкой полосы), поэтому все проводки счёта с
+    `entry_id <= last_entry_id` уже зафиксированы и учтены в `balance`.
+    """
+    insert = _INSERTS[dialect_name(session)]
+    stmt = insert(BalanceSnapshot).values(
+        account=account, balance=balance, last_entry_id=last_entry_id
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[BalanceSnapshot.account],
+            set_={
+                "balance": stmt.excluded.balance,
+                "last_entry_id": stmt.excluded.last_entry_id,
+            },
+        )
+    )
 
 
 async def check_user_data(user_id: int, amount: Decimal) -> bool:
-    async with async_session() as session:
-        user = await get_user(user_id, session)
-        if user.balance < amount:
+    """
+    ### Предварительная проверка баланса пользователя.
+
+    Проверка допускает отставание и читает реплику (см. `ReadRouter`):
+    окончательно баланс проверяет списание в основной базе.
+    """
+    replica = read_router.use_replica(user_id)
+    async with read_router.session(replica) as session:
+        balance = (await get_user_balances([user_id], session)).get(user_id)
+        if balance is None:
+            raise UserNotFoundError(f"User with id {user_id} not found")
+        if balance < amount:
             raise NotEnoughMoney(f"User with id {user_id} has not enough money")
         return True
@@ -24,3 +24,55 @@ class NotEnoughMoney(NoRetryError):
     def __init__(self, message: str, code: int = None):
         super().__init__(message)
         self.code = code
+
+
+class InvalidStatusTransition(NoRetryError):
+    """Исключение, сигнализирующее о недопустимом переходе статуса платежа."""
+
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = code
+
+
+class RetryQueueFull(MyCustomError):
+    """Исключение, сигнализирующее о переполнении очереди повторных попыток."""
+
+    pass
+
+
+class CircuitOpenError(NoRetryError):
+    """Исключение, сигнализирующее о том, что внешний сервис отключён автоматом (circuit breaker)."""
+
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = code
+
+
+class ExternalServiceError(MyCustomError):
+    """Исключение, сигнализирующее об ошибке, которую вернул внешний сервис."""
+
+    pass
+
+
+class IdempotencyKeyMismatch(NoRetryError):
+    """Исключение, сигнализирующее о повторе ключа идемпотентности с другим телом запроса."""
+
+    pass
+
+
+class IdempotencyKeyInProgress(MyCustomError):
+    """Исключение, сигнализирующее о том, что запрос с этим ключом идемпотентности ещё выполняется."""
+
+    pass
+
+
+class InjectedFault(MyCustomError):
+    """Исключение, имитирующее сбой зависимости по профилю отказов."""
+
+    pass
+
+
+class HedgeCancelled(MyCustomError):
+    """Исключение, сигнализирующее о том, что все дублирующие вызовы отменены изнутри."""
+
+    pass
@@ -1,8 +1,10 @@
 from fastapi import FastAPI
 
+from app.api.metrics.metrics import router as metrics_router
 from app.api.v1.payments import router as payments_router
 from app.api.v2.payments import router as payments_router_v2
 from app.utils.api.lifespan import lifespan
+from app.utils.api.middleware import metrics_middleware
 
 app = FastAPI(
     lifespan=lifespan,
@@ -11,8 +13,11 @@ app = FastAPI(
     version="2.0.0",
 )
 
+app.middleware("http")(metrics_middleware)
+
 app.include_router(payments_router)
 app.include_router(payments_router_v2)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
     import uvicorn
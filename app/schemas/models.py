@@ -2,6 +2,8 @@ from decimal import Decimal
 
 from pydantic import BaseModel, Field
 
+from app.config import PAYMENT_BATCH_MAX_SIZE
+
 
 class PaymentRequest(BaseModel):
     """
@@ -29,6 +31,48 @@ class PaymentResponse(BaseModel):
     )
 
 
+class PaymentBatchRequest(BaseModel):
+    """
+    Модель запроса для пакетного создания платежей.
+    """
+
+    payments: list[PaymentRequest] = Field(
+        ...,
+        min_length=1,
+        max_length=PAYMENT_BATCH_MAX_SIZE,
+        description="Платежи пакета",
+    )
+
+
+class PaymentBatchItem(BaseModel):
+    """
+    Результат создания одного платежа пакета.
+    """
+
+    index: int = Field(..., example=0, description="Позиция платежа в запросе")
+    payment_id: int = Field(..., example=1, description="Уникальный ID платежа")
+    status: str = Field(
+        ..., example="processing", description="`processing` или `failed`"
+    )
+    message: str = Field(
+        ..., example="Платёж в обработке", description="Информация о платеже"
+    )
+
+
+class PaymentBatchResponse(BaseModel):
+    """
+    Модель ответа после пакетного создания платежей.
+    """
+
+    accepted: int = Field(..., example=2, description="Число платежей в обработке")
+    rejected: int = Field(
+        ..., example=0, description="Число платежей, отклонённых проверкой баланса"
+    )
+    results: list[PaymentBatchItem] = Field(
+        ..., description="Результаты в порядке платежей запроса"
+    )
+
+
 class PaymentStatus(BaseModel):
     """
     Модель для получения состояния платежа.
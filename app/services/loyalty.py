@@ -1,12 +1,19 @@
-import asyncio
-import random
 from decimal import Decimal
 
 from fastapi import Body, FastAPI, HTTPException
+from pydantic import BaseModel
 
 from app.config import LOYALTY_HOST, LOYALTY_PORT
+from app.exception.custom_exception import InjectedFault
+from app.utils.faults.profiles import get_fault_injector
 
 app = FastAPI(title="External Loyalty Rewards API", version="1.0.0")
+faults = get_fault_injector("loyalty")
+
+
+class LoyaltyItem(BaseModel):
+    user_id: str
+    amount: str
 
 
 @app.post("/loyalty")
@@ -16,19 +23,43 @@ async def process_loyalty(
 ):
     bonus = Decimal(amount) * Decimal("0.10")
     print(f"Processing loyalty for user {user_id} with amount {amount}")
-    rnd = random.random()
-    if rnd < 0.8:
-        return {
-            "status": "success",
-            "message": "Loyalty points awarded",
-            "bonus": str(bonus),
-        }
-    elif rnd < 0.9:
-        await asyncio.sleep(60)
+    try:
+        await faults.apply()
+    except InjectedFault:
         raise HTTPException(status_code=500, detail="Loyalty service error")
-    else:
+    return {
+        "status": "success",
+        "message": "Loyalty points awarded",
+        "bonus": str(bonus),
+    }
+
+
+@app.post("/loyalty/batch")
+async def process_loyalty_batch(
+    items: list[LoyaltyItem] = Body(
+        ..., embed=True, description="Пачка запросов на начисление баллов"
+    ),
+):
+    print(f"Processing loyalty batch of {len(items)} requests")
+    try:
+        await faults.apply()
+    except InjectedFault:
         raise HTTPException(status_code=500, detail="Loyalty service error")
 
+    results = []
+    for item in items:
+        if faults.item_fails():
+            results.append({"status": "error", "message": "Loyalty service error"})
+        else:
+            results.append(
+                {
+                    "status": "success",
+                    "message": "Loyalty points awarded",
+                    "bonus": str(Decimal(item.amount) * Decimal("0.10")),
+                }
+            )
+    return {"status": "success", "results": results}
+
 
 if __name__ == "__main__":
     import uvicorn
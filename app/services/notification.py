@@ -1,11 +1,17 @@
-import asyncio
-import random
-
 from fastapi import Body, FastAPI, HTTPException
+from pydantic import BaseModel
 
 from app.config import NOTIFICATION_HOST, NOTIFICATION_PORT
+from app.exception.custom_exception import InjectedFault
+from app.utils.faults.profiles import get_fault_injector
 
 app = FastAPI(title="External Notification API", version="1.0.0")
+faults = get_fault_injector("notification")
+
+
+class Notification(BaseModel):
+    user_id: str
+    status: str
 
 
 @app.post("/notify")
@@ -14,14 +20,31 @@ async def notify(
     status: str = Body(..., description="Статус платежа"),
 ):
     print(f"Sending notification for user {user_id} with status {status}")
-    rnd = random.random()
-    if rnd < 0.8:
-        return {"status": "success", "message": "Notification sent"}
-    elif rnd < 0.9:
-        await asyncio.sleep(60)
+    try:
+        await faults.apply()
+    except InjectedFault:
         raise HTTPException(status_code=500, detail="Notification service error")
-    else:
+    return {"status": "success", "message": "Notification sent"}
+
+
+@app.post("/notify/batch")
+async def notify_batch(
+    notifications: list[Notification] = Body(
+        ..., embed=True, description="Пачка уведомлений"
+    ),
+):
+    print(f"Sending batch of {len(notifications)} notifications")
+    try:
+        await faults.apply()
+    except InjectedFault:
         raise HTTPException(status_code=500, detail="Notification service error")
+    return {
+        "status": "success",
+        "message": "Notifications sent",
+        "results": [
+            {"user_id": n.user_id, "status": "success"} for n in notifications
+        ],
+    }
 
 
 if __name__ == "__main__":
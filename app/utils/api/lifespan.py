@@ -3,18 +3,42 @@ from typing import Any
 
 from fastapi import FastAPI
 
-from app.db.payment_db import init_db as init_payment_db
-from app.db.user_db import init_db as init_user_db
+from app.config import JOB_WORKER_ENABLED, STORAGE_BACKEND
+from app.utils.db.init import init_databases
 from app.utils.logger import logger
+from app.utils.processes.jobs import start_job_workers, stop_job_workers
+from app.utils.processes.retry import close_retry_scheduler
+from app.utils.processes.status_buffer import close_status_buffer
+from app.utils.services.http_clients import (close_http_clients,
+                                             init_http_clients)
+from app.utils.services.loyalty_batcher import close_loyalty_batcher
+from app.utils.services.notification_dispatcher import (
+    get_notification_dispatcher, stop_notification_dispatcher)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> Any:
     """
-    Lifespan-контекст для инициализации баз данных.
+    Lifespan-контекст для инициализации баз данных, общих HTTP-клиентов,
+    диспетчера уведомлений и пула воркеров очереди задач
+    (если `JOB_WORKER_ENABLED`).
+
+    Базы `STORAGE_BACKEND=memory` существуют только внутри процесса, поэтому
+    создаются при запуске.
     """
-    #await init_user_db()
-    # logger.info("База данных пользователей инициализирована")
-    # await init_payment_db()
-    # logger.info("База данных платежей инициализирована")
-    yield
+    if STORAGE_BACKEND == "memory":
+        await init_databases()
+        logger.info("Базы данных в памяти инициализированы")
+    await init_http_clients()
+    get_notification_dispatcher()
+    if JOB_WORKER_ENABLED:
+        await start_job_workers()
+    try:
+        yield
+    finally:
+        await stop_job_workers()
+        await close_status_buffer()
+        await stop_notification_dispatcher()
+        await close_loyalty_batcher()
+        await close_retry_scheduler()
+        await close_http_clients()
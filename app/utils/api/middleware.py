@@ -0,0 +1,27 @@
+import time
+
+from fastapi import Request, Response
+
+from app.utils.metrics.metrics import HTTP_REQUEST_SECONDS
+
+
+async def metrics_middleware(request: Request, call_next) -> Response:
+    """
+    ### Замеряет время обработки HTTP-запроса по шаблону маршрута.
+
+    Для потоковых ответов (SSE) замеряется время до отправки заголовков.
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status,
+        )
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Awaitable, Callable
+
+from app.config import PAYMENT_CACHE_MAX_SIZE, PAYMENT_CACHE_TTL
+from app.db.payment_db import PAYMENT_FAILED, PAYMENT_SUCCESS
+from app.db.payment_db import get_payment_record, read_router
+from app.schemas.models import PaymentStatus
+from app.utils.processes.deadline import deadline, detached
+from app.utils.processes.retry_policy import PAYMENT_DB_READ
+
+PaymentLoader = Callable[[int], Awaitable[PaymentStatus | None]]
+
+
+def is_final(payment: PaymentStatus) -> bool:
+    """
+    ### Проверяет, что состояние платежа больше не изменится.
+
+    Успешный платёж с нулевым бонусом ещё может получить бонус из фоновой
+    задачи начисления, поэтому окончательным не считается.
+    """
+    if payment.status == PAYMENT_FAILED:
+        return True
+    return payment.status == PAYMENT_SUCCESS and payment.bonus > Decimal("0")
+
+
+class PaymentCache:
+    """
+    ### Read-through кэш статусов платежей.
+
+    Окончательные состояния хранятся без срока жизни (до вытеснения LRU),
+    промежуточные - не дольше `ttl` секунд и сбрасываются при обновлении
+    статуса. Одновременные промахи по одному платежу объединяются в один
+    запрос к базе (singleflight).
+    """
+
+    def __init__(
+        self, max_size: int = PAYMENT_CACHE_MAX_SIZE, ttl: float = PAYMENT_CACHE_TTL
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: OrderedDict[int, tuple[PaymentStatus, float | None]] = (
+            OrderedDict()
+        )
+        self._loading: dict[int, asyncio.Future] = {}
+
+    def _lookup(self, payment_id: int) -> PaymentStatus | None:
+        entry = self._entries.get(payment_id)
+        if entry is None:
+            return None
+        payment, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[payment_id]
+            return None
+        self._entries.move_to_end(payment_id)
+        return payment
+
+    def _store(self, payment: PaymentStatus) -> None:
+        expires_at = None if is_final(payment) else time.monotonic() + self.ttl
+        self._entries[payment.payment_id] = (payment, expires_at)
+        self._entries.move_to_end(payment.payment_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(
+        self, payment_id: int, loader: PaymentLoader
+    ) -> PaymentStatus | None:
+        """
+        ### Возвращает статус платежа из кэша или загружает его через `loader`.
+        """
+        payment = self._lookup(payment_id)
+        if payment is not None:
+            self.hits += 1
+            return payment
+
+        self.misses += 1
+        future = self._loading.get(payment_id)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = detached(loader(payment_id))
+            self._loading[payment_id] = future
+            future.add_done_callback(lambda done: self._on_loaded(payment_id, done))
+        return await asyncio.shield(future)
+
+    def _on_loaded(self, payment_id: int, future: asyncio.Future) -> None:
+        failed = future.cancelled() or future.exception() is not None
+        if self._loading.get(payment_id) is not future:
+            # Платёж был инвалидирован во время загрузки, результат может быть устаревшим.
+            return
+        del self._loading[payment_id]
+        if failed:
+            return
+        payment = future.result()
+        if payment is not None:
+            self._store(payment)
+
+    def invalidate(self, payment_id: int) -> None:
+        """
+        ### Сбрасывает закэшированное и загружаемое состояние платежа.
+        """
+        self._entries.pop(payment_id, None)
+        self._loading.pop(payment_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+payment_cache = PaymentCache()
+
+
+async def load_payment_status(payment_id: int) -> PaymentStatus | None:
+    """
+    ### Загружает статус платежа из базы платежей.
+
+    Чтение идёт в реплику, если `read_router` это допускает. Платёж, которого
+    на реплике ещё нет (создан только что, в том числе другим процессом),
+    перечитывается из основной базы.
+    """
+
+    async def fetch_payment(replica: bool):
+        async with read_router.session(
+            replica, expire_on_commit=False
+        ) as payment_session:
+            return await get_payment_record(payment_id, payment_session)
+
+    replica = read_router.use_replica(payment_id)
+    async with deadline(5.0):
+        payment = await PAYMENT_DB_READ.run(lambda: fetch_payment(replica))
+        if payment is None and replica:
+            payment = await PAYMENT_DB_READ.run(lambda: fetch_payment(False))
+
+    if payment is None:
+        return None
+    return PaymentStatus(
+        payment_id=payment.payment_id,
+        user_id=payment.user_id,
+        amount=payment.amount,
+        currency=payment.currency,
+        status=payment.status,
+        bonus=payment.bonus,
+        message=payment.message,
+    )
+
+
+async def get_payment_status(payment_id: int) -> PaymentStatus | None:
+    """
+    ### Возвращает статус платежа через read-through кэш.
+    """
+    return await payment_cache.get(payment_id, load_payment_status)
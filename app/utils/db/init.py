@@ -1,15 +1,28 @@
 import asyncio
 
+from app.db.idempotency_db import init_db as init_idempotency_db
+from app.db.job_db import init_db as init_job_db
 from app.db.payment_db import init_db as init_payment_db
 from app.db.user_db import init_db as init_user_db
 from app.utils.logger import logger
 
 
-async def main():
+async def init_databases():
+    """
+    ### Создаёт базы и таблицы пользователей, платежей, очереди задач и ключей идемпотентности.
+    """
     await init_user_db()
     logger.info("База данных пользователей инициализирована")
     await init_payment_db()
     logger.info("База данных платежей инициализирована")
+    await init_job_db()
+    logger.info("Очередь задач инициализирована")
+    await init_idempotency_db()
+    logger.info("Таблица ключей идемпотентности инициализирована")
+
+
+async def main():
+    await init_databases()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+import asyncio
+
+
+class PaymentEventBus:
+    """
+    ### Внутрипроцессная шина событий изменения статуса платежа.
+
+    Подписчик - это одна Future в наборе ожидающих платежа, поэтому тысячи
+    простаивающих подписчиков почти ничего не стоят. Событие лишь сообщает,
+    что статус изменился: актуальное состояние подписчик читает сам.
+    """
+
+    def __init__(self):
+        self._waiters: dict[int, set[asyncio.Future]] = {}
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def subscribe(self, payment_id: int) -> asyncio.Future:
+        """
+        ### Регистрирует ожидание следующего изменения статуса платежа.
+
+        Подписываться нужно до чтения текущего статуса, чтобы не пропустить
+        изменение между чтением и ожиданием.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(payment_id, set()).add(future)
+        return future
+
+    def unsubscribe(self, payment_id: int, future: asyncio.Future) -> None:
+        waiters = self._waiters.get(payment_id)
+        if waiters is None:
+            return
+        waiters.discard(future)
+        if not waiters:
+            del self._waiters[payment_id]
+
+    def publish(self, payment_id: int) -> None:
+        """
+        ### Будит всех подписчиков платежа.
+        """
+        for future in self._waiters.pop(payment_id, ()):
+            if not future.done():
+                future.set_result(None)
+
+    async def wait(
+        self, payment_id: int, future: asyncio.Future, timeout: float
+    ) -> bool:
+        """
+        ### Ждёт события по подписке не дольше `timeout` секунд.
+
+        ### Возвращает:
+        - `True`, если статус платежа изменился.
+        """
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.unsubscribe(payment_id, future)
+
+
+payment_events = PaymentEventBus()
@@ -0,0 +1,38 @@
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.util import await_only
+
+from app.exception.custom_exception import InjectedFault
+from app.utils.faults.profiles import get_fault_injector
+from app.utils.logger import logger
+
+
+def install_db_faults(target: str, engine: AsyncEngine) -> None:
+    """
+    ### Подключает профиль отказов к запросам движка базы данных.
+
+    Перед каждым запросом (кроме DDL) выдерживается задержка из профиля,
+    сбой поднимается как `OperationalError`, то есть так же, как ошибка
+    драйвера. Если профиль не задаёт сбоев для `target`, обработчик не
+    устанавливается.
+
+    ### Параметры:
+    - **target**: Имя базы в профиле (`payment_db`, `user_db`).
+    - **engine**: Асинхронный движок базы.
+    """
+    injector = get_fault_injector(target)
+    if not injector.enabled:
+        return
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def inject(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and context.isddl:
+            return
+        try:
+            # Обработчик вызывается в гринлете асинхронного движка, поэтому
+            # может дождаться корутины, не блокируя цикл событий.
+            await_only(injector.apply())
+        except InjectedFault as e:
+            raise exc.OperationalError(statement, parameters, e) from e
+
+    logger.warning("Профиль отказов подключён к базе %s: %s", target, injector.spec)
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import random
+from typing import Any
+
+from app.config import FAULT_PROFILE, FAULT_PROFILES_FILE, FAULT_SEED
+from app.exception.custom_exception import InjectedFault
+from app.utils.metrics.metrics import FAULTS_INJECTED
+
+HANG = "hang"
+ERROR = "error"
+
+# Профиль - набор настроек сбоев по зависимостям. Ключ `db` относится ко всем
+# базам и их репликам, если для `payment_db`, `user_db`, `payment_replica_db`
+# или `user_replica_db` не задан свой.
+BUILTIN_PROFILES: dict[str, dict[str, dict[str, Any]]] = {
+    "healthy": {
+        "loyalty": {"latency": {"distribution": "uniform", "low": 0.005, "high": 0.02}},
+        "notification": {
+            "latency": {"distribution": "uniform", "low": 0.005, "high": 0.02}
+        },
+    },
+    # Прежнее поведение заглушек: 80% успехов, 10% зависаний, 10% ошибок.
+    "flaky": {
+        "loyalty": {
+            "hang_rate": 0.1,
+            "hang_seconds": 60,
+            "error_rate": 0.1,
+            "item_error_rate": 0.1,
+        },
+        "notification": {"hang_rate": 0.1, "hang_seconds": 60, "error_rate": 0.1},
+    },
+    "brownout": {
+        "loyalty": {
+            "latency": {"distribution": "lognormal", "median": 0.3, "sigma": 0.8},
+            "hang_rate": 0.02,
+            "hang_seconds": 10,
+            "error_rate": 0.05,
+            "item_error_rate": 0.05,
+        },
+        "notification": {
+            "latency": {"distribution": "lognormal", "median": 0.2, "sigma": 0.6},
+            "error_rate": 0.05,
+        },
+        "db": {
+            "latency": {"distribution": "lognormal", "median": 0.02, "sigma": 1.0},
+            "error_rate": 0.01,
+        },
+    },
+    "outage": {
+        "loyalty": {"hang_rate": 0.5, "hang_seconds": 30, "error_rate": 0.5},
+        "notification": {"error_rate": 1.0},
+        "db": {
+            "latency": {"distribution": "uniform", "low": 0.1, "high": 0.5},
+            "hang_rate": 0.2,
+            "hang_seconds": 5,
+            "error_rate": 0.3,
+        },
+    },
+}
+
+_DB_TARGETS = ("payment_db", "user_db", "payment_replica_db", "user_replica_db")
+
+
+def _sample_latency(spec: dict[str, Any] | None, rnd: random.Random) -> float:
+    if not spec:
+        return 0.0
+    distribution = spec.get("distribution", "constant")
+    if distribution == "constant":
+        return float(spec["value"])
+    if distribution == "uniform":
+        return rnd.uniform(spec["low"], spec["high"])
+    if distribution == "exponential":
+        return rnd.expovariate(1 / spec["mean"])
+    if distribution == "lognormal":
+        return rnd.lognormvariate(0, spec["sigma"]) * spec["median"]
+    raise ValueError(f"Неизвестное распределение задержки: {distribution}")
+
+
+class FaultInjector:
+    """
+    ### Вносит задержки и сбои в обращения к одной зависимости.
+
+    ### Параметры:
+    - **target**: Имя зависимости (`loyalty`, `notification`, `payment_db`,
+      `user_db`, `payment_replica_db`, `user_replica_db`).
+    - **spec**: Настройки сбоев из профиля:
+      `latency` - распределение задержки (`constant`, `uniform`, `exponential`,
+      `lognormal`), `error_rate` - доля ошибок, `hang_rate` и `hang_seconds` -
+      доля и длительность зависаний перед ошибкой, `item_error_rate` - доля
+      ошибок отдельных элементов пакетного запроса.
+    - **seed**: Зерно генератора. Одинаковое зерно даёт одинаковую
+      последовательность решений для зависимости.
+    """
+
+    def __init__(self, target: str, spec: dict[str, Any], seed: int | None = None):
+        self.target = target
+        self.spec = spec
+        self.error_rate = float(spec.get("error_rate", 0))
+        self.hang_rate = float(spec.get("hang_rate", 0))
+        self.hang_seconds = float(spec.get("hang_seconds", 60))
+        self.item_error_rate = float(spec.get("item_error_rate", 0))
+        self._random = random.Random(None if seed is None else f"{seed}:{target}")
+        # Проверяет распределение задержки при загрузке профиля, а не при
+        # первом обращении.
+        _sample_latency(spec.get("latency"), random.Random(0))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            self.spec.get("latency")
+            or self.error_rate
+            or self.hang_rate
+            or self.item_error_rate
+        )
+
+    def draw(self) -> tuple[float, str | None]:
+        """
+        ### Решение для очередного обращения.
+
+        ### Возвращает:
+        - Задержку в секундах и вид сбоя: `hang`, `error` или `None`.
+        """
+        rnd = self._random.random()
+        delay = _sample_latency(self.spec.get("latency"), self._random)
+        if rnd < self.hang_rate:
+            return self.hang_seconds, HANG
+        if rnd < self.hang_rate + self.error_rate:
+            return delay, ERROR
+        return delay, None
+
+    def item_fails(self) -> bool:
+        """
+        ### Завершается ли ошибкой очередной элемент пакетного запроса.
+        """
+        if self._random.random() < self.item_error_rate:
+            FAULTS_INJECTED.inc(target=self.target, kind="item_error")
+            return True
+        return False
+
+    async def apply(self) -> None:
+        """
+        ### Выдерживает задержку и при необходимости имитирует сбой.
+
+        ### Исключения:
+        - `InjectedFault`, если профиль назначил ошибку или зависание.
+        """
+        delay, kind = self.draw()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if kind is not None:
+            FAULTS_INJECTED.inc(target=self.target, kind=kind)
+            raise InjectedFault(f"{self.target}: сбой по профилю отказов ({kind})")
+
+
+def load_profiles(path: str = FAULT_PROFILES_FILE) -> dict[str, dict[str, dict]]:
+    """
+    ### Встроенные профили, дополненные профилями из JSON-файла.
+
+    Профиль из файла с тем же именем заменяет встроенный целиком.
+    """
+    profiles = dict(BUILTIN_PROFILES)
+    if path:
+        with open(path, encoding="utf-8") as file:
+            profiles.update(json.load(file))
+    return profiles
+
+
+def _target_spec(profile: dict[str, dict], target: str) -> dict[str, Any]:
+    if target in profile:
+        return profile[target]
+    if target in _DB_TARGETS:
+        return profile.get("db", {})
+    return {}
+
+
+_injectors: dict[str, FaultInjector] = {}
+_profile: dict[str, dict] | None = None
+
+
+def get_fault_injector(target: str) -> FaultInjector:
+    """
+    ### Возвращает injector зависимости для профиля `FAULT_PROFILE`.
+    """
+    global _profile
+    injector = _injectors.get(target)
+    if injector is None:
+        if _profile is None:
+            profiles = load_profiles()
+            if FAULT_PROFILE not in profiles:
+                raise ValueError(
+                    f"Неизвестный профиль отказов {FAULT_PROFILE}, "
+                    f"доступны: {', '.join(sorted(profiles))}"
+                )
+            _profile = profiles[FAULT_PROFILE]
+        injector = FaultInjector(target, _target_spec(_profile, target), FAULT_SEED)
+        _injectors[target] = injector
+    return injector
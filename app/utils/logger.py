@@ -1,18 +1,187 @@
+import atexit
+import contextvars
+import json
 import logging
 import os
+import queue
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Iterator
+
+from app.config import (LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE,
+                        LOG_RATE_INTERVAL, LOG_RATE_LIMIT)
 
 ROOT_DIR = os.getcwd()
 
 LOG_FILE = os.path.join(ROOT_DIR, "app.log")
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+CONTEXT_FIELDS = ("payment_id", "user_id")
+
+_log_context: contextvars.ContextVar[dict[str, Any]] = contextvars.ContextVar(
+    "log_context", default={}
+)
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    ### Добавляет поля (`payment_id`, `user_id`) ко всем записям лога внутри блока.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def bind_log_context(**fields: Any) -> None:
+    """
+    ### Добавляет поля к записям лога до конца текущей задачи.
+    """
+    _log_context.set({**_log_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """
+    ### Переносит поля контекста в запись лога.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        for name in CONTEXT_FIELDS:
+            setattr(record, name, context.get(name))
+        record.context = "".join(
+            f" {name}={context[name]}" for name in CONTEXT_FIELDS if name in context
+        )
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    ### Ограничивает частоту однотипных предупреждений.
+
+    Тип сообщения - его шаблон (`record.msg`) до подстановки аргументов:
+    за `interval` секунд проходит не более `limit` записей шаблона, число
+    пропущенных добавляется к первой записи следующего интервала. Ошибки
+    не ограничиваются.
+    """
+
+    def __init__(
+        self,
+        limit: int = LOG_RATE_LIMIT,
+        interval: float = LOG_RATE_INTERVAL,
+        level: int = logging.WARNING,
+    ):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.level = level
+        self._windows: dict[tuple[str, Any], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0 or record.levelno != self.level:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window is not None else 0
+            self._windows[key] = [now, 1, 0]
+            if (
+                suppressed
+                and isinstance(record.msg, str)
+                and isinstance(record.args, tuple)
+            ):
+                record.msg = f"{record.msg} (пропущено похожих: %s)"
+                record.args = record.args + (suppressed,)
+            return True
+        if window[1] < self.limit:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    ### Форматирует запись лога одной строкой JSON.
+    """
 
-file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
-file_handler.setLevel(logging.INFO)
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
 
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-file_handler.setFormatter(formatter)
 
-if not logger.handlers:
-    logger.addHandler(file_handler)
+class DroppingQueueHandler(QueueHandler):
+    """
+    ### Передаёт записи в поток записи лога, не блокируя вызывающий код.
+
+    При переполнении очереди запись отбрасывается.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _build_formatter() -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s%(context)s"
+    )
+
+
+def _setup_logging() -> QueueListener:
+    formatter = _build_formatter()
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RateLimitFilter())
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(
+        queue_handler.queue,
+        console_handler,
+        file_handler,
+        respect_handler_level=True,
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# Запись в файл и консоль выполняется в отдельном потоке, поэтому
+# логирование не блокирует цикл событий.
+_listener = _setup_logging()
+
+logger = logging.getLogger(__name__)
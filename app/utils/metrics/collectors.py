@@ -0,0 +1,72 @@
+from app.utils.events.payment_events import payment_events
+from app.utils.logger import logger
+from app.utils.metrics.metrics import (BACKLOG, BACKLOG_OLDEST_AGE,
+                                       CIRCUIT_BREAKER_OPEN,
+                                       NOTIFICATIONS_DROPPED,
+                                       RETRY_ATTEMPTS, RETRY_BUDGET_TOKENS,
+                                       RETRY_CALLS, RETRY_GIVE_UPS,
+                                       RETRY_RETRIES)
+from app.utils.metrics.registry import REGISTRY
+from app.utils.processes.deadline import deadline
+from app.utils.processes.jobs import get_job_queue_stats
+from app.utils.processes.keyed_lock import wallet_locks
+from app.utils.processes.retry import get_retry_scheduler_stats
+from app.utils.processes.retry_policy import get_retry_stats
+from app.utils.processes.status_buffer import get_status_buffer_depth
+from app.utils.services.circuit_breaker import (HALF_OPEN, OPEN,
+                                                get_circuit_breaker_states)
+from app.utils.services.notification_dispatcher import get_notification_stats
+
+JOB_STATS_TIMEOUT = 1.0
+
+_BREAKER_STATES = {OPEN: 1.0, HALF_OPEN: 0.5}
+
+
+@REGISTRY.collector
+def collect_retries() -> None:
+    stats = get_retry_stats()
+    for name, policy in stats["policies"].items():
+        RETRY_CALLS.set_total(policy["calls"], policy=name)
+        RETRY_ATTEMPTS.set_total(policy["attempts"], policy=name)
+        RETRY_RETRIES.set_total(policy["retries"], policy=name)
+        RETRY_GIVE_UPS.set_total(policy["give_ups"], policy=name)
+    for name, budget in stats["budgets"].items():
+        RETRY_BUDGET_TOKENS.set(budget["tokens"], dependency=name)
+
+
+@REGISTRY.collector
+def collect_in_process_backlog() -> None:
+    notifications = get_notification_stats()
+    BACKLOG.set(notifications["depth"], queue="notifications")
+    NOTIFICATIONS_DROPPED.set_total(notifications["dropped"])
+
+    scheduler = get_retry_scheduler_stats()
+    BACKLOG.set(scheduler["depth"], queue="retry_scheduler")
+    BACKLOG_OLDEST_AGE.set(scheduler["oldest_pending_age"], queue="retry_scheduler")
+
+    BACKLOG.set(wallet_locks.size, queue="wallet_locks")
+    BACKLOG.set(get_status_buffer_depth(), queue="status_buffer")
+    BACKLOG.set(payment_events.subscribers, queue="payment_subscribers")
+
+    for name, state in get_circuit_breaker_states().items():
+        CIRCUIT_BREAKER_OPEN.set(_BREAKER_STATES.get(state, 0.0), service=name)
+
+
+@REGISTRY.collector
+async def collect_job_queue() -> None:
+    try:
+        async with deadline(JOB_STATS_TIMEOUT):
+            stats = await get_job_queue_stats()
+    except Exception as e:
+        logger.warning("Не удалось получить статистику очереди задач: %s", e)
+        return
+    for status in ("pending", "running", "dead"):
+        BACKLOG.set(stats[status], queue=f"jobs_{status}")
+    BACKLOG_OLDEST_AGE.set(stats["oldest_pending_age"], queue="jobs")
+
+
+async def render_metrics() -> str:
+    """
+    ### Возвращает метрики процесса в текстовом формате Prometheus.
+    """
+    return await REGISTRY.render()
@@ -0,0 +1,129 @@
+import time
+
+from app.utils.metrics.registry import Counter, Gauge, Histogram
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    labels=("method", "route", "status"),
+)
+PAYMENT_STAGE_SECONDS = Histogram(
+    "payment_stage_duration_seconds",
+    "Время выполнения этапа обработки платежа",
+    labels=("stage", "outcome"),
+)
+DOWNSTREAM_CALL_SECONDS = Histogram(
+    "downstream_call_duration_seconds",
+    "Время вызова внешнего сервиса",
+    labels=("service", "outcome"),
+)
+JOB_SECONDS = Histogram(
+    "job_duration_seconds",
+    "Время выполнения задачи из очереди",
+    labels=("kind", "outcome"),
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Время ожидания соединения из пула базы данных",
+    labels=("pool",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Число неудачных ожиданий соединения из пула базы данных",
+    labels=("pool",),
+)
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Число выданных соединений пула базы данных",
+    labels=("pool",),
+)
+DB_POOL_SIZE = Gauge(
+    "db_pool_size",
+    "Размер пула соединений базы данных",
+    labels=("pool",),
+)
+
+RETRY_CALLS = Counter(
+    "retry_policy_calls_total", "Число вызовов через политику повторов", ("policy",)
+)
+RETRY_ATTEMPTS = Counter(
+    "retry_policy_attempts_total", "Число попыток политики повторов", ("policy",)
+)
+RETRY_RETRIES = Counter(
+    "retry_policy_retries_total", "Число повторов политики повторов", ("policy",)
+)
+RETRY_GIVE_UPS = Counter(
+    "retry_policy_give_ups_total",
+    "Число отказов от повторов (попытки, срок или бюджет исчерпаны)",
+    ("policy",),
+)
+RETRY_BUDGET_TOKENS = Gauge(
+    "retry_budget_tokens", "Остаток бюджета повторов зависимости", ("dependency",)
+)
+
+BACKLOG = Gauge(
+    "background_backlog",
+    "Число ожидающих элементов фоновой обработки",
+    labels=("queue",),
+)
+BACKLOG_OLDEST_AGE = Gauge(
+    "background_backlog_oldest_age_seconds",
+    "Возраст самого старого ожидающего элемента фоновой обработки",
+    labels=("queue",),
+)
+NOTIFICATIONS_DROPPED = Counter(
+    "notifications_dropped_total",
+    "Число уведомлений, отброшенных при переполнении очереди",
+)
+CIRCUIT_BREAKER_OPEN = Gauge(
+    "circuit_breaker_open",
+    "Состояние автомата отключения: 0 - замкнут, 0.5 - пробные вызовы, 1 - разомкнут",
+    labels=("service",),
+)
+DB_READS = Counter(
+    "db_reads_total",
+    "Число чтений, допускающих отставание, по выбранной базе",
+    labels=("database", "target"),
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds",
+    "Отставание реплики базы данных при последней проверке",
+    labels=("database",),
+)
+WALLET_SHARD_REBALANCES = Counter(
+    "wallet_shard_rebalances_total",
+    "Число перераспределений баланса между шардами кошелька",
+)
+FAULTS_INJECTED = Counter(
+    "faults_injected_total",
+    "Число сбоев, внесённых профилем отказов",
+    labels=("target", "kind"),
+)
+
+
+class OutcomeTimer:
+    """
+    ### Замеряет блок кода с меткой исхода `ok` или `error`.
+    """
+
+    def __init__(self, histogram: Histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.histogram.observe(
+            time.perf_counter() - self._start,
+            outcome="ok" if exc_type is None else "error",
+            **self.labels,
+        )
+
+
+def stage_timer(stage: str) -> OutcomeTimer:
+    """
+    ### Замеряет этап обработки платежа.
+    """
+    return OutcomeTimer(PAYMENT_STAGE_SECONDS, stage=stage)
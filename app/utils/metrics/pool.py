@@ -0,0 +1,46 @@
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.utils.metrics.metrics import (DB_POOL_CHECKOUT_SECONDS,
+                                       DB_POOL_CHECKOUT_TIMEOUTS,
+                                       DB_POOL_IN_USE, DB_POOL_SIZE)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    ### Пул соединений, замеряющий ожидание свободного соединения.
+    """
+
+    metrics_name = "default"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.inc(pool=self.metrics_name)
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(
+                time.perf_counter() - start, pool=self.metrics_name
+            )
+
+
+def timed_pool_class(name: str) -> type[TimedQueuePool]:
+    """
+    ### Возвращает класс пула для `create_async_engine(poolclass=...)`.
+
+    Класс, а не экземпляр, нужен потому, что движок пересоздаёт пул при
+    `dispose()`.
+    """
+    return type(f"TimedQueuePool_{name}", (TimedQueuePool,), {"metrics_name": name})
+
+
+def register_pool_metrics(name: str, engine) -> None:
+    """
+    ### Публикует число выданных соединений и размер пула движка.
+    """
+    DB_POOL_IN_USE.set_function(lambda: engine.pool.checkedout(), pool=name)
+    DB_POOL_SIZE.set_function(lambda: engine.pool.size(), pool=name)
@@ -1,12 +1,60 @@
-import asyncio
 from decimal import Decimal
 
+from app.exception.custom_exception import NoRetryError
 from app.utils.logger import logger
+from app.utils.metrics.metrics import stage_timer
+from app.utils.processes.jobs import job_handler
 from app.utils.processes.protected import (protected_process_transaction,
+                                           protected_update_payment_bonus,
                                            protected_update_payment_status)
-from app.utils.processes.retry import retry_until_success_service
-from app.utils.services.call_services import (call_loyalty_service,
-                                              call_notification_service)
+from app.utils.services.call_services import call_loyalty_service
+from app.utils.services.notification_dispatcher import dispatch_notification
+
+PROCESS_PAYMENT_JOB = "process_payment"
+FINALIZE_PAYMENT_JOB = "finalize_payment"
+AWARD_LOYALTY_JOB = "award_loyalty"
+
+
+def payment_job_payload(
+    payment_id: int,
+    user_id: int,
+    amount: Decimal,
+    currency: str,
+    bonus: Decimal | None = None,
+) -> dict:
+    """
+    ### Формирует JSON-параметры задачи обработки платежа.
+    """
+    payload = {
+        "payment_id": payment_id,
+        "user_id": user_id,
+        "amount": str(amount),
+        "currency": currency,
+    }
+    if bonus is not None:
+        payload["bonus"] = str(bonus)
+    return payload
+
+
+def loyalty_job(
+    payment_id: int, user_id: int, amount: Decimal, update_bonus: bool
+) -> tuple[str, dict]:
+    """
+    ### Задача начисления бонусов, повторяемого до успеха.
+
+    Ставится в очередь вместе с переводом платежа в `success` (см.
+    `protected_process_transaction`), поэтому начисление не теряется при сбое
+    между переходом и постановкой и не дублируется при повторе обработки.
+
+    ### Параметры:
+    - **update_bonus**: Записать полученные бонусы в платёж.
+    """
+    return AWARD_LOYALTY_JOB, {
+        "payment_id": payment_id,
+        "user_id": user_id,
+        "amount": str(amount),
+        "update_bonus": update_bonus,
+    }
 
 
 async def process_payment(
@@ -21,8 +69,13 @@ async def process_payment(
     В рамках транзакции в базе пользователей проверяется наличие достаточных средств на кошельке.
     Если средств достаточно, они списываются, и статус платежа обновляется.
     Если обновление статуса успешно, транзакция коммитится, и вызываются внешние сервисы.
-    Сервис уведомлений запускается один раз без ретраев.
-    Сервис лояльности запускается в фоновом режиме и повторяется до достижения успеха.
+    Уведомление ставится в очередь пакетной отправки.
+    Начисление бонусов ставится в очередь задач вместе с переводом в `success`
+    и повторяется до достижения успеха.
+
+    Платёж переводится в `failed` только при `NoRetryError` (пользователь не
+    найден, недостаточно средств). Остальные ошибки пробрасываются, и очередь
+    повторяет задачу с задержкой.
 
     ### Параметры:
     - **payment_id**: ID платежа.
@@ -30,33 +83,25 @@ async def process_payment(
     - **amount**: Сумма платежа.
     - **currency**: Валюта платежа.
     """
-    logger.info(f"Начало обработки платежа {payment_id}")
+    logger.info("Начало обработки платежа %s", payment_id)
 
     try:
-        await protected_process_transaction(
-            payment_id, user_id, amount, Decimal("0.00")
-        )
-        try:
-            await call_notification_service(user_id, "success")
-        except Exception as e:
-            logger.warning(
-                f"Сервис уведомлений вернул ошибку для платежа {payment_id}: {e}"
-            )
-
-        async def call_loyalty():
-            return await call_loyalty_service(user_id, amount)
-
-        asyncio.create_task(
-            retry_until_success_service(
-                coro=call_loyalty,
-                description=f"loyalty-payment_id:{payment_id}",
+        with stage_timer("transaction"):
+            processed = await protected_process_transaction(
+                payment_id,
+                user_id,
+                amount,
+                Decimal("0.00"),
+                job=loyalty_job(payment_id, user_id, amount, update_bonus=False),
             )
-        )
-    except Exception as e:
-        logger.error(f"Ошибка обработки платежа {payment_id}: {e}")
+    except NoRetryError as e:
+        logger.error("Ошибка обработки платежа %s: %s", payment_id, e)
         await protected_update_payment_status(
             payment_id, "failed", f"Ошибка обработки платежа:{str(e)}", Decimal("0.00")
         )
+        return
+    if processed:
+        dispatch_notification(user_id, "success")
 
 
 async def finalize_payment(
@@ -67,8 +112,12 @@ async def finalize_payment(
 
     - Вычитает сумму с баланса пользователя.
     - Обновляет запись платежа, устанавливая количество бонусов.
-    - Выполняет ретрай начисления бонусов до успешного результата.
-    - Отправляет финальное уведомление с итоговым статусом.
+    - Ничего не делает, если платёж уже завершён другим обработчиком.
+    - Ставит в очередь начисление бонусов до успешного результата вместе с
+      переводом в `success`, если они не были рассчитаны при создании платежа.
+    - Ставит финальное уведомление в очередь пакетной отправки.
+    - Переводит платёж в `failed` только при `NoRetryError`, остальные ошибки
+      пробрасывает для повтора задачи.
 
     ### Параметры:
     - **payment_id**: ID платежа.
@@ -77,39 +126,66 @@ async def finalize_payment(
     - **currency**: Валюта платежа.
     - **bonus**: Количество бонусов.
     """
-    logger.info(f"Начало фоновой обработки платежа {payment_id}")
+    logger.info("Начало фоновой обработки платежа %s", payment_id)
+    job = None
+    if bonus == Decimal("0.00"):
+        job = loyalty_job(payment_id, user_id, amount, update_bonus=True)
     try:
-        await protected_process_transaction(payment_id, user_id, amount, bonus)
-
-        try:
-            await call_notification_service(user_id, "success")
-        except Exception as e:
-            logger.warning(
-                f"Ошибка отправки финального уведомления для платежа {payment_id}: {e}"
+        with stage_timer("transaction"):
+            processed = await protected_process_transaction(
+                payment_id, user_id, amount, bonus, job=job
             )
-
-        if bonus == Decimal("0.00"):
-
-            async def call_loyalty():
-                return await call_loyalty_service(user_id, amount)
-
-            loyalty_response = await asyncio.create_task(
-                retry_until_success_service(
-                    coro=call_loyalty,
-                    description=f"loyalty-payment_id:{payment_id}",
-                )
-            )
-
-            bonus = Decimal(loyalty_response.get("bonus", 0))
-            await protected_update_payment_status(
-                payment_id,
-                "success",
-                "Фоновая операция по зачислению бонусов прошла успешно.",
-                bonus,
-            )
-
-    except Exception as e:
-        logger.error(f"Ошибка обработки платежа {payment_id}: {e}")
+    except NoRetryError as e:
+        logger.error("Ошибка обработки платежа %s: %s", payment_id, e)
         await protected_update_payment_status(
             payment_id, "failed", f"Ошибка обработки платежа:{str(e)}"
         )
+        return
+    if processed:
+        dispatch_notification(user_id, "success")
+
+
+@job_handler(PROCESS_PAYMENT_JOB)
+async def process_payment_job(payload: dict) -> None:
+    await process_payment(
+        payload["payment_id"],
+        payload["user_id"],
+        Decimal(payload["amount"]),
+        payload["currency"],
+    )
+
+
+@job_handler(FINALIZE_PAYMENT_JOB)
+async def finalize_payment_job(payload: dict) -> None:
+    await finalize_payment(
+        payload["payment_id"],
+        payload["user_id"],
+        Decimal(payload["amount"]),
+        payload["currency"],
+        Decimal(payload["bonus"]),
+    )
+
+
+@job_handler(AWARD_LOYALTY_JOB, max_attempts=None)
+async def award_loyalty_job(payload: dict) -> None:
+    """
+    ### Одна попытка начисления бонусов.
+
+    Ошибка или неуспешный ответ сервиса возвращают задачу в очередь
+    с экспоненциальной задержкой, пока начисление не пройдёт успешно.
+    """
+    payment_id = payload["payment_id"]
+    with stage_timer("loyalty"):
+        result = await call_loyalty_service(
+            payload["user_id"], Decimal(payload["amount"])
+        )
+    if result.get("status") != "success":
+        raise Exception(f"Сервис лояльности вернул неуспешный ответ: {result}")
+    logger.info("Бонусы для платежа %s начислены: %s", payment_id, result)
+
+    if payload.get("update_bonus"):
+        await protected_update_payment_bonus(
+            payment_id,
+            Decimal(result.get("bonus", 0)),
+            "Фоновая операция по зачислению бонусов прошла успешно.",
+        )
@@ -0,0 +1,74 @@
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Coroutine
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+def remaining() -> float | None:
+    """
+    ### Возвращает оставшееся время текущего запроса или задачи в секундах.
+
+    ### Возвращает:
+    - `None`, если срок не задан.
+    """
+    when = _deadline.get()
+    if when is None:
+        return None
+    return max(when - asyncio.get_running_loop().time(), 0.0)
+
+
+def check_deadline() -> None:
+    """
+    ### Выбрасывает `asyncio.TimeoutError`, если срок уже истёк.
+    """
+    if remaining() == 0.0:
+        raise asyncio.TimeoutError("Срок выполнения истёк")
+
+
+def bounded(timeout: float | None) -> float | None:
+    """
+    ### Ограничивает таймаут операции оставшимся временем.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if timeout is None:
+        return left
+    return min(timeout, left)
+
+
+@asynccontextmanager
+async def deadline(timeout: float) -> AsyncIterator[None]:
+    """
+    ### Задаёт срок выполнения для всего, что выполняется внутри блока.
+
+    Срок наследуется вложенными корутинами и задачами, вложенный срок не
+    может быть позже внешнего. По истечении срока работа внутри блока
+    отменяется и выбрасывается `asyncio.TimeoutError`.
+    """
+    when = asyncio.get_running_loop().time() + timeout
+    current = _deadline.get()
+    if current is not None:
+        when = min(when, current)
+    token = _deadline.set(when)
+    try:
+        async with asyncio.timeout_at(when):
+            yield
+    finally:
+        _deadline.reset(token)
+
+
+def detached(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    """
+    ### Запускает задачу без срока текущего запроса.
+
+    Нужна для общей фоновой работы (пачки, планировщики), которую не должен
+    ограничивать срок запроса, случайно её запустившего.
+    """
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    return asyncio.get_running_loop().create_task(coro, context=context)
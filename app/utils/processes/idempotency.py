@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Awaitable, Callable
+
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
+
+from app.config import (IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_LOCK_TIMEOUT,
+                        IDEMPOTENCY_WAIT_TIMEOUT)
+from app.db.idempotency_db import (claim_idempotency_key, get_idempotency_key,
+                                   release_idempotency_key,
+                                   save_idempotent_response)
+from app.db.payment_db import async_session as payment_async_session
+from app.db.payment_db import read_session as payment_read_session
+from app.exception.custom_exception import (IdempotencyKeyInProgress,
+                                            IdempotencyKeyMismatch)
+from app.schemas.models import PaymentResponse
+from app.utils.logger import logger
+
+_recent: OrderedDict[str, tuple[str, dict]] = OrderedDict()
+_in_flight: dict[str, tuple[str, asyncio.Future]] = {}
+
+
+def _fingerprint_value(value: Any) -> Any:
+    # Одна и та же сумма может прийти как "100.5" и "100.50".
+    if isinstance(value, Decimal):
+        return str(value.normalize())
+    return to_jsonable_python(value)
+
+
+def request_fingerprint(request: BaseModel) -> str:
+    """
+    ### Хеш тела запроса для сравнения повторов по ключу идемпотентности.
+
+    Суммы нормализуются, поэтому запросы, отличающиеся только записью числа,
+    считаются одинаковыми.
+    """
+    body = json.dumps(
+        request.model_dump(), default=_fingerprint_value, sort_keys=True
+    )
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _remember(key: str, request_hash: str, response: dict) -> None:
+    _recent[key] = (request_hash, response)
+    _recent.move_to_end(key)
+    while len(_recent) > IDEMPOTENCY_CACHE_SIZE:
+        _recent.popitem(last=False)
+
+
+def _check_hash(key: str, expected: str, actual: str) -> None:
+    if expected != actual:
+        raise IdempotencyKeyMismatch(
+            f"Ключ идемпотентности {key} уже использован с другим запросом"
+        )
+
+
+async def _stored_response(key: str, request_hash: str) -> dict | None:
+    async with payment_read_session() as session:
+        record = await get_idempotency_key(key, session)
+    if record is None:
+        return None
+    _check_hash(key, record.request_hash, request_hash)
+    return record.response
+
+
+async def _wait_for_owner(key: str, request_hash: str) -> dict:
+    """
+    ### Ждёт, пока запрос с тем же ключом в другом процессе сохранит ответ.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_TIMEOUT
+    delay = 0.05
+    while loop.time() < deadline:
+        response = await _stored_response(key, request_hash)
+        if response is not None:
+            return response
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+    raise IdempotencyKeyInProgress(f"Запрос с ключом {key} ещё выполняется")
+
+
+async def _execute(
+    key: str,
+    request_hash: str,
+    operation: Callable[[], Awaitable[BaseModel]],
+) -> dict:
+    async with payment_async_session() as session:
+        claimed = await claim_idempotency_key(
+            key, request_hash, IDEMPOTENCY_LOCK_TIMEOUT, session
+        )
+        await session.commit()
+
+    if not claimed:
+        response = await _stored_response(key, request_hash)
+        if response is not None:
+            return response
+        return await _wait_for_owner(key, request_hash)
+
+    try:
+        response = await operation()
+    except BaseException:
+        async with payment_async_session() as session:
+            await release_idempotency_key(key, session)
+            await session.commit()
+        raise
+
+    data = response.model_dump(mode="json")
+    try:
+        async with payment_async_session() as session:
+            await save_idempotent_response(
+                key, getattr(response, "payment_id", None), data, session
+            )
+            await session.commit()
+    except Exception as e:
+        # Ответ уже получен: повтор увидит захваченный ключ и дождётся
+        # истечения IDEMPOTENCY_LOCK_TIMEOUT.
+        logger.error(
+            "Ошибка сохранения ответа для ключа идемпотентности %s: %s", key, e
+        )
+    return data
+
+
+async def run_idempotent(
+    scope: str,
+    idempotency_key: str,
+    request: BaseModel,
+    operation: Callable[[], Awaitable[BaseModel]],
+    response_model: type[BaseModel] = PaymentResponse,
+) -> BaseModel:
+    """
+    ### Выполняет создание платежа не более одного раза на ключ идемпотентности.
+
+    Повтор с тем же ключом возвращает исходный ответ (`response_model`) из LRU недавних
+    ключей или из таблицы `idempotency_keys`, не обращаясь к базе пользователей
+    и внешним сервисам. Одновременные дубликаты в процессе ждут первый запрос,
+    в других процессах - сохранения его ответа. Если запрос завершился ошибкой,
+    ключ освобождается.
+
+    ### Исключения:
+    - `IdempotencyKeyMismatch`, если ключ использован с другим телом запроса.
+    - `IdempotencyKeyInProgress`, если первый запрос не завершился вовремя.
+    """
+    key = f"{scope}:{idempotency_key}"
+    request_hash = request_fingerprint(request)
+
+    recent = _recent.get(key)
+    if recent is not None:
+        _check_hash(key, recent[0], request_hash)
+        _recent.move_to_end(key)
+        return response_model(**recent[1])
+
+    in_flight = _in_flight.get(key)
+    if in_flight is not None:
+        _check_hash(key, in_flight[0], request_hash)
+        return response_model(**await asyncio.shield(in_flight[1]))
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = (request_hash, future)
+    try:
+        data = await _execute(key, request_hash, operation)
+        _remember(key, request_hash, data)
+        future.set_result(data)
+        return response_model(**data)
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим дубликатам.
+            future.exception()
+        raise
+    finally:
+        del _in_flight[key]
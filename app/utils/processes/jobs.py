@@ -0,0 +1,303 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from app.config import (JOB_BATCH_SIZE, JOB_MAX_ATTEMPTS, JOB_MAX_RETRY_DELAY,
+                        JOB_POLL_INTERVAL, JOB_RETRY_BACKOFF, JOB_RETRY_DELAY,
+                        JOB_VISIBILITY_TIMEOUT, JOB_WORKER_CONCURRENCY)
+from app.db.job_db import Job
+from app.db.job_db import cancel_job as cancel_job_record
+from app.db.job_db import claim_jobs, complete_job
+from app.db.job_db import enqueue_job as enqueue_job_record
+from app.db.job_db import enqueue_jobs as enqueue_job_records
+from app.db.job_db import fail_job, get_queue_stats
+from app.db.job_db import release_job as release_job_record
+from app.db.payment_db import async_session as payment_async_session
+from app.db.payment_db import read_session as payment_read_session
+from app.exception.custom_exception import NoRetryError
+from app.utils.logger import CONTEXT_FIELDS, log_context, logger
+from app.utils.metrics.metrics import JOB_SECONDS, OutcomeTimer
+from app.utils.processes.deadline import deadline, detached
+from app.utils.processes.retry import jittered_delay
+
+JobHandler = Callable[[dict], Awaitable[Any]]
+
+_handlers: dict[str, JobHandler] = {}
+_max_attempts: dict[str, int | None] = {}
+_pool: "JobWorkerPool | None" = None
+
+
+def job_handler(kind: str, max_attempts: int | None = JOB_MAX_ATTEMPTS):
+    """
+    ### Регистрирует корутинную функцию как обработчик задач типа `kind`.
+
+    ### Параметры:
+    - **kind**: Тип задачи.
+    - **max_attempts**: Максимальное число попыток, `None` - повторять до успеха.
+    """
+
+    def decorator(func: JobHandler) -> JobHandler:
+        _handlers[kind] = func
+        _max_attempts[kind] = max_attempts
+        return func
+
+    return decorator
+
+
+async def enqueue_job(
+    kind: str, payload: dict, session=None, delay: float = 0.0
+) -> int:
+    """
+    ### Ставит задачу в очередь.
+
+    Если передана сессия, задача фиксируется вместе с ней (после коммита нужно
+    вызвать `wake_job_workers`). Иначе задача сохраняется в отдельной сессии
+    и воркеры пробуждаются сразу.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    max_attempts = _max_attempts[kind]
+    if session is not None:
+        return await enqueue_job_record(kind, payload, session, max_attempts, delay)
+
+    async with payment_async_session() as job_session:
+        job_id = await enqueue_job_record(
+            kind, payload, job_session, max_attempts, delay
+        )
+        await job_session.commit()
+    wake_job_workers()
+    return job_id
+
+
+async def enqueue_jobs(kind: str, payloads: list[dict], session) -> list[int]:
+    """
+    ### Ставит в очередь пачку задач одного типа в рамках переданной сессии.
+
+    После коммита сессии нужно вызвать `wake_job_workers`.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    return await enqueue_job_records(kind, payloads, session, _max_attempts[kind])
+
+
+async def release_job(job_id: int, payload: dict) -> bool:
+    """
+    ### Запускает отложенную задачу сразу, заменив её параметры.
+
+    ### Возвращает:
+    - `False`, если задача уже выбиралась воркером и параметры не заменены.
+    """
+    async with payment_async_session() as session:
+        released = await release_job_record(job_id, payload, session)
+        await session.commit()
+    if released:
+        wake_job_workers()
+    return released
+
+
+async def cancel_job(job_id: int) -> bool:
+    """
+    ### Отменяет отложенную задачу.
+
+    ### Возвращает:
+    - `False`, если задача уже выбиралась воркером и не отменена.
+    """
+    async with payment_async_session() as session:
+        cancelled = await cancel_job_record(job_id, session)
+        await session.commit()
+    return cancelled
+
+
+def wake_job_workers() -> None:
+    """
+    ### Пробуждает пул воркеров текущего процесса, если он запущен.
+    """
+    if _pool is not None:
+        _pool.wake()
+
+
+class JobWorkerPool:
+    """
+    ### Пул воркеров очереди задач.
+
+    Забирает задачи пачками с `FOR UPDATE SKIP LOCKED`, выполняет не более
+    `concurrency` задач одновременно и переназначает упавшие задачи
+    с экспоненциальной задержкой с джиттером.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        batch_size: int = JOB_BATCH_SIZE,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        retry_delay: float = JOB_RETRY_DELAY,
+        retry_backoff: float = JOB_RETRY_BACKOFF,
+        max_retry_delay: float = JOB_MAX_RETRY_DELAY,
+    ):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+        self._active: set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._slot_freed = asyncio.Event()
+        self._running = False
+        self._loop_task: asyncio.Task | None = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        self._running = True
+        self._loop_task = detached(self._poll_loop())
+        logger.info(
+            "Пул воркеров запущен: concurrency=%s, batch=%s",
+            self.concurrency,
+            self.batch_size,
+        )
+
+    async def stop(self, grace: float = 10.0) -> None:
+        """
+        ### Останавливает выборку задач и ждёт завершения активных.
+
+        Задачи, не завершившиеся за `grace` секунд, отменяются и будут
+        повторно выбраны после истечения таймаута видимости.
+        """
+        self._running = False
+        self.wake()
+        self._slot_freed.set()
+        if self._loop_task is not None:
+            await self._loop_task
+        if self._active:
+            _, pending = await asyncio.wait(self._active, timeout=grace)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        logger.info("Пул воркеров остановлен")
+
+    async def _poll_loop(self) -> None:
+        while self._running:
+            free = self.concurrency - len(self._active)
+            if free <= 0:
+                self._slot_freed.clear()
+                await self._slot_freed.wait()
+                continue
+            try:
+                jobs = await self._claim(min(free, self.batch_size))
+            except Exception as e:
+                logger.error("Ошибка выборки задач из очереди: %s", e)
+                jobs = []
+            for job in jobs:
+                task = asyncio.create_task(self._run(job))
+                self._active.add(task)
+                task.add_done_callback(self._on_done)
+            if len(jobs) < min(free, self.batch_size):
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._active.discard(task)
+        self._slot_freed.set()
+
+    async def _claim(self, limit: int) -> list[Job]:
+        async with payment_async_session() as session:
+            jobs = await claim_jobs(session, limit, self.visibility_timeout)
+            await session.commit()
+            return jobs
+
+    async def _run(self, job: Job) -> None:
+        handler = _handlers.get(job.kind)
+        error: Exception | None = None
+        try:
+            if handler is None:
+                raise NoRetryError(f"Нет обработчика для задачи типа {job.kind}")
+            context = {
+                name: job.payload[name]
+                for name in CONTEXT_FIELDS
+                if name in job.payload
+            }
+            with log_context(**context), OutcomeTimer(JOB_SECONDS, kind=job.kind):
+                async with deadline(self.visibility_timeout):
+                    await handler(job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+
+        try:
+            async with payment_async_session() as session:
+                if error is None:
+                    await complete_job(job.job_id, job.attempts, session)
+                else:
+                    retry_delay = self._retry_delay(job, error)
+                    await fail_job(
+                        job.job_id, job.attempts, repr(error), retry_delay, session
+                    )
+                await session.commit()
+        except Exception as e:
+            # Задача будет выбрана повторно после истечения таймаута видимости.
+            logger.error("Ошибка сохранения результата задачи %s: %s", job.job_id, e)
+            return
+
+        if error is None:
+            return
+        if retry_delay is None:
+            logger.error(
+                "Задача %s (%s) завершилась окончательной ошибкой: %s",
+                job.job_id,
+                job.kind,
+                error,
+            )
+        else:
+            logger.warning(
+                "Задача %s (%s), попытка %s, ошибка: %s. Повтор через %.1f секунд",
+                job.job_id,
+                job.kind,
+                job.attempts,
+                error,
+                retry_delay,
+            )
+
+    def _retry_delay(self, job: Job, error: Exception) -> float | None:
+        if isinstance(error, NoRetryError):
+            return None
+        if job.max_attempts is not None and job.attempts >= job.max_attempts:
+            return None
+        return jittered_delay(
+            job.attempts, self.retry_delay, self.retry_backoff, self.max_retry_delay
+        )
+
+
+async def start_job_workers(**kwargs) -> JobWorkerPool:
+    """
+    ### Запускает пул воркеров в текущем процессе.
+    """
+    global _pool
+    if _pool is None:
+        _pool = JobWorkerPool(**kwargs)
+        await _pool.start()
+    return _pool
+
+
+async def stop_job_workers() -> None:
+    """
+    ### Останавливает пул воркеров текущего процесса.
+    """
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.stop()
+
+
+async def get_job_queue_stats() -> dict:
+    """
+    ### Возвращает глубину очереди задач и возраст самой старой ожидающей задачи.
+    """
+    async with payment_read_session() as session:
+        return await get_queue_stats(session)
@@ -0,0 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Hashable
+
+
+class KeyedLock:
+    """
+    ### Набор асинхронных блокировок по ключу.
+
+    Операции с одним ключом выполняются строго по очереди (в порядке
+    прихода), с разными ключами - параллельно. Блокировка существует, пока
+    её держат или ждут, поэтому память ограничена числом ключей в работе.
+    """
+
+    def __init__(self):
+        self._locks: dict[Hashable, tuple[asyncio.Lock, int]] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self._locks)
+
+    def waiting(self, key: Hashable) -> int:
+        """
+        ### Возвращает число операций, держащих или ожидающих блокировку ключа.
+        """
+        entry = self._locks.get(key)
+        return entry[1] if entry is not None else 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+
+wallet_locks = KeyedLock()
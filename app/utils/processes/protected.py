@@ -1,71 +1,251 @@
+import itertools
+import time
 from decimal import Decimal
 
+from app.config import PAYMENT_STATUS_WRITE_BEHIND
+from app.db.payment_db import PAYMENT_PROCESSING
 from app.db.payment_db import async_session as payment_async_session
-from app.db.payment_db import update_payment_status
+from app.db.payment_db import read_router as payment_read_router
+from app.db.payment_db import update_payment_bonus, update_payment_status
 from app.db.user_db import async_session as user_async_session
-from app.db.user_db import update_user_balance
+from app.db.user_db import debit_user_balance
+from app.db.user_db import read_router as user_read_router
+from app.db.user_db import wallet_shard_count
 from app.exception.custom_exception import NotEnoughMoney, UserNotFoundError
+from app.utils.cache.payment_cache import payment_cache
+from app.utils.events.payment_events import payment_events
 from app.utils.logger import logger
-from app.utils.processes.retry import retry_operation
+from app.utils.metrics.metrics import PAYMENT_STAGE_SECONDS, stage_timer
+from app.utils.processes.jobs import enqueue_job, wake_job_workers
+from app.utils.processes.keyed_lock import wallet_locks
+from app.utils.processes.retry_policy import (PAYMENT_STATUS_UPDATE,
+                                              USER_DB_DEBIT)
+from app.utils.processes.status_buffer import get_status_buffer
 
+_wallet_slots = itertools.count()
 
-async def protected_update_payment_status(
-    payment_id: int, status: str, message: str, bonus: Decimal = Decimal("0.00")
-):
+
+def _wallet_lock_key(user_id: int):
     """
-    Обновляет статус платежа с защитой от ошибок.
+    ### Ключ блокировки списаний кошелька в процессе.
 
-    ### Параметры:
-    - **payment_id**: ID платежа.
-    - **status**: Новый статус платежа.
-    - **message**: Сообщение о статусе.
+    Шардированный кошелёк получает по ключу на шард (по кругу), чтобы
+    списания шли параллельно по числу шардов.
     """
+    shards = wallet_shard_count(user_id)
+    if shards == 1:
+        return user_id
+    return user_id, next(_wallet_slots) % shards
+
+
+async def _write_payment_status(
+    payment_id: int,
+    status: str,
+    message: str,
+    bonus: Decimal,
+    expected_status: str,
+    job: tuple[str, dict] | None = None,
+) -> bool:
+    if PAYMENT_STATUS_WRITE_BEHIND:
+        return await get_status_buffer().update_status(
+            payment_id, status, message, bonus, expected_status, job
+        )
     async with payment_async_session() as payment_session:
         try:
 
             async def update():
                 return await update_payment_status(
-                    payment_id, status, message, bonus, payment_session
+                    payment_id,
+                    status,
+                    message,
+                    bonus,
+                    payment_session,
+                    expected_status=expected_status,
                 )
 
-            await retry_operation(update, 3, 0.2, 2)
+            applied = await PAYMENT_STATUS_UPDATE.run(update)
+            if applied and job is not None:
+                await enqueue_job(*job, session=payment_session)
+            await payment_session.commit()
+        except Exception as e:
+            await payment_session.rollback()
+            raise e
+    if applied and job is not None:
+        wake_job_workers()
+    return applied
+
 
+async def _write_payment_bonus(payment_id: int, bonus: Decimal, message: str) -> bool:
+    if PAYMENT_STATUS_WRITE_BEHIND:
+        return await get_status_buffer().update_bonus(payment_id, bonus, message)
+    async with payment_async_session() as payment_session:
+        try:
+
+            async def update():
+                return await update_payment_bonus(
+                    payment_id, bonus, message, payment_session
+                )
+
+            applied = await PAYMENT_STATUS_UPDATE.run(update)
             await payment_session.commit()
-            logger.info(f"Статус платежа {payment_id} успешно обновлен на {status}")
+            return applied
         except Exception as e:
             await payment_session.rollback()
-            logger.error(f"Ошибка при обновлении статуса платежа {payment_id}: {e}")
             raise e
 
 
+async def protected_update_payment_status(
+    payment_id: int,
+    status: str,
+    message: str,
+    bonus: Decimal = Decimal("0.00"),
+    expected_status: str = PAYMENT_PROCESSING,
+    job: tuple[str, dict] | None = None,
+) -> bool:
+    """
+    Обновляет статус платежа с защитой от ошибок.
+
+    При `PAYMENT_STATUS_WRITE_BEHIND` обновление записывается пачкой вместе
+    с обновлениями других платежей (`StatusWriteBuffer`).
+
+    Задача `job` ставится в очередь в той же транзакции, что и применённый
+    переход: повтор обработки, заставший платёж уже в новом статусе, не
+    ставит её второй раз.
+
+    ### Параметры:
+    - **payment_id**: ID платежа.
+    - **status**: Новый статус платежа.
+    - **message**: Сообщение о статусе.
+    - **bonus**: Количество бонусов.
+    - **expected_status**: Статус, из которого выполняется переход.
+    - **job**: Тип и параметры задачи, которая ставится при применённом переходе.
+
+    ### Возвращает:
+    - `True`, если переход применён, `False`, если статус платежа уже изменён.
+    """
+    try:
+        with stage_timer("status_update"):
+            applied = await _write_payment_status(
+                payment_id, status, message, bonus, expected_status, job
+            )
+    except Exception as e:
+        logger.error("Ошибка при обновлении статуса платежа %s: %s", payment_id, e)
+        raise e
+    finally:
+        payment_read_router.mark_written(payment_id)
+        payment_cache.invalidate(payment_id)
+
+    if applied:
+        payment_events.publish(payment_id)
+        logger.info("Статус платежа %s успешно обновлен на %s", payment_id, status)
+    else:
+        logger.warning(
+            "Статус платежа %s не обновлен на %s: платёж не найден или уже не в статусе %s",
+            payment_id,
+            status,
+            expected_status,
+        )
+    return applied
+
+
+async def protected_update_payment_bonus(
+    payment_id: int, bonus: Decimal, message: str
+) -> bool:
+    """
+    Записывает бонусы успешного платежа с защитой от ошибок.
+
+    ### Параметры:
+    - **payment_id**: ID платежа.
+    - **bonus**: Количество бонусов.
+    - **message**: Сообщение о статусе.
+    """
+    try:
+        with stage_timer("bonus_update"):
+            applied = await _write_payment_bonus(payment_id, bonus, message)
+    except Exception as e:
+        logger.error("Ошибка при записи бонусов платежа %s: %s", payment_id, e)
+        raise e
+    finally:
+        payment_read_router.mark_written(payment_id)
+        payment_cache.invalidate(payment_id)
+
+    if applied:
+        payment_events.publish(payment_id)
+        logger.info("Бонусы платежа %s успешно записаны: %s", payment_id, bonus)
+    else:
+        logger.warning("Бонусы платежа %s не записаны: платёж не успешен", payment_id)
+    return applied
+
+
 async def protected_process_transaction(
-    payment_id: int, user_id: int, amount: Decimal, bonus: Decimal
-):
+    payment_id: int,
+    user_id: int,
+    amount: Decimal,
+    bonus: Decimal,
+    job: tuple[str, dict] | None = None,
+) -> bool:
     """
     Обрабатывает транзакцию с защитой от ошибок.
 
+    Списание фиксируется только если платёж удалось перевести из `processing`
+    в `success`. Если платёж уже завершён другим обработчиком, списание
+    откатывается.
+
+    Списания с одного кошелька выполняются в процессе по очереди: они не
+    конкурируют за строку пользователя в базе и не уходят в повторы, а ждут
+    без занятого соединения из пула. Разные кошельки обрабатываются
+    параллельно, шардированный кошелёк (`WALLET_SHARDS`) - параллельно по
+    числу шардов.
+
     ### Параметры:
     - **payment_id**: ID платежа.
     - **user_id**: ID пользователя.
     - **amount**: Сумма транзакции.
+    - **bonus**: Количество бонусов.
+    - **job**: Задача, которая ставится в очередь вместе с переводом в
+      `success` (см. `protected_update_payment_status`).
+
+    ### Возвращает:
+    - `True`, если средства списаны и платёж переведён в `success`.
     """
-    async with user_async_session() as user_session:
-        try:
+    lock_requested_at = time.perf_counter()
+    async with wallet_locks.hold(_wallet_lock_key(user_id)):
+        PAYMENT_STAGE_SECONDS.observe(
+            time.perf_counter() - lock_requested_at,
+            stage="wallet_lock_wait",
+            outcome="ok",
+        )
+        async with user_async_session() as user_session:
+            try:
 
-            async def update():
-                await update_user_balance(user_id, amount, user_session)
+                async def update():
+                    await debit_user_balance(
+                        user_id, amount, user_session, payment_id
+                    )
 
-            await retry_operation(update, 5, 0.5, 2)
-            await protected_update_payment_status(
-                payment_id, "success", "Платеж успешно обработан", bonus
-            )
-            await user_session.commit()
-            logger.info(f"Баланс пользователя {user_id} успешно обновлен")
-        except (UserNotFoundError, NotEnoughMoney) as e:
-            await user_session.rollback()
-            logger.info(f"Ошибка обновления баланса: {e}")
-            raise e
-        except Exception as e:
-            await user_session.rollback()
-            logger.error(f"Необработанная ошибка при обновлении баланса: {e}")
-            raise Exception(f"Необработанная ошибка при обновлении баланса: {e}")
+                with stage_timer("debit"):
+                    await USER_DB_DEBIT.run(update)
+                applied = await protected_update_payment_status(
+                    payment_id, "success", "Платеж успешно обработан", bonus, job=job
+                )
+                if not applied:
+                    await user_session.rollback()
+                    logger.warning(
+                        "Платёж %s уже обработан, списание с баланса пользователя %s отменено",
+                        payment_id,
+                        user_id,
+                    )
+                    return False
+                with stage_timer("debit_commit"):
+                    await user_session.commit()
+                user_read_router.mark_written(user_id)
+                logger.info("Баланс пользователя %s успешно обновлен", user_id)
+                return True
+            except (UserNotFoundError, NotEnoughMoney) as e:
+                await user_session.rollback()
+                logger.info("Ошибка обновления баланса: %s", e)
+                raise e
+            except Exception as e:
+                await user_session.rollback()
+                logger.error("Необработанная ошибка при обновлении баланса: %s", e)
+                raise Exception(f"Необработанная ошибка при обновлении баланса: {e}")
@@ -1,80 +1,228 @@
 import asyncio
+import heapq
+import itertools
+import random
+import time
+from dataclasses import dataclass, field
 from typing import Any, Callable, Coroutine
 
-from app.exception.custom_exception import NoRetryError
+from app.config import RETRY_SCHEDULER_CONCURRENCY, RETRY_SCHEDULER_MAX_PENDING
+from app.exception.custom_exception import RetryQueueFull
 from app.utils.logger import logger
+from app.utils.processes.deadline import detached
 
 
-async def retry_operation(
-    coro: Callable[[], Coroutine[Any, Any, Any]],
-    retries: int = 3,
-    delay: float = 0.5,
-    backoff: float = 2,
-) -> Any:
+def jittered_delay(
+    attempt: int, delay: float, backoff: float, max_delay: float
+) -> float:
     """
-    ### Универсальная функция-ретрайер с экспоненциальной задержкой.
+    ### Экспоненциальная задержка с "равным" джиттером.
 
-    ### Параметры:
-    - **coro**: Корутинная функция, которую нужно выполнить.
-    - **retries**: Количество попыток.
-    - **delay**: Начальная задержка между попытками.
-    - **backoff**: Множитель экспоненциальной задержки.
+    Половина задержки фиксирована, вторая половина случайна, поэтому клиенты,
+    упавшие одновременно, не повторяют запросы синхронно.
 
-    ### Возвращает:
-    - Результат выполнения корутины или исключение после исчерпания попыток.
+    ### Параметры:
+    - **attempt**: Номер неудачной попытки, начиная с 1.
     """
-    attempt = 0
-    current_delay = delay
-    while attempt < retries:
-        try:
-            return await coro()
-        except NoRetryError as e:
-            raise e
-        except Exception as e:
-            attempt += 1
-            logger.warning(f"Попытка {attempt} завершилась ошибкой: {e}")
-            if attempt >= retries:
-                logger.error(f"Все попытки исчерпаны: {e}")
-                raise e
-            await asyncio.sleep(current_delay)
-            current_delay *= backoff
-
-
-async def retry_until_success_service(
-    coro: Callable[[], Coroutine[Any, Any, Any]],
-    delay: float = 0.5,
-    backoff: float = 2,
-    max_delay=120.0,
-    description="unknown",
-) -> Any:
+    capped = min(delay * backoff ** (attempt - 1), max_delay)
+    return capped / 2 + random.uniform(0, capped / 2)
+
+
+def _is_success_response(result: Any) -> bool:
+    return isinstance(result, dict) and result.get("status") == "success"
+
+
+@dataclass
+class _RetryEntry:
+    coro: Callable[[], Coroutine[Any, Any, Any]]
+    description: str
+    delay: float
+    backoff: float
+    max_delay: float
+    is_success: Callable[[Any], bool]
+    future: asyncio.Future
+    created_at: float = field(default_factory=time.monotonic)
+    attempt: int = 0
+
+
+class RetryScheduler:
     """
-    ### Повторяет вызов корутинной функции до успешного выполнения.
+    ### Единый планировщик повторных попыток "до успеха".
 
-    ### Параметры:
-    - **coro**: Корутинная функция, которую нужно выполнить.
-    - **delay**: Начальная задержка между попытками.
-    - **backoff**: Множитель экспоненциальной задержки.
-    - **max_delay**: Максимальная задержка между попытками.
-    - **description**: Описание сервиса для логирования.
-
-    ### Возвращает:
-    - Результат выполнения корутины или исключение после исчерпания попыток.
+    Ожидающие повторы хранятся в куче по времени следующей попытки и
+    обслуживаются одной управляющей корутиной. Одновременно выполняется
+    не более `concurrency` попыток, в очереди - не более `max_pending` записей,
+    поэтому отказ внешнего сервиса стоит O(1) задач, а не O(платежей).
     """
-    while True:
+
+    def __init__(
+        self,
+        max_pending: int = RETRY_SCHEDULER_MAX_PENDING,
+        concurrency: int = RETRY_SCHEDULER_CONCURRENCY,
+    ):
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._heap: list[tuple[float, int, _RetryEntry]] = []
+        self._pending: dict[int, _RetryEntry] = {}
+        self._seq = itertools.count()
+        self._in_flight: set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._driver: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        """Количество ожидающих и выполняющихся повторов."""
+        return len(self._pending)
+
+    @property
+    def oldest_pending_age(self) -> float:
+        """Возраст самой старой незавершённой записи в секундах."""
+        for entry in self._pending.values():
+            return time.monotonic() - entry.created_at
+        return 0.0
+
+    def submit(
+        self,
+        coro: Callable[[], Coroutine[Any, Any, Any]],
+        description: str = "unknown",
+        delay: float = 0.5,
+        backoff: float = 2,
+        max_delay: float = 120.0,
+        is_success: Callable[[Any], bool] = _is_success_response,
+        start_delay: float = 0.0,
+    ) -> asyncio.Future:
+        """
+        ### Ставит корутинную функцию на выполнение до успеха.
+
+        Первая попытка выполняется через `start_delay` секунд, последующие -
+        с экспоненциальной задержкой с джиттером.
+
+        ### Возвращает:
+        - Future с первым успешным результатом.
+        """
+        if len(self._pending) >= self.max_pending:
+            raise RetryQueueFull(
+                f"Очередь повторных попыток переполнена ({self.max_pending})"
+            )
+        entry = _RetryEntry(
+            coro=coro,
+            description=description,
+            delay=delay,
+            backoff=backoff,
+            max_delay=max_delay,
+            is_success=is_success,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        seq = next(self._seq)
+        self._pending[seq] = entry
+        self._schedule(seq, entry, start_delay)
+        if self._driver is None or self._driver.done():
+            self._driver = detached(self._drive())
+        return entry.future
+
+    def _schedule(self, seq: int, entry: _RetryEntry, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, seq, entry))
+        self._wakeup.set()
+
+    async def _drive(self) -> None:
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due_at, seq, entry = self._heap[0]
+            wait = due_at - time.monotonic()
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            if entry.future.done():
+                # Вызывающий код отменил ожидание результата.
+                self._pending.pop(seq, None)
+                continue
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._attempt(seq, entry))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _attempt(self, seq: int, entry: _RetryEntry) -> None:
         try:
-            result = await coro()
-            if result.get("status") == "success":
-                logger.info(f"Сервис {description} выполнен успешно: {result}")
-                return result
-                break
-            else:
+            entry.attempt += 1
+            try:
+                result = await entry.coro()
+                if entry.is_success(result):
+                    logger.info(
+                        "Сервис %s выполнен успешно: %s", entry.description, result
+                    )
+                    self._pending.pop(seq, None)
+                    if not entry.future.done():
+                        entry.future.set_result(result)
+                    return
                 logger.warning(
-                    f"Сервис {description} вернул неуспешный ответ: {result}"
+                    "Сервис %s вернул неуспешный ответ: %s", entry.description, result
                 )
-        except Exception as e:
-            logger.error(f"Ошибка вызова сервиса {description}: {e}")
-        logger.info(
-            f"Повторная попытка вызова сервиса {description} через {delay:.1f} секунд"
-        )
-        await asyncio.sleep(delay)
-        delay = min(delay * backoff, max_delay)
+            except Exception as e:
+                logger.error("Ошибка вызова сервиса %s: %s", entry.description, e)
+            next_delay = jittered_delay(
+                entry.attempt, entry.delay, entry.backoff, entry.max_delay
+            )
+            logger.info(
+                "Повторная попытка вызова сервиса %s через %.1f секунд",
+                entry.description,
+                next_delay,
+            )
+            self._schedule(seq, entry, next_delay)
+        finally:
+            self._semaphore.release()
+
+    async def close(self) -> None:
+        """
+        ### Останавливает планировщик и отменяет ожидающие повторы.
+        """
+        if self._driver is not None:
+            self._driver.cancel()
+            await asyncio.gather(self._driver, return_exceptions=True)
+            self._driver = None
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        for entry in self._pending.values():
+            entry.future.cancel()
+        self._pending.clear()
+        self._heap.clear()
+
+
+_scheduler: RetryScheduler | None = None
+
+
+def get_retry_scheduler() -> RetryScheduler:
+    """
+    ### Возвращает общий планировщик повторных попыток процесса.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RetryScheduler()
+    return _scheduler
+
+
+async def close_retry_scheduler() -> None:
+    global _scheduler
+    if _scheduler is not None:
+        scheduler, _scheduler = _scheduler, None
+        await scheduler.close()
+
+
+def get_retry_scheduler_stats() -> dict:
+    """
+    ### Возвращает число ожидающих повторов и возраст самого старого.
+    """
+    if _scheduler is None:
+        return {"depth": 0, "oldest_pending_age": 0.0}
+    return {
+        "depth": _scheduler.depth,
+        "oldest_pending_age": _scheduler.oldest_pending_age,
+    }
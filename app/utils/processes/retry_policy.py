@@ -0,0 +1,294 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Coroutine
+
+import httpx
+
+from app.config import (RETRY_BUDGET_CAPACITY, RETRY_BUDGET_MIN_PER_SECOND,
+                        RETRY_BUDGET_RATIO)
+from app.exception.custom_exception import NoRetryError
+from app.utils.logger import logger
+from app.utils.processes.deadline import check_deadline, remaining
+
+NO_JITTER = "none"
+FULL_JITTER = "full"
+EQUAL_JITTER = "equal"
+DECORRELATED_JITTER = "decorrelated"
+
+PAYMENT_DB = "payment_db"
+USER_DB = "user_db"
+LOYALTY = "loyalty"
+
+
+class RetryBudget:
+    """
+    ### Бюджет повторов зависимости (token bucket).
+
+    Каждый вызов пополняет бюджет на `ratio` токена, каждый повтор тратит
+    один токен, поэтому повторы составляют не более `ratio` от трафика.
+    Дополнительно бюджет пополняется на `min_per_second` токенов в секунду,
+    чтобы при малом трафике повторы оставались возможны.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+        capacity: float = RETRY_BUDGET_CAPACITY,
+    ):
+        self.name = name
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.rejected = 0
+        self._updated_at = time.monotonic()
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = time.monotonic()
+        amount += (now - self._updated_at) * self.min_per_second
+        self._updated_at = now
+        self.tokens = min(self.tokens + amount, self.capacity)
+
+    def deposit(self) -> None:
+        self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        ### Тратит токен на повтор.
+
+        ### Возвращает:
+        - `False`, если бюджет исчерпан и повторять нельзя.
+        """
+        self._refill()
+        if self.tokens < 1:
+            self.rejected += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+_budgets: dict[str, RetryBudget] = {}
+
+
+def get_retry_budget(name: str) -> RetryBudget:
+    """
+    ### Возвращает бюджет повторов зависимости, создавая его при первом обращении.
+    """
+    budget = _budgets.get(name)
+    if budget is None:
+        budget = _budgets[name] = RetryBudget(name)
+    return budget
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    ### Классифицирует ошибку: имеет ли смысл повторять вызов.
+
+    Не повторяются `NoRetryError` (бизнес-ошибки, разомкнутый автомат
+    отключения) и ответы 4xx внешних сервисов, кроме 408 и 429.
+    """
+    if isinstance(error, NoRetryError):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return True
+
+
+class RetryPolicy:
+    """
+    ### Именованная политика повторов.
+
+    ### Параметры:
+    - **name**: Имя политики в счётчиках и логах.
+    - **max_attempts**: Максимальное число попыток, включая первую.
+    - **base_delay**: Начальная задержка между попытками.
+    - **max_delay**: Верхняя граница задержки.
+    - **multiplier**: Множитель экспоненциальной задержки.
+    - **jitter**: Способ рандомизации задержки (`none`, `full`, `equal`, `decorrelated`).
+    - **budget**: Имя зависимости, бюджет повторов которой расходует политика.
+    - **retryable**: Классификатор ошибок.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        multiplier: float = 2,
+        jitter: str = FULL_JITTER,
+        budget: str | None = None,
+        retryable: Callable[[Exception], bool] = is_retryable,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.budget = budget
+        self.retryable = retryable
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.give_ups = 0
+        self.budget_exhausted = 0
+
+    def next_delay(self, attempt: int, previous: float) -> float:
+        """
+        ### Задержка после неудачной попытки номер `attempt`.
+        """
+        if self.jitter == DECORRELATED_JITTER:
+            return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+        capped = min(self.base_delay * self.multiplier ** (attempt - 1), self.max_delay)
+        if self.jitter == FULL_JITTER:
+            return random.uniform(0, capped)
+        if self.jitter == EQUAL_JITTER:
+            return capped / 2 + random.uniform(0, capped / 2)
+        return capped
+
+    def _give_up(self, message: str, error: Exception) -> None:
+        self.give_ups += 1
+        logger.error("Политика %s: %s: %s", self.name, message, error)
+
+    async def run(self, coro: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
+        """
+        ### Выполняет корутинную функцию с повторами по политике.
+
+        Повтор не выполняется, если ошибка не подлежит повтору, попытки
+        исчерпаны, задержка не укладывается в срок запроса (`deadline`) или
+        исчерпан бюджет повторов зависимости.
+        """
+        budget = get_retry_budget(self.budget) if self.budget else None
+        if budget is not None:
+            budget.deposit()
+        self.calls += 1
+        attempt = 0
+        delay = self.base_delay
+        while True:
+            check_deadline()
+            attempt += 1
+            self.attempts += 1
+            try:
+                return await coro()
+            except Exception as e:
+                if not self.retryable(e):
+                    raise e
+                logger.warning(
+                    "Политика %s: попытка %s завершилась ошибкой: %s",
+                    self.name,
+                    attempt,
+                    e,
+                )
+                if attempt >= self.max_attempts:
+                    self._give_up("все попытки исчерпаны", e)
+                    raise e
+                delay = self.next_delay(attempt, delay)
+                left = remaining()
+                if left is not None and left <= delay:
+                    self._give_up(
+                        f"повтор через {delay:.2f} с не укладывается в срок запроса", e
+                    )
+                    raise e
+                if budget is not None and not budget.withdraw():
+                    self.budget_exhausted += 1
+                    self._give_up(f"бюджет повторов {budget.name} исчерпан", e)
+                    raise e
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "give_ups": self.give_ups,
+            "budget_exhausted": self.budget_exhausted,
+        }
+
+
+_policies: dict[str, RetryPolicy] = {}
+
+
+def _register(policy: RetryPolicy) -> RetryPolicy:
+    _policies[policy.name] = policy
+    return policy
+
+
+PAYMENT_DB_WRITE = _register(
+    RetryPolicy(
+        "payment_db_write",
+        max_attempts=5,
+        base_delay=0.2,
+        max_delay=2.0,
+        jitter=DECORRELATED_JITTER,
+        budget=PAYMENT_DB,
+    )
+)
+PAYMENT_DB_READ = _register(
+    RetryPolicy(
+        "payment_db_read",
+        max_attempts=3,
+        base_delay=0.2,
+        max_delay=2.0,
+        jitter=FULL_JITTER,
+        budget=PAYMENT_DB,
+    )
+)
+PAYMENT_STATUS_UPDATE = _register(
+    RetryPolicy(
+        "payment_status_update",
+        max_attempts=3,
+        base_delay=0.2,
+        max_delay=1.0,
+        jitter=DECORRELATED_JITTER,
+        budget=PAYMENT_DB,
+    )
+)
+USER_DB_READ = _register(
+    RetryPolicy(
+        "user_db_read",
+        max_attempts=5,
+        base_delay=0.2,
+        max_delay=2.0,
+        jitter=FULL_JITTER,
+        budget=USER_DB,
+    )
+)
+USER_DB_DEBIT = _register(
+    RetryPolicy(
+        "user_db_debit",
+        max_attempts=5,
+        base_delay=0.5,
+        max_delay=4.0,
+        jitter=DECORRELATED_JITTER,
+        budget=USER_DB,
+    )
+)
+LOYALTY_CALL = _register(
+    RetryPolicy(
+        "loyalty_call",
+        max_attempts=3,
+        base_delay=0.2,
+        max_delay=1.0,
+        jitter=FULL_JITTER,
+        budget=LOYALTY,
+    )
+)
+
+
+def get_retry_stats() -> dict:
+    """
+    ### Счётчики политик повторов и остатки бюджетов зависимостей.
+    """
+    return {
+        "policies": {name: policy.stats() for name, policy in _policies.items()},
+        "budgets": {
+            name: {"tokens": round(budget.tokens, 2), "rejected": budget.rejected}
+            for name, budget in _budgets.items()
+        },
+    }
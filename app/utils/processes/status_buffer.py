@@ -0,0 +1,245 @@
+import asyncio
+from collections import deque
+from decimal import Decimal
+
+from app.config import (PAYMENT_STATUS_BUFFER_SIZE,
+                        PAYMENT_STATUS_FLUSH_INTERVAL,
+                        PAYMENT_STATUS_FLUSH_SIZE)
+from app.db.payment_db import PAYMENT_SUCCESS
+from app.db.payment_db import async_session as payment_async_session
+from app.db.payment_db import check_status_transition, update_payment_statuses
+from app.utils.processes.deadline import detached
+from app.utils.processes.jobs import enqueue_jobs, wake_job_workers
+from app.utils.processes.retry_policy import PAYMENT_STATUS_UPDATE
+
+
+class _StatusUpdate:
+    __slots__ = ("values", "job", "future", "taken")
+
+    def __init__(
+        self, values: dict, job: tuple[str, dict] | None, future: asyncio.Future
+    ):
+        self.values = values
+        self.job = job
+        self.future = future
+        self.taken = False
+
+
+class StatusWriteBuffer:
+    """
+    ### Групповая запись обновлений статусов и бонусов платежей.
+
+    Обновления собираются `max_linger` секунд (или до `max_batch_size` штук)
+    и записываются одним запросом и одним коммитом на пачку. Вызывающий ждёт
+    результат своего условного обновления, как при прямой записи, поэтому
+    списание по-прежнему фиксируется только после применённого перехода
+    статуса.
+
+    Обновления одного платежа применяются в порядке поступления: следующее
+    попадает в пачку только после записи предыдущего. Число ожидающих
+    обновлений ограничено `max_size`, при переполнении вызывающие ждут.
+
+    Задачи, привязанные к обновлениям статуса, ставятся в очередь в той же
+    транзакции, что и пачка, и только для применённых переходов.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = PAYMENT_STATUS_FLUSH_SIZE,
+        max_linger: float = PAYMENT_STATUS_FLUSH_INTERVAL,
+        max_size: int = PAYMENT_STATUS_BUFFER_SIZE,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger
+        self._space = asyncio.Semaphore(max_size)
+        self._queues: dict[int, deque[_StatusUpdate]] = {}
+        self._in_flight: set[int] = set()
+        self._size = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushing: set[asyncio.Task] = set()
+
+    @property
+    def depth(self) -> int:
+        return self._size
+
+    async def update_status(
+        self,
+        payment_id: int,
+        status: str,
+        message: str,
+        bonus: Decimal,
+        expected_status: str,
+        job: tuple[str, dict] | None = None,
+    ) -> bool:
+        """
+        ### Буферизованный аналог `update_payment_status`.
+
+        ### Параметры:
+        - **job**: Тип и параметры задачи, которая ставится в очередь при
+          применённом переходе.
+        """
+        check_status_transition(payment_id, expected_status, status)
+        return await self._submit(
+            {
+                "payment_id": payment_id,
+                "expected_status": expected_status,
+                "status": status,
+                "message": message,
+                "bonus": bonus,
+            },
+            job,
+        )
+
+    async def update_bonus(self, payment_id: int, bonus: Decimal, message: str) -> bool:
+        """
+        ### Буферизованный аналог `update_payment_bonus`.
+        """
+        return await self._submit(
+            {
+                "payment_id": payment_id,
+                "expected_status": PAYMENT_SUCCESS,
+                "status": PAYMENT_SUCCESS,
+                "message": message,
+                "bonus": bonus,
+            }
+        )
+
+    async def _submit(self, values: dict, job: tuple[str, dict] | None = None) -> bool:
+        await self._space.acquire()
+        entry = _StatusUpdate(values, job, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(values["payment_id"], deque()).append(entry)
+        self._size += 1
+        self._schedule()
+        try:
+            return await entry.future
+        except asyncio.CancelledError:
+            # Ещё не отправленное обновление отменяется. Отправленное уже
+            # нельзя отозвать: его результат неизвестен, как у прерванного
+            # коммита.
+            if not entry.taken:
+                self._discard(entry)
+            raise
+
+    def _discard(self, entry: _StatusUpdate) -> None:
+        payment_id = entry.values["payment_id"]
+        queue = self._queues.get(payment_id)
+        if queue is None or entry not in queue:
+            return
+        queue.remove(entry)
+        if not queue:
+            del self._queues[payment_id]
+        self._size -= 1
+        self._space.release()
+
+    def _ready(self) -> int:
+        return sum(1 for payment_id in self._queues if payment_id not in self._in_flight)
+
+    def _schedule(self) -> None:
+        if self._ready() >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None and self._queues:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_linger, self._flush
+            )
+
+    def _take_batch(self) -> list[_StatusUpdate]:
+        batch = []
+        for payment_id, queue in list(self._queues.items()):
+            if len(batch) >= self.max_batch_size:
+                break
+            if payment_id in self._in_flight:
+                continue
+            entry = queue.popleft()
+            if not queue:
+                del self._queues[payment_id]
+            entry.taken = True
+            self._in_flight.add(payment_id)
+            batch.append(entry)
+        return batch
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._take_batch()
+        if batch:
+            task = detached(self._send(batch))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+        if self._ready():
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_linger, self._flush
+            )
+
+    async def _write(self, batch: list[_StatusUpdate]) -> set[int]:
+        async with payment_async_session() as session:
+
+            async def update():
+                return await update_payment_statuses(
+                    [entry.values for entry in batch], session
+                )
+
+            applied = await PAYMENT_STATUS_UPDATE.run(update)
+            jobs: dict[str, list[dict]] = {}
+            for entry in batch:
+                if entry.job is not None and entry.values["payment_id"] in applied:
+                    kind, payload = entry.job
+                    jobs.setdefault(kind, []).append(payload)
+            for kind, payloads in jobs.items():
+                await enqueue_jobs(kind, payloads, session)
+            await session.commit()
+        if jobs:
+            wake_job_workers()
+        return applied
+
+    async def _send(self, batch: list[_StatusUpdate]) -> None:
+        try:
+            applied = await self._write(batch)
+        except asyncio.CancelledError:
+            for entry in batch:
+                entry.future.cancel()
+            raise
+        except Exception as e:
+            for entry in batch:
+                if not entry.future.done():
+                    entry.future.set_exception(e)
+        else:
+            for entry in batch:
+                if not entry.future.done():
+                    entry.future.set_result(entry.values["payment_id"] in applied)
+        finally:
+            for entry in batch:
+                self._in_flight.discard(entry.values["payment_id"])
+                self._size -= 1
+                self._space.release()
+            if self._queues:
+                self._schedule()
+
+    async def close(self) -> None:
+        """
+        ### Записывает все накопленные обновления и ждёт завершения пачек.
+        """
+        while self._queues or self._flushing:
+            self._flush()
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+
+_buffer: StatusWriteBuffer | None = None
+
+
+def get_status_buffer() -> StatusWriteBuffer:
+    global _buffer
+    if _buffer is None:
+        _buffer = StatusWriteBuffer()
+    return _buffer
+
+
+def get_status_buffer_depth() -> int:
+    return _buffer.depth if _buffer is not None else 0
+
+
+async def close_status_buffer() -> None:
+    global _buffer
+    if _buffer is not None:
+        buffer, _buffer = _buffer, None
+        await buffer.close()
@@ -1,41 +1,96 @@
 from decimal import Decimal
 
-import httpx
+from app.config import (LOYALTY_BATCH_ENABLED, LOYALTY_HEDGE_ENABLED,
+                        LOYALTY_SERVICE_URL, NOTIFICATION_SERVICE_URL)
+from app.exception.custom_exception import CircuitOpenError, RetryQueueFull
+from app.utils.logger import logger
+from app.utils.processes.retry import get_retry_scheduler
+from app.utils.services.circuit_breaker import get_circuit_breaker
+from app.utils.services.hedging import get_latency_tracker, hedged_call
+from app.utils.services.http_clients import (LOYALTY, NOTIFICATION,
+                                             get_http_client, request_timeout)
+from app.utils.services.loyalty_batcher import get_loyalty_batcher
 
-from app.config import LOYALTY_SERVICE_URL, NOTIFICATION_SERVICE_URL
 
-
-async def call_loyalty_service(user_id: int, amount: Decimal) -> dict:
+async def call_loyalty_service(
+    user_id: int, amount: Decimal, hedge: bool = False
+) -> dict:
     """
     ### Вызов внешнего сервиса для начисления бонусов (loyalty).
 
+    При `LOYALTY_BATCH_ENABLED` запрос объединяется с конкурентными запросами
+    в один вызов `/loyalty/batch`. Если автомат отключения сервиса разомкнут,
+    сразу возвращается ответ со статусом `fallback` и нулевым бонусом.
+
+    Расчёт бонусов идемпотентен, поэтому при `hedge` и `LOYALTY_HEDGE_ENABLED`
+    медленный вызов дублируется после p95 задержки сервиса и берётся первый
+    ответ. Дублирование тратит запросы к сервису ради задержки ответа клиенту,
+    поэтому включается только на пути запроса.
+
     ### params:
         user_id: ID пользователя.
         amount: Сумма платежа.
+        hedge: Дублировать медленный вызов.
 
     ### return:
         Ответ сервиса в виде словаря.
     """
-    async with httpx.AsyncClient(timeout=5) as client:
-
-        async def do_call() -> dict:
-            response = await client.post(
-                LOYALTY_SERVICE_URL,
-                json={
-                    "user_id": str(user_id),
-                    "amount": str(amount),
-                },
+
+    async def do_call() -> dict:
+        client = get_http_client(LOYALTY)
+        response = await client.post(
+            LOYALTY_SERVICE_URL,
+            json={
+                "user_id": str(user_id),
+                "amount": str(amount),
+            },
+            timeout=request_timeout(),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def single_call() -> dict:
+        if LOYALTY_BATCH_ENABLED:
+            return await get_loyalty_batcher().submit(user_id, amount)
+        return await get_circuit_breaker(LOYALTY).call(do_call)
+
+    try:
+        if hedge and LOYALTY_HEDGE_ENABLED:
+            return await hedged_call(
+                single_call,
+                get_latency_tracker(LOYALTY),
+                f"Расчёт бонусов для пользователя {user_id}",
             )
-            response.raise_for_status()
-            return response.json()
+        return await single_call()
+    except CircuitOpenError as e:
+        logger.warning("Бонусы для пользователя %s не рассчитаны: %s", user_id, e)
+        return {"status": "fallback", "message": str(e), "bonus": "0"}
 
-        return await do_call()
+
+async def _send_notification(user_id: int, status: str) -> dict:
+    async def do_call() -> dict:
+        client = get_http_client(NOTIFICATION)
+        response = await client.post(
+            NOTIFICATION_SERVICE_URL,
+            json={
+                "user_id": str(user_id),
+                "status": status,
+            },
+            timeout=request_timeout(),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    return await get_circuit_breaker(NOTIFICATION).call(do_call)
 
 
 async def call_notification_service(user_id: int, status: str) -> dict:
     """
     ### Вызов внешнего сервиса для отправки уведомлений (notification).
 
+    Если автомат отключения сервиса разомкнут, уведомление откладывается
+    в общий планировщик повторных попыток и возвращается статус `deferred`.
+
     ### params:
         user_id: ID пользователя.
         status: Текущий статус платежа.
@@ -43,17 +98,21 @@ async def call_notification_service(user_id: int, status: str) -> dict:
     ### return:
         Ответ сервиса в виде словаря.
     """
-    async with httpx.AsyncClient(timeout=5) as client:
-
-        async def do_call() -> dict:
-            response = await client.post(
-                NOTIFICATION_SERVICE_URL,
-                json={
-                    "user_id": str(user_id),
-                    "status": status,
-                },
-            )
-            response.raise_for_status()
-            return response.json()
+    try:
+        return await _send_notification(user_id, status)
+    except CircuitOpenError as e:
+
+        async def deferred_send() -> dict:
+            return await _send_notification(user_id, status)
 
-        return await do_call()
+        try:
+            get_retry_scheduler().submit(
+                deferred_send,
+                description=f"notification-user_id:{user_id}",
+                start_delay=get_circuit_breaker(NOTIFICATION).open_timeout,
+            )
+        except RetryQueueFull as full:
+            logger.error("Уведомление пользователю %s отброшено: %s", user_id, full)
+            return {"status": "dropped", "message": str(full)}
+        logger.warning("Уведомление пользователю %s отложено: %s", user_id, e)
+        return {"status": "deferred", "message": str(e)}
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine
+
+from app.config import (CIRCUIT_BREAKER_FAILURE_RATE,
+                        CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+                        CIRCUIT_BREAKER_MIN_CALLS,
+                        CIRCUIT_BREAKER_OPEN_TIMEOUT,
+                        CIRCUIT_BREAKER_SLOW_CALL_DURATION,
+                        CIRCUIT_BREAKER_SLOW_CALL_RATE,
+                        CIRCUIT_BREAKER_WINDOW_SIZE)
+from app.exception.custom_exception import CircuitOpenError
+from app.utils.logger import logger
+from app.utils.metrics.metrics import DOWNSTREAM_CALL_SECONDS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    ### Автомат отключения (circuit breaker) для вызовов внешнего сервиса.
+
+    Хранит результаты последних `window_size` вызовов. Если доля ошибок или
+    медленных вызовов превышает порог, автомат размыкается, и вызовы сразу
+    завершаются `CircuitOpenError`. Через `open_timeout` секунд пропускается
+    не более `half_open_calls` пробных вызовов: если все успешны, автомат
+    замыкается, при первой ошибке снова размыкается.
+
+    Каждый переход состояния начинает новое поколение. Вызов запоминает
+    поколение, в котором начался, и его результат учитывается только в нём:
+    медленный вызов, начатый до размыкания, не может замкнуть автомат
+    вместо пробного.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = CIRCUIT_BREAKER_WINDOW_SIZE,
+        min_calls: int = CIRCUIT_BREAKER_MIN_CALLS,
+        failure_rate: float = CIRCUIT_BREAKER_FAILURE_RATE,
+        slow_call_rate: float = CIRCUIT_BREAKER_SLOW_CALL_RATE,
+        slow_call_duration: float = CIRCUIT_BREAKER_SLOW_CALL_DURATION,
+        open_timeout: float = CIRCUIT_BREAKER_OPEN_TIMEOUT,
+        half_open_calls: int = CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_duration = slow_call_duration
+        self.open_timeout = open_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._window: deque[tuple[bool, bool]] = deque(maxlen=window_size)
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._generation = 0
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(
+            "Автомат отключения сервиса %s: %s -> %s", self.name, self.state, state
+        )
+        self.state = state
+        self._generation += 1
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._window.clear()
+            self._failures = 0
+            self._slow = 0
+
+    def _acquire(self) -> int:
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_timeout:
+                raise CircuitOpenError(f"Сервис {self.name} временно отключён")
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes_started >= self.half_open_calls:
+                raise CircuitOpenError(
+                    f"Сервис {self.name} проверяется пробными вызовами"
+                )
+            self._probes_started += 1
+        return self._generation
+
+    def _record(self, failed: bool, duration: float, generation: int) -> None:
+        if generation != self._generation:
+            return
+        slow = duration >= self.slow_call_duration
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._transition(OPEN)
+                return
+            self._probes_succeeded += 1
+            if self._probes_succeeded >= self.half_open_calls:
+                self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            return
+
+        if len(self._window) == self._window.maxlen:
+            old_failed, old_slow = self._window[0]
+            self._failures -= old_failed
+            self._slow -= old_slow
+        self._window.append((failed, slow))
+        self._failures += failed
+        self._slow += slow
+
+        calls = len(self._window)
+        if calls < self.min_calls:
+            return
+        if (
+            self._failures / calls >= self.failure_rate
+            or self._slow / calls >= self.slow_call_rate
+        ):
+            self._transition(OPEN)
+
+    async def call(self, coro: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
+        """
+        ### Выполняет вызов через автомат отключения.
+
+        ### Исключения:
+        - `CircuitOpenError`, если автомат разомкнут.
+        """
+        generation = self._acquire()
+        start = time.monotonic()
+        try:
+            result = await coro()
+        except asyncio.CancelledError:
+            # Отменённый вызов (например, проигравший дублирующий запрос) не
+            # говорит о сбое сервиса; учитывается, только если уже был медленным.
+            duration = time.monotonic() - start
+            DOWNSTREAM_CALL_SECONDS.observe(
+                duration, service=self.name, outcome="cancelled"
+            )
+            if duration >= self.slow_call_duration:
+                self._record(False, duration, generation)
+            elif self.state == HALF_OPEN and generation == self._generation:
+                self._probes_started -= 1
+            raise
+        except Exception:
+            duration = time.monotonic() - start
+            DOWNSTREAM_CALL_SECONDS.observe(duration, service=self.name, outcome="error")
+            self._record(True, duration, generation)
+            raise
+        duration = time.monotonic() - start
+        DOWNSTREAM_CALL_SECONDS.observe(duration, service=self.name, outcome="ok")
+        self._record(False, duration, generation)
+        return result
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    ### Возвращает автомат отключения сервиса, создавая его при первом обращении.
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def get_circuit_breaker_states() -> dict[str, str]:
+    """
+    ### Возвращает состояния созданных автоматов отключения.
+    """
+    return {name: breaker.state for name, breaker in _breakers.items()}
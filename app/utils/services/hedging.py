@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine
+
+from app.config import (HEDGE_MAX_ATTEMPTS, HEDGE_MAX_DELAY, HEDGE_MIN_DELAY,
+                        HEDGE_MIN_SAMPLES, HEDGE_PERCENTILE,
+                        HEDGE_WINDOW_SIZE)
+from app.exception.custom_exception import HedgeCancelled
+from app.utils.logger import logger
+
+
+class LatencyTracker:
+    """
+    ### Скользящее окно длительностей успешных вызовов сервиса.
+    """
+
+    def __init__(self, window_size: int = HEDGE_WINDOW_SIZE):
+        self._samples: deque[float] = deque(maxlen=window_size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, duration: float) -> None:
+        self._samples.append(duration)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def hedge_delay(
+        self,
+        q: float = HEDGE_PERCENTILE,
+        min_delay: float = HEDGE_MIN_DELAY,
+        max_delay: float = HEDGE_MAX_DELAY,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+    ) -> float:
+        """
+        ### Возвращает задержку перед дублирующим вызовом.
+
+        Пока замеров меньше `min_samples`, используется `max_delay`.
+        """
+        if len(self._samples) < min_samples:
+            return max_delay
+        return min(max(self.percentile(q), min_delay), max_delay)
+
+
+def _consume(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+async def hedged_call(
+    call: Callable[[], Coroutine[Any, Any, Any]],
+    tracker: LatencyTracker,
+    description: str,
+    max_attempts: int = HEDGE_MAX_ATTEMPTS,
+) -> Any:
+    """
+    ### Выполняет идемпотентный вызов с дублированием медленных запросов.
+
+    Если вызов не завершился за `tracker.hedge_delay()` (p95 последних
+    вызовов), запускается ещё один, всего не более `max_attempts`. Возвращается
+    первый успешный результат, остальные вызовы отменяются. Ошибка вызова не
+    порождает новую попытку: повторы - задача политики повторов.
+
+    ### Параметры:
+    - **call**: Идемпотентная асинхронная функция без аргументов.
+    - **tracker**: Замеры задержек сервиса.
+    - **description**: Описание вызова для логов.
+    - **max_attempts**: Максимальное число одновременных вызовов.
+    """
+    delay = tracker.hedge_delay()
+
+    async def attempt() -> Any:
+        start = time.monotonic()
+        result = await call()
+        tracker.record(time.monotonic() - start)
+        return result
+
+    tasks: set[asyncio.Task] = set()
+    started = 0
+    last_error: BaseException | None = None
+
+    def launch() -> None:
+        nonlocal started
+        task = asyncio.ensure_future(attempt())
+        task.add_done_callback(_consume)
+        tasks.add(task)
+        started += 1
+
+    launch()
+    try:
+        while tasks:
+            can_hedge = started < max_attempts and last_error is None
+            done, _ = await asyncio.wait(
+                tasks,
+                timeout=delay if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                logger.info(
+                    "%s: нет ответа за %.3f с, запущен дублирующий вызов",
+                    description,
+                    delay,
+                )
+                launch()
+                continue
+            for task in done:
+                tasks.discard(task)
+                if task.cancelled():
+                    # Вызов отменён изнутри (например, отменён запрос пакета):
+                    # `exception()` у такой задачи сам бросил бы CancelledError.
+                    # Наружу уходит обычная ошибка: CancelledError означал бы
+                    # отмену самого вызывающего.
+                    last_error = HedgeCancelled(f"{description}: вызов отменён")
+                    continue
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+_trackers: dict[str, LatencyTracker] = {}
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    """
+    ### Возвращает замеры задержек сервиса, создавая их при первом обращении.
+    """
+    tracker = _trackers.get(name)
+    if tracker is None:
+        tracker = _trackers[name] = LatencyTracker()
+    return tracker
@@ -0,0 +1,98 @@
+import httpx
+
+from app.config import (HTTP2_ENABLED, HTTP_CONNECT_TIMEOUT,
+                        HTTP_KEEPALIVE_EXPIRY, HTTP_MAX_CONNECTIONS,
+                        HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_POOL_TIMEOUT,
+                        HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT)
+from app.utils.logger import logger
+from app.utils.processes.deadline import bounded
+
+LOYALTY = "loyalty"
+NOTIFICATION = "notification"
+
+SERVICES = (LOYALTY, NOTIFICATION)
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_client(service: str) -> httpx.AsyncClient:
+    """
+    ### Создаёт пул соединений для одного внешнего сервиса.
+
+    HTTP/2 включается только если установлен пакет `h2`, иначе используется HTTP/1.1
+    с keep-alive.
+    """
+    http2 = HTTP2_ENABLED and _http2_available()
+    if HTTP2_ENABLED and not http2:
+        logger.warning(
+            "HTTP/2 для сервиса %s недоступен (не установлен h2), используется HTTP/1.1",
+            service,
+        )
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+            write=HTTP_WRITE_TIMEOUT,
+            pool=HTTP_POOL_TIMEOUT,
+        ),
+    )
+
+
+async def init_http_clients() -> None:
+    """
+    ### Создаёт общие HTTP-клиенты для всех внешних сервисов.
+    """
+    for service in SERVICES:
+        if service not in _clients or _clients[service].is_closed:
+            _clients[service] = _build_client(service)
+    logger.info("HTTP-клиенты внешних сервисов инициализированы")
+
+
+async def close_http_clients() -> None:
+    """
+    ### Закрывает общие HTTP-клиенты и их пулы соединений.
+    """
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
+    logger.info("HTTP-клиенты внешних сервисов закрыты")
+
+
+def get_http_client(service: str) -> httpx.AsyncClient:
+    """
+    ### Возвращает общий HTTP-клиент сервиса.
+
+    Если клиент не был создан в lifespan (например, при вызове вне приложения),
+    он создаётся при первом обращении.
+    """
+    client = _clients.get(service)
+    if client is None or client.is_closed:
+        client = _build_client(service)
+        _clients[service] = client
+    return client
+
+
+def request_timeout() -> httpx.Timeout:
+    """
+    ### Возвращает таймауты HTTP-запроса, ограниченные сроком текущего запроса.
+    """
+    return httpx.Timeout(
+        connect=bounded(HTTP_CONNECT_TIMEOUT),
+        read=bounded(HTTP_READ_TIMEOUT),
+        write=bounded(HTTP_WRITE_TIMEOUT),
+        pool=bounded(HTTP_POOL_TIMEOUT),
+    )
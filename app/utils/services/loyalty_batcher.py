@@ -0,0 +1,126 @@
+import asyncio
+from decimal import Decimal
+
+from app.config import (LOYALTY_BATCH_LINGER, LOYALTY_BATCH_SERVICE_URL,
+                        LOYALTY_BATCH_SIZE)
+from app.exception.custom_exception import ExternalServiceError
+from app.utils.processes.deadline import detached
+from app.utils.services.circuit_breaker import get_circuit_breaker
+from app.utils.services.http_clients import LOYALTY, get_http_client
+
+
+class LoyaltyBatcher:
+    """
+    ### Микробатчинг вызовов сервиса лояльности.
+
+    Конкурентные запросы собираются в один вызов `/loyalty/batch`, когда набирается
+    `max_batch_size` запросов или проходит `max_linger` секунд с первого запроса
+    пачки. Каждый вызывающий получает свой результат или свою ошибку.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = LOYALTY_BATCH_SIZE,
+        max_linger: float = LOYALTY_BATCH_LINGER,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger
+        self._pending: list[tuple[dict, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushing: set[asyncio.Task] = set()
+
+    async def submit(self, user_id: int, amount: Decimal) -> dict:
+        """
+        ### Добавляет запрос в текущую пачку и ждёт его результат.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        item = {"user_id": str(user_id), "amount": str(amount)}
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_linger, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch = self._pending[: self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size :]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_linger, self._flush
+            )
+        task = detached(self._send(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _post_batch(self, items: list[dict]) -> dict:
+        async def do_call() -> dict:
+            client = get_http_client(LOYALTY)
+            response = await client.post(
+                LOYALTY_BATCH_SERVICE_URL, json={"items": items}
+            )
+            response.raise_for_status()
+            return response.json()
+
+        return await get_circuit_breaker(LOYALTY).call(do_call)
+
+    async def _send(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        try:
+            response = await self._post_batch([item for item, _ in batch])
+            results = response.get("results", [])
+            if len(results) != len(batch):
+                raise ExternalServiceError(
+                    f"Сервис лояльности вернул {len(results)} результатов на {len(batch)} запросов"
+                )
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if result.get("status") == "error":
+                future.set_exception(
+                    ExternalServiceError(
+                        f"Ошибка сервиса лояльности: {result.get('message')}"
+                    )
+                )
+            else:
+                future.set_result(result)
+
+    async def close(self) -> None:
+        """
+        ### Отправляет накопленные запросы и ждёт завершения всех пачек.
+        """
+        while self._pending:
+            self._flush()
+        await asyncio.gather(*self._flushing, return_exceptions=True)
+
+
+_batcher: LoyaltyBatcher | None = None
+
+
+def get_loyalty_batcher() -> LoyaltyBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = LoyaltyBatcher()
+    return _batcher
+
+
+async def close_loyalty_batcher() -> None:
+    global _batcher
+    if _batcher is not None:
+        batcher, _batcher = _batcher, None
+        await batcher.close()
@@ -0,0 +1,234 @@
+import asyncio
+import time
+from collections import deque
+
+from app.config import (NOTIFICATION_BATCH_INTERVAL,
+                        NOTIFICATION_BATCH_SERVICE_URL,
+                        NOTIFICATION_BATCH_SIZE, NOTIFICATION_OVERFLOW_POLICY,
+                        NOTIFICATION_QUEUE_SIZE)
+from app.exception.custom_exception import CircuitOpenError, RetryQueueFull
+from app.utils.logger import logger
+from app.utils.processes.deadline import detached
+from app.utils.processes.retry import get_retry_scheduler
+from app.utils.services.circuit_breaker import get_circuit_breaker
+from app.utils.services.http_clients import NOTIFICATION, get_http_client
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+# Попытки отправки пачки при остановке: планировщик повторов к этому моменту
+# тоже останавливается, поэтому повторы идут сразу и ограничены.
+STOP_SEND_ATTEMPTS = 3
+STOP_RETRY_DELAY = 0.5
+
+
+class NotificationDispatcher:
+    """
+    ### Пакетная отправка уведомлений.
+
+    Уведомления складываются в ограниченную очередь и отправляются одним
+    запросом `/notify/batch`, когда набирается `batch_size` уведомлений или
+    проходит `batch_interval` секунд с первого уведомления пачки.
+    При переполнении очереди отбрасывается самое старое (`drop_oldest`)
+    или новое (`drop_newest`) уведомление.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = NOTIFICATION_BATCH_SIZE,
+        batch_interval: float = NOTIFICATION_BATCH_INTERVAL,
+        max_queue: int = NOTIFICATION_QUEUE_SIZE,
+        overflow_policy: str = NOTIFICATION_OVERFLOW_POLICY,
+    ):
+        if overflow_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Неизвестная политика переполнения: {overflow_policy}")
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self._queue: deque[dict] = deque()
+        self._first_enqueued_at = 0.0
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._sending: set[asyncio.Task] = set()
+        self._stopping = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def send(self, user_id: int, status: str) -> bool:
+        """
+        ### Ставит уведомление в очередь без ожидания отправки.
+
+        ### Возвращает:
+        - `False`, если уведомление отброшено из-за переполнения очереди.
+        """
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            if self.overflow_policy == DROP_NEWEST:
+                logger.warning(
+                    "Очередь уведомлений переполнена, уведомление пользователю %s отброшено",
+                    user_id,
+                )
+                return False
+            dropped = self._queue.popleft()
+            logger.warning(
+                "Очередь уведомлений переполнена, отброшено уведомление пользователю %s",
+                dropped["user_id"],
+            )
+        if not self._queue:
+            self._first_enqueued_at = time.monotonic()
+        self._queue.append({"user_id": str(user_id), "status": status})
+        self._has_items.set()
+        if len(self._queue) >= self.batch_size:
+            self._batch_full.set()
+        return True
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = detached(self._run())
+
+    async def stop(self) -> None:
+        """
+        ### Останавливает диспетчер, отправив оставшиеся уведомления.
+
+        Пачки, которые не удалось отправить после остановки, не уходят в
+        планировщик повторов (он закрывается следом), а повторяются сразу,
+        не более `STOP_SEND_ATTEMPTS` раз. Неотправленные уведомления
+        учитываются в `dropped`.
+        """
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        batches = []
+        while self._queue:
+            batches.append(self._take_batch())
+        await asyncio.gather(
+            *(self._send_batch(batch) for batch in batches),
+            *self._sending,
+            return_exceptions=True,
+        )
+
+    def _take_batch(self) -> list[dict]:
+        count = min(self.batch_size, len(self._queue))
+        batch = [self._queue.popleft() for _ in range(count)]
+        if self._queue:
+            self._first_enqueued_at = time.monotonic()
+        else:
+            self._has_items.clear()
+        if len(self._queue) < self.batch_size:
+            self._batch_full.clear()
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_items.wait()
+            linger = self._first_enqueued_at + self.batch_interval - time.monotonic()
+            if linger > 0 and len(self._queue) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), linger)
+                except asyncio.TimeoutError:
+                    pass
+            if not self._queue:
+                continue
+            task = asyncio.create_task(self._send_batch(self._take_batch()))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _post_batch(self, batch: list[dict]) -> dict:
+        async def do_call() -> dict:
+            client = get_http_client(NOTIFICATION)
+            response = await client.post(
+                NOTIFICATION_BATCH_SERVICE_URL, json={"notifications": batch}
+            )
+            response.raise_for_status()
+            return response.json()
+
+        return await get_circuit_breaker(NOTIFICATION).call(do_call)
+
+    async def _send_batch(self, batch: list[dict]) -> None:
+        try:
+            await self._post_batch(batch)
+            return
+        except CircuitOpenError as e:
+            logger.warning("Пачка из %s уведомлений отложена: %s", len(batch), e)
+        except Exception as e:
+            logger.warning("Ошибка отправки пачки из %s уведомлений: %s", len(batch), e)
+
+        if self._stopping:
+            await self._send_before_stop(batch)
+            return
+
+        async def deferred_send() -> dict:
+            return await self._post_batch(batch)
+
+        try:
+            get_retry_scheduler().submit(
+                deferred_send,
+                description=f"notification-batch:{len(batch)}",
+                start_delay=self.batch_interval,
+            )
+        except RetryQueueFull as e:
+            self.dropped += len(batch)
+            logger.error("Пачка из %s уведомлений отброшена: %s", len(batch), e)
+
+    async def _send_before_stop(self, batch: list[dict]) -> None:
+        delay = STOP_RETRY_DELAY
+        for _ in range(STOP_SEND_ATTEMPTS - 1):
+            await asyncio.sleep(delay)
+            delay *= 2
+            try:
+                await self._post_batch(batch)
+                return
+            except Exception as e:
+                logger.warning(
+                    "Ошибка отправки пачки из %s уведомлений: %s", len(batch), e
+                )
+        self.dropped += len(batch)
+        logger.error(
+            "Пачка из %s уведомлений отброшена при остановке после %s попыток",
+            len(batch),
+            STOP_SEND_ATTEMPTS,
+        )
+
+
+_dispatcher: NotificationDispatcher | None = None
+
+
+def get_notification_dispatcher() -> NotificationDispatcher:
+    """
+    ### Возвращает запущенный диспетчер уведомлений процесса.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = NotificationDispatcher()
+    _dispatcher.start()
+    return _dispatcher
+
+
+async def stop_notification_dispatcher() -> None:
+    global _dispatcher
+    if _dispatcher is not None:
+        dispatcher, _dispatcher = _dispatcher, None
+        await dispatcher.stop()
+
+
+def dispatch_notification(user_id: int, status: str) -> bool:
+    """
+    ### Ставит уведомление в очередь пакетной отправки.
+    """
+    return get_notification_dispatcher().send(user_id, status)
+
+
+def get_notification_stats() -> dict:
+    """
+    ### Возвращает глубину очереди уведомлений и число отброшенных уведомлений.
+    """
+    if _dispatcher is None:
+        return {"depth": 0, "dropped": 0}
+    return {"depth": _dispatcher.depth, "dropped": _dispatcher.dropped}
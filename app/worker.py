@@ -0,0 +1,53 @@
+import asyncio
+import signal
+
+import app.utils.processes.background  # noqa: F401 - регистрирует обработчики задач
+from app.config import STORAGE_BACKEND
+from app.utils.logger import logger
+from app.utils.processes.jobs import start_job_workers, stop_job_workers
+from app.utils.processes.retry import close_retry_scheduler
+from app.utils.processes.status_buffer import close_status_buffer
+from app.utils.services.http_clients import (close_http_clients,
+                                             init_http_clients)
+from app.utils.services.loyalty_batcher import close_loyalty_batcher
+from app.utils.services.notification_dispatcher import (
+    get_notification_dispatcher, stop_notification_dispatcher)
+
+
+async def main():
+    """
+    ### Отдельный процесс воркеров очереди задач.
+
+    Позволяет масштабировать фоновую обработку платежей независимо от HTTP-воркеров.
+    Останавливается по SIGINT/SIGTERM, дожидаясь завершения активных задач.
+    """
+    if STORAGE_BACKEND == "memory":
+        logger.error(
+            "STORAGE_BACKEND=memory: база в памяти не видна другим процессам, "
+            "задачи выполняются воркерами внутри приложения"
+        )
+        return
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await init_http_clients()
+    get_notification_dispatcher()
+    await start_job_workers()
+    logger.info("Воркер очереди задач запущен")
+    try:
+        await stop.wait()
+    finally:
+        await stop_job_workers()
+        await close_status_buffer()
+        await stop_notification_dispatcher()
+        await close_loyalty_batcher()
+        await close_retry_scheduler()
+        await close_http_clients()
+        logger.info("Воркер очереди задач остановлен")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""
+Сравнение двух результатов `benchmarks.load_test`.
+
+Сценарии сопоставляются по паре (API, интенсивность). Изменение метрики
+хуже порога (`--threshold`, относительное) считается регрессией, и команда
+завершается с кодом 1, что позволяет использовать её в CI.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+# Путь к метрике в сценарии и направление: True - чем больше, тем лучше.
+METRICS = (
+    (("requests", "throughput"), True),
+    (("requests", "error_rate"), False),
+    (("requests", "latency", "p50"), False),
+    (("requests", "latency", "p95"), False),
+    (("requests", "latency", "p99"), False),
+    (("terminal", "throughput"), True),
+    (("terminal", "latency", "p50"), False),
+    (("terminal", "latency", "p95"), False),
+    (("terminal", "latency", "p99"), False),
+)
+POOL_METRICS = (
+    ("checkout_wait_p95", False),
+    ("checkout_timeouts", False),
+    ("saturated_fraction", False),
+)
+
+
+def _get(data: dict, path: tuple[str, ...]):
+    for part in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def _paths(scenario: dict):
+    yield from METRICS
+    for pool in scenario.get("pools", {}):
+        for name, higher_is_better in POOL_METRICS:
+            yield ("pools", pool, name), higher_is_better
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[dict]:
+    """
+    ### Сравнивает сценарии двух прогонов.
+
+    ### Возвращает:
+    - Строки сравнения: сценарий, метрика, значения, относительное изменение
+      и признак регрессии.
+    """
+    base = {(s["api"], s["rate"]): s for s in baseline["scenarios"]}
+    rows = []
+    for scenario in candidate["scenarios"]:
+        key = (scenario["api"], scenario["rate"])
+        old = base.get(key)
+        if old is None:
+            continue
+        for path, higher_is_better in _paths(scenario):
+            before, after = _get(old, path), _get(scenario, path)
+            if before is None or after is None:
+                continue
+            if before == 0:
+                change = 0.0 if after == 0 else float("inf")
+            else:
+                change = (after - before) / abs(before)
+            worse = -change if higher_is_better else change
+            rows.append(
+                {
+                    "api": key[0],
+                    "rate": key[1],
+                    "metric": ".".join(path),
+                    "baseline": before,
+                    "candidate": after,
+                    "change": change,
+                    "regression": worse > threshold,
+                }
+            )
+    return rows
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.compare",
+        description="Сравнение двух результатов нагрузочного теста",
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="Допустимое относительное ухудшение метрики",
+    )
+    parser.add_argument("--json", action="store_true", help="Вывести сравнение в JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    with open(args.candidate, encoding="utf-8") as file:
+        candidate = json.load(file)
+    rows = compare(baseline, candidate, args.threshold)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        for row in rows:
+            mark = "РЕГРЕССИЯ" if row["regression"] else ""
+            print(
+                f"{row['api']:<3} {row['rate']:>8g} {row['metric']:<34} "
+                f"{row['baseline']:>12.6g} -> {row['candidate']:<12.6g} "
+                f"{row['change']:+8.1%} {mark}"
+            )
+    if any(row["regression"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,548 @@
+"""
+Нагрузочный тест `/api/v1/payments` и `/api/v2/payments`.
+
+Поднимает заглушки сервисов лояльности и уведомлений, приложение и (по
+желанию) PostgreSQL в Docker, затем для каждой пары (API, интенсивность)
+подаёт запросы по открытой модели: моменты отправки заранее вычисляются
+из пуассоновского потока с заданным seed и не зависят от того, как быстро
+отвечает сервис. Результат - JSON, который можно сравнить с другим прогоном
+(`python -m benchmarks.compare`).
+
+    python -m benchmarks.load_test --rates 20 50 100 --duration 30 --output run.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import AsyncIterator
+
+import httpx
+
+from app.config import (DATABASE_PASSWORD, DATABASE_PORT, DATABASE_USER,
+                        LOYALTY_PORT, NOTIFICATION_PORT,
+                        PAYMENT_LONG_POLL_MAX_WAIT, STORAGE_BACKEND)
+from benchmarks.report import (count_by, parse_metrics, pool_in_use,
+                               pool_names, summarize_latency, summarize_pool)
+
+TERMINAL_PENDING = "processing"
+READY_TIMEOUT = 60.0
+POSTGRES_CONTAINER = "payment-api-bench-pg"
+
+
+class PaymentResult:
+    """
+    ### Результат одного платежа в сценарии.
+
+    Задержки отсчитываются от запланированного момента отправки, а не от
+    фактического, поэтому очередь на стороне клиента не скрывает деградацию
+    сервиса.
+    """
+
+    __slots__ = ("latency", "outcome", "payment_id", "terminal_latency", "terminal_status")
+
+    def __init__(self):
+        self.latency: float | None = None
+        self.outcome: str = "pending"
+        self.payment_id: int | None = None
+        self.terminal_latency: float | None = None
+        self.terminal_status: str | None = None
+
+
+def arrival_schedule(rate: float, duration: float, seed: int) -> list[float]:
+    """
+    ### Моменты отправки запросов пуассоновского потока.
+
+    ### Параметры:
+    - **rate**: Средняя интенсивность, запросов в секунду.
+    - **duration**: Длительность сценария в секундах.
+    - **seed**: Зерно генератора, одинаковое зерно даёт одинаковое расписание.
+    """
+    rnd = random.Random(seed)
+    moments = []
+    moment = rnd.expovariate(rate)
+    while moment < duration:
+        moments.append(moment)
+        moment += rnd.expovariate(rate)
+    return moments
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, process=None) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + READY_TIMEOUT
+    while loop.time() < deadline:
+        if process is not None and process.returncode is not None:
+            raise RuntimeError(f"Процесс для {url} завершился с кодом {process.returncode}")
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} не ответил за {READY_TIMEOUT} с")
+
+
+@asynccontextmanager
+async def _process(*command: str, env: dict, log_path: str | None) -> AsyncIterator:
+    log = open(log_path, "ab") if log_path else subprocess.DEVNULL
+    process = await asyncio.create_subprocess_exec(
+        *command, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    try:
+        yield process
+    finally:
+        if process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), 10)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        if log_path:
+            log.close()
+
+
+async def _run_checked(*command: str, env: dict) -> None:
+    process = await asyncio.create_subprocess_exec(*command, env=env)
+    if await process.wait() != 0:
+        raise RuntimeError(f"Команда {' '.join(command)} завершилась с кодом {process.returncode}")
+
+
+@asynccontextmanager
+async def _postgres_container(image: str) -> AsyncIterator[None]:
+    """
+    ### Временный PostgreSQL в Docker с параметрами подключения из `app.config`.
+    """
+    await _run_checked(
+        "docker", "run", "-d", "--rm",
+        "--name", POSTGRES_CONTAINER,
+        "-p", f"{DATABASE_PORT}:5432",
+        "-e", f"POSTGRES_USER={DATABASE_USER}",
+        "-e", f"POSTGRES_PASSWORD={DATABASE_PASSWORD}",
+        "-e", "POSTGRES_DB=postgres",
+        image,
+        env=dict(os.environ),
+    )
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + READY_TIMEOUT
+        while True:
+            process = await asyncio.create_subprocess_exec(
+                "docker", "exec", POSTGRES_CONTAINER,
+                "pg_isready", "-U", DATABASE_USER, "-h", "127.0.0.1",
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            if await process.wait() == 0:
+                break
+            if loop.time() > deadline:
+                raise RuntimeError("PostgreSQL не запустился вовремя")
+            await asyncio.sleep(0.5)
+        yield
+    finally:
+        await _run_checked("docker", "stop", POSTGRES_CONTAINER, env=dict(os.environ))
+
+
+async def seed_users(count: int, balance: Decimal) -> list[int]:
+    """
+    ### Создаёт недостающих пользователей и выставляет всем одинаковый баланс.
+
+    Баланс восстанавливается перед каждым сценарием, чтобы прогоны не
+    зависели друг от друга и от предыдущих запусков. Журнал балансов
+    (`USER_BALANCE_MODE=ledger`) очищается: без проводок и снимков баланс
+    кошелька равен `users.balance`. Шардированные кошельки заново делятся
+    на то же число шардов, что и до сброса; полосы журнала удаляются вместе
+    с ним, поэтому в режиме журнала кошельки делятся по `WALLET_SHARDS`.
+    """
+    from sqlalchemy import delete, func, select, update
+
+    from app.config import USER_BALANCE_MODE, WALLET_SHARDS
+    from app.db.user_db import (BALANCE_LEDGER, BalanceSnapshot, LedgerEntry,
+                                User, WalletShard, async_session,
+                                set_wallet_shards, wallet_shard_count)
+
+    async with async_session() as session:
+        await session.execute(delete(LedgerEntry))
+        await session.execute(delete(BalanceSnapshot))
+        sharded = dict(
+            (
+                await session.execute(
+                    select(WalletShard.user_id, func.count()).group_by(
+                        WalletShard.user_id
+                    )
+                )
+            ).all()
+        )
+        await session.execute(delete(WalletShard))
+        user_ids = list((await session.execute(select(User.user_id))).scalars())
+        for _ in range(count - len(user_ids)):
+            session.add(User(balance=balance))
+        await session.execute(update(User).values(balance=balance))
+        if USER_BALANCE_MODE == BALANCE_LEDGER:
+            sharded.update(
+                (user_id, wallet_shard_count(user_id)) for user_id in WALLET_SHARDS
+            )
+        for user_id, shards in sharded.items():
+            await set_wallet_shards(user_id, shards, session)
+        await session.commit()
+        user_ids = list(
+            (await session.execute(select(User.user_id).order_by(User.user_id))).scalars()
+        )
+    return user_ids[:count]
+
+
+class Scenario:
+    """
+    ### Один прогон открытой нагрузки на версию API с заданной интенсивностью.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        base_url: str,
+        api: str,
+        rate: float,
+        args: argparse.Namespace,
+        user_ids: list[int],
+        seed: int,
+    ):
+        self.client = client
+        self.base_url = base_url
+        self.api = api
+        self.rate = rate
+        self.args = args
+        self.user_ids = user_ids
+        self.seed = seed
+        self.poll_errors = 0
+        self.pool_samples: dict[str, list[float]] = {}
+
+    async def _scrape(self) -> dict:
+        response = await self.client.get(f"{self.base_url}/metrics")
+        response.raise_for_status()
+        return parse_metrics(response.text)
+
+    async def _sample_pools(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            try:
+                samples = await self._scrape()
+            except httpx.HTTPError:
+                samples = {}
+            for name, value in pool_in_use(samples).items():
+                self.pool_samples.setdefault(name, []).append(value)
+            try:
+                await asyncio.wait_for(stop.wait(), self.args.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _wait_terminal(self, result: PaymentResult, scheduled: float) -> None:
+        url = f"{self.base_url}/api/{self.api}/payments/{result.payment_id}"
+        loop = asyncio.get_running_loop()
+        give_up = scheduled + self.args.terminal_timeout
+        while loop.time() < give_up:
+            params = {}
+            if self.api == "v2":
+                wait = min(give_up - loop.time(), PAYMENT_LONG_POLL_MAX_WAIT)
+                params["wait"] = round(max(wait, 0), 3)
+            try:
+                response = await self.client.get(url, params=params)
+                response.raise_for_status()
+                status = response.json()["status"]
+            except (httpx.HTTPError, ValueError, KeyError):
+                self.poll_errors += 1
+                await asyncio.sleep(self.args.poll_interval)
+                continue
+            if status != TERMINAL_PENDING:
+                result.terminal_status = status
+                result.terminal_latency = loop.time() - scheduled
+                return
+            if self.api != "v2":
+                await asyncio.sleep(self.args.poll_interval)
+        result.terminal_status = "timeout"
+
+    async def _send(self, result: PaymentResult, scheduled: float, body: dict) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            response = await self.client.post(
+                f"{self.base_url}/api/{self.api}/payments", json=body
+            )
+        except httpx.TimeoutException:
+            result.outcome = "timeout"
+            return
+        except httpx.HTTPError as e:
+            result.outcome = type(e).__name__
+            return
+        finally:
+            result.latency = loop.time() - scheduled
+        if response.status_code != 200:
+            result.outcome = str(response.status_code)
+            return
+        result.outcome = "ok"
+        data = response.json()
+        result.payment_id = data["payment_id"]
+        if data["status"] != TERMINAL_PENDING:
+            result.terminal_status = data["status"]
+            result.terminal_latency = result.latency
+            return
+        await self._wait_terminal(result, scheduled)
+
+    async def run(self) -> dict:
+        schedule = arrival_schedule(self.rate, self.args.duration, self.seed)
+        rnd = random.Random(self.seed + 1)
+        before = await self._scrape()
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(self._sample_pools(stop))
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results: list[PaymentResult] = []
+        tasks = []
+        for moment in schedule:
+            scheduled = start + moment
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            body = {
+                "user_id": rnd.choice(self.user_ids),
+                "amount": str(Decimal(rnd.randint(100, 5000)) / 100),
+                "currency": "USD",
+            }
+            result = PaymentResult()
+            results.append(result)
+            tasks.append(asyncio.create_task(self._send(result, scheduled, body)))
+        send_finished = loop.time()
+
+        if tasks:
+            _, unfinished = await asyncio.wait(tasks, timeout=self.args.drain_timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        elapsed = loop.time() - start
+
+        stop.set()
+        await sampler
+        after = await self._scrape()
+        return self._report(results, elapsed, send_finished - start, before, after)
+
+    def _report(
+        self,
+        results: list[PaymentResult],
+        elapsed: float,
+        send_elapsed: float,
+        before: dict,
+        after: dict,
+    ) -> dict:
+        outcomes = count_by(result.outcome for result in results)
+        ok = [result for result in results if result.outcome == "ok"]
+        errors = {name: count for name, count in outcomes.items() if name != "ok"}
+        terminal = [result for result in ok if result.terminal_latency is not None]
+        names = sorted(set(pool_names(before)) | set(pool_names(after)))
+        return {
+            "api": self.api,
+            "rate": self.rate,
+            "duration": self.args.duration,
+            "seed": self.seed,
+            "elapsed": round(elapsed, 3),
+            "requests": {
+                "scheduled": len(results),
+                "offered_rate": round(len(results) / send_elapsed, 3) if send_elapsed else None,
+                "ok": len(ok),
+                "errors": errors,
+                "error_rate": round(sum(errors.values()) / len(results), 4) if results else None,
+                "throughput": round(len(ok) / elapsed, 3) if elapsed else None,
+                "latency": summarize_latency(
+                    result.latency for result in ok if result.latency is not None
+                ),
+            },
+            "terminal": {
+                "tracked": len(ok),
+                "statuses": count_by(
+                    result.terminal_status or "unfinished" for result in ok
+                ),
+                "throughput": round(len(terminal) / elapsed, 3) if elapsed else None,
+                "latency": summarize_latency(
+                    result.terminal_latency for result in terminal
+                ),
+                "poll_errors": self.poll_errors,
+            },
+            "pools": {
+                name: summarize_pool(name, before, after, self.pool_samples.get(name, []))
+                for name in names
+            },
+        }
+
+
+def _service_env(overrides: list[str]) -> dict:
+    env = dict(os.environ)
+    for item in overrides:
+        name, _, value = item.partition("=")
+        env[name] = value
+    return env
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    """
+    ### Поднимает окружение и выполняет сценарии по всем API и интенсивностям.
+    """
+    if STORAGE_BACKEND == "memory":
+        # Пользователей создаёт процесс нагрузки, а база в памяти видна только
+        # процессу приложения.
+        raise SystemExit(
+            "STORAGE_BACKEND=memory не поддерживается: используйте sqlite "
+            "(например, с SQLITE_DIR=/dev/shm) или postgres"
+        )
+    env = _service_env(args.env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    log_dir = args.service_logs
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    def log_path(name: str) -> str | None:
+        return os.path.join(log_dir, f"{name}.log") if log_dir else None
+
+    limits = httpx.Limits(
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.max_connections,
+    )
+    timeout = httpx.Timeout(args.request_timeout, connect=args.request_timeout)
+    python = sys.executable
+    async with AsyncExitStack() as stack:
+        client = await stack.enter_async_context(
+            httpx.AsyncClient(limits=limits, timeout=timeout)
+        )
+        if args.postgres_image:
+            await stack.enter_async_context(_postgres_container(args.postgres_image))
+        await _run_checked(python, "-m", "app.utils.db.init", env=env)
+
+        for name, module, port in (
+            ("loyalty", "app.services.loyalty:app", LOYALTY_PORT),
+            ("notification", "app.services.notification:app", NOTIFICATION_PORT),
+        ):
+            process = await stack.enter_async_context(
+                _process(
+                    python, "-m", "uvicorn", module,
+                    "--host", "127.0.0.1", "--port", str(port),
+                    "--log-level", "warning",
+                    env=env,
+                    log_path=log_path(name),
+                )
+            )
+            await _wait_ready(client, f"http://127.0.0.1:{port}/docs", process)
+
+        # Метрики пулов собираются в процессе, поэтому приложение запускается
+        # одним воркером: иначе /metrics отражал бы случайный из них.
+        process = await stack.enter_async_context(
+            _process(
+                python, "-m", "uvicorn", "app.main:app",
+                "--host", "127.0.0.1", "--port", str(args.port),
+                "--log-level", "warning",
+                env=env,
+                log_path=log_path("app"),
+            )
+        )
+        await _wait_ready(client, f"{base_url}/metrics", process)
+
+        scenarios = []
+        for api in args.apis:
+            for index, rate in enumerate(args.rates):
+                user_ids = await seed_users(args.users, Decimal(args.balance))
+                seed = args.seed + index
+                print(f"Сценарий {api} {rate} запр/с, {args.duration} с", file=sys.stderr)
+                scenario = Scenario(client, base_url, api, rate, args, user_ids, seed)
+                scenarios.append(await scenario.run())
+                await asyncio.sleep(args.cooldown)
+
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "duration": args.duration,
+            "rates": args.rates,
+            "apis": args.apis,
+            "users": args.users,
+            "env": dict(item.partition("=")[::2] for item in args.env),
+        },
+        "scenarios": scenarios,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load_test",
+        description="Нагрузочный тест /api/v1/payments и /api/v2/payments",
+    )
+    parser.add_argument("--apis", nargs="+", choices=("v1", "v2"), default=["v1", "v2"])
+    parser.add_argument(
+        "--rates", nargs="+", type=float, default=[10.0, 50.0],
+        help="Интенсивности открытой нагрузки, запросов в секунду",
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность сценария, с")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно расписания и тел запросов")
+    parser.add_argument("--users", type=int, default=50, help="Число пользователей в нагрузке")
+    parser.add_argument("--balance", default="1000000", help="Баланс пользователей перед сценарием")
+    parser.add_argument("--port", type=int, default=8000, help="Порт приложения")
+    parser.add_argument("--request-timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--terminal-timeout", type=float, default=120.0,
+        help="Сколько ждать итогового статуса платежа от момента отправки, с",
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=0.25,
+        help="Интервал опроса статуса v1 (v2 использует long-poll), с",
+    )
+    parser.add_argument(
+        "--drain-timeout", type=float, default=180.0,
+        help="Сколько ждать незавершённые платежи после окончания отправки, с",
+    )
+    parser.add_argument("--cooldown", type=float, default=5.0, help="Пауза между сценариями, с")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Период снимков /metrics, с")
+    parser.add_argument("--max-connections", type=int, default=1000, help="Соединения клиента нагрузки")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="NAME=VALUE",
+        help="Переменная окружения для приложения и заглушек (можно повторять)",
+    )
+    parser.add_argument(
+        "--postgres-image", metavar="IMAGE",
+        help="Запустить временный PostgreSQL в Docker из этого образа (например, postgres:15)",
+    )
+    parser.add_argument("--service-logs", metavar="DIR", help="Каталог для вывода процессов")
+    parser.add_argument("--output", help="Файл для JSON-результата (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    started = time.perf_counter()
+    result = asyncio.run(run_benchmark(args))
+    result["meta"]["wall_time"] = round(time.perf_counter() - started, 3)
+    data = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(data + "\n")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
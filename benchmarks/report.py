@@ -0,0 +1,161 @@
+import math
+import re
+from collections import Counter
+from typing import Iterable
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$")
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+PoolSamples = dict[tuple[str, tuple[tuple[str, str], ...]], float]
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """
+    ### Перцентиль по ближайшему рангу.
+
+    ### Параметры:
+    - **values**: Отсортированные значения.
+    - **q**: Доля от 0 до 1.
+    """
+    if not values:
+        return None
+    rank = max(math.ceil(q * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize_latency(values: Iterable[float]) -> dict:
+    """
+    ### Сводка задержек в секундах: p50/p95/p99, среднее и максимум.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "count": len(ordered),
+        "p50": round(percentile(ordered, 0.50), 6),
+        "p95": round(percentile(ordered, 0.95), 6),
+        "p99": round(percentile(ordered, 0.99), 6),
+        "mean": round(sum(ordered) / len(ordered), 6),
+        "max": round(ordered[-1], 6),
+    }
+
+
+def count_by(values: Iterable[str]) -> dict[str, int]:
+    return dict(sorted(Counter(values).items()))
+
+
+def parse_metrics(text: str) -> PoolSamples:
+    """
+    ### Разбирает текстовый формат Prometheus в словарь `(имя, метки) -> значение`.
+    """
+    samples: PoolSamples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        key = tuple(sorted(_LABEL.findall(labels or "")))
+        samples[(name, key)] = float(value)
+    return samples
+
+
+def _series(samples: PoolSamples, name: str, **labels: str) -> dict[tuple, float]:
+    wanted = set(labels.items())
+    return {
+        key: value
+        for (metric, key), value in samples.items()
+        if metric == name and wanted <= set(key)
+    }
+
+
+def _value(samples: PoolSamples, name: str, **labels: str) -> float:
+    return sum(_series(samples, name, **labels).values())
+
+
+def _histogram_quantile(buckets: list[tuple[float, float]], q: float) -> float | None:
+    """
+    ### Оценка квантиля по накопленным корзинам гистограммы, как в Prometheus.
+    """
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    target = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= target:
+            if bound == math.inf:
+                return lower_bound
+            if count == lower_count:
+                return bound
+            fraction = (target - lower_count) / (count - lower_count)
+            return lower_bound + (bound - lower_bound) * fraction
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def pool_names(samples: PoolSamples) -> list[str]:
+    return sorted(
+        dict(key)["pool"]
+        for (metric, key) in samples
+        if metric == "db_pool_size" and "pool" in dict(key)
+    )
+
+
+def summarize_pool(
+    name: str,
+    before: PoolSamples,
+    after: PoolSamples,
+    in_use: list[float],
+) -> dict:
+    """
+    ### Насыщение пула соединений за время сценария.
+
+    Ожидание соединения считается по разнице гистограммы
+    `db_pool_checkout_wait_seconds` между началом и концом сценария,
+    занятость - по периодическим снимкам `db_pool_connections_in_use`.
+
+    ### Параметры:
+    - **name**: Имя пула (`payment`, `user`).
+    - **before**: Метрики перед сценарием.
+    - **after**: Метрики после сценария.
+    - **in_use**: Снимки числа выданных соединений.
+    """
+    size = _value(after, "db_pool_size", pool=name)
+    wait_name = "db_pool_checkout_wait_seconds"
+    checkouts = _value(after, f"{wait_name}_count", pool=name) - _value(
+        before, f"{wait_name}_count", pool=name
+    )
+    wait_total = _value(after, f"{wait_name}_sum", pool=name) - _value(
+        before, f"{wait_name}_sum", pool=name
+    )
+    buckets = []
+    old = _series(before, f"{wait_name}_bucket", pool=name)
+    for key, value in _series(after, f"{wait_name}_bucket", pool=name).items():
+        bound = float(dict(key)["le"])
+        buckets.append((bound, value - old.get(key, 0.0)))
+    buckets.sort()
+    timeouts = _value(after, "db_pool_checkout_timeouts_total", pool=name) - _value(
+        before, "db_pool_checkout_timeouts_total", pool=name
+    )
+    saturated = sum(1 for value in in_use if size and value >= size)
+    p95 = _histogram_quantile(buckets, 0.95)
+    p99 = _histogram_quantile(buckets, 0.99)
+    return {
+        "size": size,
+        "max_in_use": max(in_use, default=None),
+        "mean_in_use": round(sum(in_use) / len(in_use), 3) if in_use else None,
+        "saturated_fraction": round(saturated / len(in_use), 4) if in_use else None,
+        "checkouts": checkouts,
+        "checkout_wait_mean": round(wait_total / checkouts, 6) if checkouts else None,
+        "checkout_wait_p95": round(p95, 6) if p95 is not None else None,
+        "checkout_wait_p99": round(p99, 6) if p99 is not None else None,
+        "checkout_timeouts": timeouts,
+    }
+
+
+def pool_in_use(samples: PoolSamples) -> dict[str, float]:
+    return {
+        name: _value(samples, "db_pool_connections_in_use", pool=name)
+        for name in pool_names(samples)
+    }